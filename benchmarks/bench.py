@@ -0,0 +1,234 @@
+"""
+Benchmark the conversion pipeline on synthetic corpora.
+
+    python benchmarks/bench.py                        # all shapes, default sizes
+    python benchmarks/bench.py --shapes small,images --scale 0.25 --jobs 2
+    python benchmarks/bench.py --compare benchmarks/results/previous.json
+
+For each corpus shape it measures, through `run_conversion_command`:
+  cold    empty render cache, no renderer running (includes Node + Chromium startup)
+  warm    empty render cache, renderers already running
+  cached  every document restored from the render cache
+and the same cold/cached pair through the `md_to_pdf.py` CLI in a subprocess.
+It also times renderer startup and samples the peak RSS of all child processes
+(Node, Chromium and its helpers) from /proc.
+
+Runs offline on Linux with the local `node_modules` renderer (`npm install`).
+Results go to a JSON file so runs can be compared over time.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import statistics
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.corpus import SHAPES, generate
+from modules.renderer import RenderDaemon, daemon_available, get_pool
+from modules.cache import engine_version
+from modules.system import available_memory_mb, default_concurrency, descendant_pids, rss_mb
+
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+class PeakRSS:
+    """Samples the summed RSS of this process's descendants until stopped."""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, rss_mb(descendant_pids()))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def run_stats(wall, results, peak_mb):
+    """Summary of one timed run; per-document latency comes from the renderer's own timings."""
+    rendered = [r["ms"] for r in results if r["ok"] and not r["cached"]]
+    return {
+        "wall_s": round(wall, 3),
+        "docs": len(results),
+        "docs_per_sec": round(len(results) / wall, 2) if wall else 0,
+        "rendered": len(rendered),
+        "cached": sum(1 for r in results if r["cached"]),
+        "failed": sum(1 for r in results if not r["ok"]),
+        "latency_ms": {"p50": percentile(rendered, 50), "p95": percentile(rendered, 95),
+                       "max": max(rendered, default=0)},
+        "peak_rss_mb": round(peak_mb, 1),
+    }
+
+def clear_render_cache():
+    from modules.utils import get_fixed_temp_dir
+    shutil.rmtree(os.path.join(get_fixed_temp_dir(), "store"), ignore_errors=True)
+
+def measure_startup(runs=3):
+    """Wall time to a ready renderer, and Chromium launch time reported by the worker."""
+    walls, launches, rss = [], [], []
+    for _ in range(runs):
+        daemon = RenderDaemon()
+        started = time.perf_counter()
+        daemon.start()
+        walls.append((time.perf_counter() - started) * 1000)
+        launches.append(daemon.info.get("launch_ms", 0))
+        rss.append(rss_mb([daemon.proc.pid] + descendant_pids(daemon.proc.pid)))
+        daemon.stop()
+    return {"ready_ms": round(statistics.median(walls)), "chromium_launch_ms": round(statistics.median(launches)),
+            "idle_rss_mb": round(statistics.median(rss), 1), "runs": runs}
+
+def bench_pipeline(files, jobs):
+    from modules.utils import run_conversion_command
+
+    def timed():
+        with PeakRSS() as sampler:
+            started = time.perf_counter()
+            _, _, _, _, _, results = run_conversion_command(files, concurrency=jobs)
+            wall = time.perf_counter() - started
+        return run_stats(wall, results, sampler.peak_mb)
+
+    pool = get_pool()
+    pool.shrink(0)
+    clear_render_cache()
+    cold = timed()
+    clear_render_cache()
+    warm = timed()
+    cached = timed()
+    pool.shrink(0)
+    return {"cold": cold, "warm": warm, "cached": cached}
+
+def bench_cli(folder, jobs):
+    """`md_to_pdf.py` in a subprocess: a fresh interpreter and renderer every run."""
+    def timed():
+        summary = os.path.join(folder, "cli_summary.json")
+        with PeakRSS() as sampler:
+            started = time.perf_counter()
+            proc = subprocess.run([sys.executable, os.path.join(ROOT_DIR, "md_to_pdf.py"), folder,
+                                   "-q", "-j", str(jobs), "--json", summary], capture_output=True, text=True)
+            wall = time.perf_counter() - started
+        with open(summary) as f:
+            results = json.load(f)["files"]
+        return dict(run_stats(wall, results, sampler.peak_mb), exit_code=proc.returncode)
+
+    clear_render_cache()
+    cold = timed()
+    cached = timed()
+    return {"cold": cold, "cached": cached}
+
+def host_info():
+    try:
+        node = subprocess.run(["node", "--version"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        node = None
+    return {"platform": platform.platform(), "python": platform.python_version(), "node": node,
+            "engine": engine_version(), "cpus": os.cpu_count(), "mem_available_mb": available_memory_mb()}
+
+def compare(current, previous_path):
+    """Print docs/sec changes against an earlier results file."""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous_path} ({previous.get('timestamp', '?')}):")
+    for shape, runs in current["corpora"].items():
+        before = previous.get("corpora", {}).get(shape)
+        if not before:
+            continue
+        for driver in ("pipeline", "cli"):
+            for mode, stats in runs.get(driver, {}).items():
+                old = before.get(driver, {}).get(mode)
+                if old and old["docs_per_sec"]:
+                    change = (stats["docs_per_sec"] / old["docs_per_sec"] - 1) * 100
+                    print(f"  {shape:8} {driver:8} {mode:6} {old['docs_per_sec']:>8} -> {stats['docs_per_sec']:>8} docs/s ({change:+.1f}%)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark markdown-to-PDF conversion on synthetic corpora.")
+    parser.add_argument("--shapes", default=",".join(SHAPES),
+                        help=f"Comma-separated corpus shapes: {', '.join(f'{k} ({v[2]})' for k, v in SHAPES.items())}")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the number of files per corpus")
+    parser.add_argument("--size-kb", type=float, default=None, help="Override the approximate size of each file")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Parallel renderers (default: as the app)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-cli", action="store_true", help="Only benchmark run_conversion_command")
+    parser.add_argument("--workdir", default=None, help="Where corpora and the render cache go (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep the work directory")
+    parser.add_argument("-o", "--output", default=None, help="Results file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--compare", metavar="FILE", help="Earlier results file to compare throughput with")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    shapes = [s.strip() for s in args.shapes.split(",") if s.strip()]
+    unknown = [s for s in shapes if s not in SHAPES]
+    if unknown:
+        sys.exit(f"Unknown shape(s): {', '.join(unknown)}")
+    if not daemon_available():
+        sys.exit("The benchmark needs node and a local md-to-pdf install (run `npm install` in the repo root).")
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="md2pdf-bench-"))
+    # Private render cache: cold runs must not hit the app's cache (the CLI child inherits TMPDIR)
+    cache_root = os.path.join(workdir, "tmp")
+    os.makedirs(cache_root, exist_ok=True)
+    os.environ["TMPDIR"] = cache_root
+    tempfile.tempdir = cache_root
+    jobs = args.jobs or default_concurrency()
+
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": host_info(),
+              "config": {"shapes": shapes, "scale": args.scale, "size_kb": args.size_kb, "jobs": jobs, "seed": args.seed},
+              "corpora": {}}
+    try:
+        print(f"[BENCH] Work dir: {workdir} · {jobs} renderer(s)")
+        report["startup"] = measure_startup()
+        print(f"[BENCH] Renderer ready in {report['startup']['ready_ms']} ms "
+              f"(Chromium launch {report['startup']['chromium_launch_ms']} ms)")
+
+        for shape in shapes:
+            count = max(1, round(SHAPES[shape][0] * args.scale))
+            folder = os.path.join(workdir, shape)
+            files = generate(shape, folder, count=count, size_kb=args.size_kb, seed=args.seed)
+            size = sum(os.path.getsize(f) for f in files)
+            entry = {"files": len(files), "markdown_bytes": size}
+            entry["pipeline"] = bench_pipeline(files, jobs)
+            if not args.skip_cli:
+                entry["cli"] = bench_cli(folder, jobs)
+            report["corpora"][shape] = entry
+
+            line = " · ".join(f"{mode} {stats['wall_s']}s ({stats['docs_per_sec']} docs/s)"
+                              for mode, stats in entry["pipeline"].items())
+            print(f"[BENCH] {shape:8} {len(files):>4} files, {size // 1024} KB: {line}, "
+                  f"peak RSS {entry['pipeline']['warm']['peak_rss_mb']} MB")
+    finally:
+        get_pool().stop()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Results written to {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == "__main__":
+    main()
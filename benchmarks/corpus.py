@@ -0,0 +1,103 @@
+"""
+Synthetic markdown corpora for the benchmarks.
+
+Every shape is deterministic for a given seed, needs no network and writes
+plain files, so the same corpus can be regenerated on any machine.
+"""
+import os
+import random
+import struct
+import zlib
+
+WORDS = ("render pipeline chromium markdown batch cache worker latency table image "
+         "code document page layout font stylesheet throughput memory queue").split()
+
+# name -> (default file count, approximate kilobytes per file, description)
+SHAPES = {
+    "small": (200, 2, "many small notes"),
+    "huge": (3, 1500, "a few very long documents"),
+    "images": (20, 4, "documents with many local PNG images"),
+    "tables": (20, 200, "large tables"),
+    "code": (20, 200, "many highlighted code blocks"),
+}
+
+def _sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+def _paragraphs(rng, size):
+    out, length = [], 0
+    while length < size:
+        para = " ".join(_sentence(rng) for _ in range(5))
+        out.append(para)
+        length += len(para) + 2
+    return out
+
+def write_png(path, width, height, rng):
+    """Noise PNG (hard to compress, like a photo) written with zlib only."""
+    rows = b"".join(b"\x00" + rng.getrandbits(width * 24).to_bytes(width * 3, "little") for _ in range(height))
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows, 6)))
+        f.write(chunk(b"IEND", b""))
+
+def _small(rng, index, size, folder):
+    body = "\n\n".join(_paragraphs(rng, size))
+    return f"# Note {index}\n\n{body}\n\n- {_sentence(rng, 4)}\n- {_sentence(rng, 4)}\n"
+
+def _huge(rng, index, size, folder):
+    parts, length, section = [f"# Long document {index}"], 0, 0
+    while length < size:
+        section += 1
+        text = "\n\n".join(_paragraphs(rng, 4000))
+        parts.append(f"## Section {section}\n\n{text}")
+        length += len(text)
+    return "\n\n".join(parts) + "\n"
+
+def _images(rng, index, size, folder, per_doc=12):
+    os.makedirs(os.path.join(folder, "img"), exist_ok=True)
+    parts = [f"# Gallery {index}"]
+    for i in range(per_doc):
+        name = f"img/d{index}_{i}.png"
+        write_png(os.path.join(folder, name), 320, 200, rng)
+        parts.append(f"{_sentence(rng)}\n\n![figure {i}]({name})")
+    return "\n\n".join(parts) + "\n"
+
+def _tables(rng, index, size, folder):
+    header = "| " + " | ".join(f"Col {c}" for c in range(6)) + " |\n|" + "---|" * 6
+    rows, length = [], 0
+    while length < size:
+        row = "| " + " | ".join(rng.choice(WORDS) if c % 2 else str(rng.randint(0, 99999)) for c in range(6)) + " |"
+        rows.append(row)
+        length += len(row) + 1
+    return f"# Tables {index}\n\n{header}\n" + "\n".join(rows) + "\n"
+
+def _code(rng, index, size, folder):
+    parts, length, block = [f"# Code {index}"], 0, 0
+    while length < size:
+        block += 1
+        lines = [f"def step_{block}_{n}(value):\n    return value * {rng.randint(2, 9)} + {n}  # {rng.choice(WORDS)}"
+                 for n in range(15)]
+        code = "\n\n".join(lines)
+        parts.append(f"{_sentence(rng)}\n\n```python\n{code}\n```")
+        length += len(code)
+    return "\n\n".join(parts) + "\n"
+
+BUILDERS = {"small": _small, "huge": _huge, "images": _images, "tables": _tables, "code": _code}
+
+def generate(shape, folder, count=None, size_kb=None, seed=0):
+    """Write a corpus of `shape` into `folder`; returns the markdown paths."""
+    default_count, default_kb, _ = SHAPES[shape]
+    count = count or default_count
+    size = int((size_kb or default_kb) * 1024)
+    rng = random.Random(f"{shape}-{seed}")
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(folder, f"{shape}_{index:04d}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(BUILDERS[shape](rng, index, size, folder))
+        paths.append(path)
+    return paths
@@ -1,34 +1,50 @@
 import os
 import sys
+import json
+import signal
+import argparse
+import threading
 import subprocess
 import glob
-import shutil
 import platform
+import time
 
-def check_dependencies():
+from modules.renderer import daemon_available, get_pool
+from modules.environment import get_environment
+from modules.file_index import DEFAULT_IGNORE_PATTERNS, FileIndex, IgnoreRules
+from modules.system import default_concurrency
+from modules.utils import run_conversion_command, get_dependency_index
+from modules.book import build_book, order_chapters
+from modules.batching import get_governor
+from modules.backends import CHOICES, get_router
+from modules.split import merge_available
+from modules.postprocess import DEFAULT_DPI, optimize_available
+from modules.offline import NETWORK_MODES
+
+def check_dependencies(log=print):
     """Check if Node.js/npx is installed."""
-    print("[INIT] Checking system requirements...")
+    log("[INIT] Checking system requirements...")
     
     # 1. Detect OS
     os_name = platform.system()
-    print(f"   -> Operating System: {os_name}")
+    log(f"   -> Operating System: {os_name}")
     
     # 2. Check Node.js / npx
-    # shutil.which works cross-platform to find executables
-    npx_path = shutil.which("npx")
+    # Looked up once per process (shutil.which, cross-platform)
+    npx_path = get_environment()["npx"]
     
     if npx_path:
-        print(f"   -> Node.js (npx) found: {npx_path}")
+        log(f"   -> Node.js (npx) found: {npx_path}")
         return True
     else:
-        print("\n[!] CRITICAL ERROR: Node.js is NOT installed or not in PATH.")
-        print("    To use this tool, you must install Node.js:")
+        log("\n[!] CRITICAL ERROR: Node.js is NOT installed or not in PATH.")
+        log("    To use this tool, you must install Node.js:")
         if os_name == "Windows":
-             print("    -> Download: https://nodejs.org/en/download/ (Select Windows Installer)")
+             log("    -> Download: https://nodejs.org/en/download/ (Select Windows Installer)")
         elif os_name == "Darwin": # macOS
-             print("    -> Run: brew install node")
+             log("    -> Run: brew install node")
         else: # Linux
-             print("    -> Run: sudo apt install nodejs npm")
+             log("    -> Run: sudo apt install nodejs npm")
         return False
 
 def get_valid_directory():
@@ -44,7 +60,311 @@ def get_valid_directory():
         else:
             print(f"[!] Path does not exist: {path}")
 
+def watch_folder(work_dir, quiet=False, **watch_options):
+    """
+    Re-convert markdown in `work_dir` whenever it or its images change (Ctrl+C to stop).
+    `watch_options` go to `start_watch` (ignore rules, concurrency, conversion options).
+    With `quiet`, only failures are printed.
+    """
+    from modules.watcher import start_watch, stop_watch
+
+    def report(run):
+        stamp = time.strftime("%H:%M:%S", time.localtime(run["time"]))
+        for r in run["results"]:
+            name = os.path.relpath(r["path"], work_dir)
+            if not r["ok"]:
+                print(f"  [{stamp}] [FAIL] {name}: {r['error']}", file=sys.stderr if quiet else sys.stdout)
+            elif quiet:
+                continue
+            elif r["cached"]:
+                print(f"  [{stamp}] [SAME] {name} (content unchanged)")
+            else:
+                print(f"  [{stamp}] [OK]   {name} ({r['ms']} ms)")
+
+    try:
+        start_watch(work_dir, on_result=report, **watch_options)
+    except RuntimeError as e:
+        print(f"[!] {e}")
+        return False
+    if not quiet:
+        print(f"\n[WATCH] Watching {work_dir} for changes... (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\n[WATCH] Stopped.")
+    finally:
+        stop_watch(work_dir)
+    return True
+
+def offer_watch(work_dir):
+    choice = input("\n[?] Watch this folder and re-convert on save? (y/N): ").strip().lower()
+    if choice == "y":
+        watch_folder(work_dir)
+
+# --- Headless mode -----------------------------------------------------------
+
+# Exit codes for scripts and CI
+EXIT_OK = 0           # every file converted (or restored from the cache)
+EXIT_FAILED = 1       # at least one file failed or an input path did not exist
+EXIT_USAGE = 2        # bad arguments or nothing to convert (argparse uses 2 as well)
+EXIT_NO_NODE = 3      # Node.js / npx not installed
+EXIT_INTERRUPTED = 130
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert Markdown files to PDF. Run without arguments for the interactive menu.",
+        epilog="Exit codes: 0 ok, 1 some files failed, 2 usage error / no input, 3 Node.js missing, 130 interrupted.")
+    parser.add_argument("paths", nargs="*", default=[],
+                        help="Markdown files, folders or glob patterns (quote globs; '**' spans folders). Default: current folder.")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="Also convert .md files in subfolders of folder arguments")
+    parser.add_argument("-e", "--exclude", action="append", default=[], metavar="PATTERN",
+                        help="gitignore-style pattern to skip (repeatable), e.g. -e drafts/ -e 'README.md'")
+    parser.add_argument("--no-gitignore", action="store_true",
+                        help="Do not apply .gitignore files found while scanning folders")
+    parser.add_argument("-j", "--jobs", type=int, default=None, metavar="N",
+                        help="Parallel renderers (default: from CPU cores and free memory, or MD2PDF_JOBS)")
+    parser.add_argument("--memory-limit", type=int, default=None, metavar="MB",
+                        help="Start renderers only while their measured memory fits under MB (default: 80%% of RAM/cgroup limit)")
+    parser.add_argument("--max-batch", type=int, default=None, metavar="N",
+                        help="At most N small files per renderer job (default: automatic)")
+    parser.add_argument("--backend", choices=CHOICES, default=None,
+                        help="Renderer: 'auto' sends plain documents to the in-process Python backend (if installed) "
+                             "and the rest to Chromium (default: auto, or MD2PDF_BACKEND)")
+    parser.add_argument("--timeout", type=float, default=None, metavar="SECONDS",
+                        help="Fail a single file after SECONDS of rendering (default: 120, or MD2PDF_TIMEOUT)")
+    parser.add_argument("--retries", type=int, default=None, metavar="N",
+                        help="Re-run at most N batches after a renderer crash to isolate the bad file (default: 10, 0 disables)")
+    parser.add_argument("--split-mb", type=float, default=None, metavar="MB",
+                        help="Render markdown files larger than MB as parts in parallel and merge the PDFs "
+                             "(needs pypdf; default: off, or MD2PDF_SPLIT_MB)")
+    parser.add_argument("--optimize", nargs="?", type=int, const=DEFAULT_DPI, default=None, metavar="DPI",
+                        help="Post-process new PDFs: share duplicate images and fonts, resample images to DPI "
+                             f"(default {DEFAULT_DPI}) and linearize (needs pikepdf; default: off, or MD2PDF_OPTIMIZE_DPI)")
+    parser.add_argument("--image-dpi", type=int, default=None, metavar="DPI",
+                        help="Render local images wider than the page at DPI from reduced, cached copies "
+                             "(needs Pillow; default: 300, or MD2PDF_ASSET_DPI; 0 renders the originals)")
+    parser.add_argument("--network", choices=NETWORK_MODES, default=None,
+                        help="Remote images, fonts and stylesheets: 'online' fetches them, 'cache' serves them from "
+                             "the fetch cache and stores new downloads, 'offline' blocks cache misses at once "
+                             "(default: online, or MD2PDF_NETWORK; cache dir: MD2PDF_FETCH_CACHE)")
+    parser.add_argument("--json", nargs="?", const="-", default=None, metavar="FILE",
+                        help="Write a JSON summary to FILE, or to stdout when no FILE is given")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only report failures")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and re-convert the folder whenever files change")
+    book = parser.add_argument_group("book mode", "Combine the selected files into one PDF with a table of contents")
+    book.add_argument("--book", metavar="OUTPUT",
+                      help="Write the combined book to OUTPUT (.pdf; the merged .md is kept next to it)")
+    book.add_argument("--title", help="Book title shown above the table of contents")
+    book.add_argument("--manifest", metavar="FILE",
+                      help="Chapter order: one path per line or SUMMARY.md-style links (default: natural path order)")
+    book.add_argument("--no-toc", action="store_true", help="Leave out the table of contents")
+    args = parser.parse_args(argv)
+    if not args.paths and not args.manifest:
+        args.paths = ["."]
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+def _markdown_in(folder, recursive, excludes, use_gitignore):
+    if recursive:
+        # Same walker as the Local Batch tab: ignored folders are never entered
+        index = FileIndex(folder, DEFAULT_IGNORE_PATTERNS + excludes, use_gitignore)
+        return [path for path, _ in index.snapshot()]
+    rules = IgnoreRules(excludes)
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                  if name.lower().endswith(".md") and not rules.ignored(name)
+                  and os.path.isfile(os.path.join(folder, name)))
+
+def collect_markdown(paths, recursive=False, excludes=(), use_gitignore=True):
+    """
+    Expand files, folders and glob patterns into absolute .md paths (argument order,
+    duplicates removed). Returns (files, missing) where `missing` lists arguments
+    that matched nothing.
+    """
+    excludes = list(excludes)
+    rules = IgnoreRules(excludes)
+    files, missing, seen = [], [], set()
+    for arg in paths:
+        if any(c in arg for c in "*?["):
+            matches = sorted(glob.glob(arg, recursive=True))
+        else:
+            matches = [arg] if os.path.exists(arg) else []
+        if not matches:
+            missing.append(arg)
+            continue
+        for match in matches:
+            if os.path.isdir(match):
+                found = _markdown_in(match, recursive, excludes, use_gitignore)
+            elif match.lower().endswith(".md"):
+                # Excludes apply to explicit files and glob matches too (relative to cwd)
+                rel = os.path.relpath(match).replace(os.sep, "/")
+                found = [] if rules.ignored(rel) else [match]
+            else:
+                found = []
+            for path in map(os.path.abspath, found):
+                if path not in seen:
+                    seen.add(path)
+                    files.append(path)
+    return files, missing
+
+def run_headless(args):
+    """Non-interactive conversion. Returns the process exit code."""
+    log = (lambda *a, **k: None) if args.quiet else (lambda *a, **k: print(*a, file=sys.stderr, **k))
+    err = lambda *a, **k: print(*a, file=sys.stderr, **k)
+
+    router = get_router()
+    router.configure(args.backend)
+    backend, python = router.choice(), router.get("python")
+    if backend == "python" and not python.available():
+        err("[!] The python backend needs the 'markdown' and 'weasyprint' packages.")
+        return EXIT_USAGE
+    if backend != "python" and not check_dependencies(log=log):
+        if backend == "chromium" or not python.available():
+            err("[!] Node.js (npx) is not installed or not in PATH.")
+            return EXIT_NO_NODE
+        err("[!] Node.js missing: only documents the python backend supports will convert.")
+    if args.optimize and not optimize_available():
+        err("[!] --optimize needs the 'pikepdf' package; PDFs will be kept as rendered.")
+    if args.split_mb and not merge_available():
+        err("[!] --split-mb needs the 'pypdf' package; large files will render in one piece.")
+
+    get_governor().configure(ceiling_mb=args.memory_limit, max_batch=args.max_batch)
+    if args.watch:
+        folder = args.paths[0] if args.paths else "."
+        if len(args.paths) > 1 or not os.path.isdir(folder):
+            err("[!] --watch takes a single folder.")
+            return EXIT_USAGE
+        if args.json or args.book:
+            # A watch never finishes, so there is no summary to write or single book to build
+            err("[!] --watch can't be combined with --json or --book.")
+            return EXIT_USAGE
+        # Watching always covers subfolders, so -r changes nothing here
+        watched = watch_folder(os.path.abspath(folder), quiet=args.quiet,
+                               patterns=DEFAULT_IGNORE_PATTERNS + args.exclude, use_gitignore=not args.no_gitignore,
+                               concurrency=args.jobs,
+                               options={"timeout": args.timeout, "retries": args.retries, "split": args.split_mb,
+                                        "optimize": args.optimize, "images": args.image_dpi, "network": args.network})
+        return EXIT_OK if watched else EXIT_USAGE
+
+    files, missing = collect_markdown(args.paths, args.recursive, args.exclude, not args.no_gitignore)
+    # References are followed within the working directory and the folders named on the command line
+    index = get_dependency_index()
+    index.add_root(os.getcwd())
+    for arg in args.paths:
+        if os.path.isdir(arg):
+            index.add_root(arg)
+    for arg in missing:
+        err(f"[!] No such file or no match: {arg}")
+    if args.book:
+        # All chapters go into one document, rendered in a single page load
+        try:
+            chapters = len(order_chapters(files, args.manifest))
+            files = [build_book(files, os.path.splitext(args.book)[0] + ".md", title=args.title,
+                                manifest=args.manifest, toc=not args.no_toc)]
+        except (OSError, ValueError) as e:
+            err(f"[!] Cannot build book: {e}")
+            write_summary(args.json, summary([], missing, 0, args.jobs, EXIT_USAGE))
+            return EXIT_USAGE
+        log(f"[BOOK] Combined {chapters} chapter(s) into {os.path.relpath(files[0])}")
+    if not files:
+        err("[!] No markdown (.md) files to convert.")
+        write_summary(args.json, summary([], missing, 0, args.jobs, EXIT_USAGE))
+        return EXIT_USAGE
+
+    jobs = args.jobs or default_concurrency()
+    log(f"[EXEC] Converting {len(files)} file(s) with up to {jobs} parallel renderer(s)...")
+
+    def report(event):
+        name = os.path.relpath(event["path"]) if "path" in event else ""
+        if event["event"] == "cached":
+            log(f"  [CACHE] {name}")
+        elif event["event"] == "finished":
+            log(f"  [OK]    {name} ({event['ms']} ms, {event['bytes'] // 1024} KB)")
+        elif event["event"] == "failed":
+            err(f"  [FAIL]  {name}: {event['error']}")
+        if event.get("blocked"):
+            for url in event["blocked"]:
+                err(f"  [BLOCKED] {name}: {url}")
+        if event["event"] == "optimized":
+            saved = event["before"] - event["after"]
+            log(f"  [OPT]   {name} ({event['before'] // 1024} KB -> {event['after'] // 1024} KB, "
+                f"-{100 * saved // max(1, event['before'])}%, {event['ms']} ms)")
+        elif event["event"] == "part":
+            log(f"  [PART]  {name} ({event['part']} of {event['parts']}, {event['ms']} ms{'' if event['ok'] else ', failed'})")
+        elif event["event"] == "retry":
+            log(f"  [RETRY] {name} (attempt {event['attempt'] + 1}): {event['error'].splitlines()[0]}")
+
+    # Ctrl+C cancels batches that haven't started, so the summary is still written;
+    # a second Ctrl+C aborts immediately.
+    cancel = threading.Event()
+    def on_interrupt(signum, frame):
+        if cancel.is_set():
+            raise KeyboardInterrupt
+        err("\n[!] Interrupted: finishing running batches (Ctrl+C again to abort)...")
+        cancel.set()
+    previous = signal.signal(signal.SIGINT, on_interrupt)
+
+    started = time.time()
+    try:
+        success, out, stderr, misses, hits, results = run_conversion_command(
+            files, concurrency=jobs, event_callback=report, cancel_event=cancel,
+            timeout=args.timeout, retries=args.retries, split=args.split_mb,
+            optimize=args.optimize, images=args.image_dpi, network=args.network)
+    finally:
+        signal.signal(signal.SIGINT, previous)
+    wall = time.time() - started
+
+    if cancel.is_set():
+        code = EXIT_INTERRUPTED
+    elif not success or missing or not all(r["ok"] for r in results):
+        code = EXIT_FAILED
+    else:
+        code = EXIT_OK
+
+    result = summary(results, missing, wall, jobs, code)
+    log(f"[DONE] {result['converted']} converted, {result['cached']} from cache, "
+        f"{result['failed']} failed in {wall:.1f}s ({result['docs_per_sec']} docs/s)")
+    write_summary(args.json, result)
+    return code
+
+def summary(results, missing, wall, jobs, code):
+    failures = [{"path": r["path"], "error": r["error"]} for r in results if not r["ok"]]
+    return {
+        "exit_code": code,
+        "ok": code == EXIT_OK,
+        "total": len(results),
+        "converted": sum(1 for r in results if r["ok"] and not r["cached"]),
+        "cached": sum(1 for r in results if r["cached"]),
+        "failed": len(failures),
+        "bytes_saved": sum(r.get("saved", 0) for r in results),
+        "blocked_urls": sorted({url for r in results for url in r.get("blocked", [])}),
+        "missing": missing,
+        "jobs": jobs,
+        "renderer": "worker" if daemon_available() else "cli",
+        "wall_ms": int(wall * 1000),
+        "docs_per_sec": round(len(results) / wall, 2) if wall else 0,
+        "files": results,
+        "failures": failures,
+    }
+
+def write_summary(target, result):
+    if target is None:
+        return
+    text = json.dumps(result, indent=2)
+    if target == "-":
+        print(text)
+    else:
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
 def main():
+    # Any argument switches to the scriptable mode; no arguments keeps the menu
+    if len(sys.argv) > 1:
+        sys.exit(run_headless(parse_args()))
+
     print("==================================================")
     print("   CROSS-PLATFORM MD TO PDF CONVERTER             ")
     print("==================================================")
@@ -96,7 +416,39 @@ def main():
         print("[!] No files selected.")
         return
 
-    # 4. Construct Command
+    # 4. Warm renderer (local node_modules install)
+    if daemon_available():
+        print(f"\n[EXEC] Rendering {len(selected_files)} file(s) with the local render worker...")
+        print("-" * 50)
+        def report(event):
+            name = os.path.basename(event["path"])
+            if event["event"] == "started":
+                print(f"  [..]   {name}")
+            elif event["event"] == "finished":
+                print(f"  [OK]   {name} ({event['ms']} ms, {event['bytes'] // 1024} KB)")
+            else:
+                print(f"  [FAIL] {name}: {event['error']}")
+
+        pool = get_pool()
+        try:
+            with pool.worker() as daemon:
+                results = daemon.render(selected_files, on_event=report)
+        except RuntimeError as e:
+            print(f"[!] {e}")
+            print("    Falling back to npx md-to-pdf.")
+        else:
+            failed = [r for r in results if not r["ok"]]
+            print("-" * 50)
+            if failed:
+                print(f"\n[ERROR] {len(failed)} file(s) failed to convert.")
+            else:
+                print("\n[SUCCESS] Conversion completed! Check your PDF files.")
+            offer_watch(os.getcwd())
+            return
+        finally:
+            pool.stop()
+
+    # 5. Construct Command
     # Quote filenames to handle spaces safely on all OSs
     quoted_files = [f'"{f}"' for f in selected_files]
     file_args = " ".join(quoted_files)
@@ -115,13 +467,14 @@ def main():
     print(f" > {command}")
     print("-" * 50)
 
-    # 5. Execute
+    # 6. Execute
     try:
         # shell=True is generally required for npx on Windows cmd, 
         # and helpful on Linux to expand args properly
         subprocess.run(command, shell=True, check=True)
         print("-" * 50)
         print("\n[SUCCESS] Conversion completed! Check your PDF files.")
+        offer_watch(os.getcwd())
     except subprocess.CalledProcessError as e:
         print(f"\n[ERROR] Command failed with exit code {e.returncode}.")
         print("Note: If 'npx' failed, try installing the tool globally: npm i -g md-to-pdf")
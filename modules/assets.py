@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it images are rendered as they are
+    Image = None
+
+ASSET_DPI = 300            # print resolution images are reduced to (MD2PDF_ASSET_DPI; 0 = off)
+ASSET_VERSION = 1          # bump when `AssetCache.prepare` output changes (part of the cache key)
+MIN_BYTES = 512 * 1024     # smaller images aren't worth a second copy
+# Widest an image can be drawn: A4 minus md-to-pdf's side margins (40 mm + 20 mm), in inches
+CONTENT_WIDTH_IN = (210 - 40 - 20) / 25.4
+IMAGE_TYPES = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+QUALITY = 90
+
+def asset_dpi(value=None):
+    """Resolution oversized images are reduced to (`value`, else env MD2PDF_ASSET_DPI; 0 = off)."""
+    if value is not None:
+        return value
+    override = os.environ.get("MD2PDF_ASSET_DPI", "")
+    return int(override) if override.isdigit() else ASSET_DPI
+
+def assets_available():
+    return Image is not None
+
+def asset_options(dpi):
+    """Cache key entry, so renders from reduced and original images are cached apart."""
+    return {"dpi": dpi, "version": ASSET_VERSION}
+
+class AssetCache:
+    """
+    Reduced copies of oversized images under `root/<2 hex>/<sha256>-<dpi><ext>`,
+    keyed by the content hash of the original. Renderers are handed these in
+    place of the originals (the markdown on disk is never changed), so a 20 MB
+    photo is decoded at print size, and repeated renders reuse the copy.
+    Images already small enough are remembered too and never reopened.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._skip = set()  # (digest, dpi) of images that don't need a copy
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, digest, dpi, ext):
+        return os.path.join(self.root, digest[:2], f"{digest}-{dpi}{ext}")
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def prepare(self, path, digest, dpi):
+        """Path of the reduced copy of image `path` (made on first use), or None to use the original."""
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in IMAGE_TYPES or (digest, dpi) in self._skip:
+            return None
+        out = self.path_for(digest, dpi, ext)
+        marker = out + ".skip"
+        with self._key_lock((digest, dpi)):
+            for existing in (out, marker):
+                if os.path.exists(existing):
+                    try:
+                        os.utime(existing)  # last use, for `prune`
+                    except OSError:
+                        pass
+                    if existing == marker:
+                        self._skip.add((digest, dpi))
+                        return None
+                    return out
+            try:
+                reduced = os.path.getsize(path) >= MIN_BYTES and self._reduce(path, out, dpi, IMAGE_TYPES[ext])
+            except Exception:
+                # Corrupt or unreadable images (Pillow raises more than OSError) render as they are
+                reduced = False
+            if not reduced:
+                os.makedirs(os.path.dirname(marker), exist_ok=True)
+                open(marker, "w").close()
+                self._skip.add((digest, dpi))
+                return None
+            return out
+
+    def _reduce(self, path, out, dpi, fmt):
+        """Write a copy no wider than the page at `dpi`; False if the original is already as small."""
+        max_width = round(CONTENT_WIDTH_IN * dpi)
+        with Image.open(path) as image:
+            if getattr(image, "is_animated", False):
+                return False
+            # Chromium honours EXIF orientation; the copy carries it in its pixels instead
+            image = ImageOps.exif_transpose(image)
+            if image.width <= max_width:
+                return False
+            size = (max_width, max(1, round(image.height * max_width / image.width)))
+            image = image.resize(size, Image.LANCZOS)
+            if fmt == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            tmp = f"{out}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if fmt == "PNG":
+                image.save(tmp, fmt, optimize=True)
+            else:
+                image.save(tmp, fmt, quality=QUALITY)
+        if os.path.getsize(tmp) >= os.path.getsize(path):
+            os.remove(tmp)
+            return False
+        os.replace(tmp, out)
+        return True
+
+    def substitutes(self, md_paths, index, dpi, on_error=None):
+        """
+        {original image: reduced copy} for the local images the documents reference.
+        An image that can't be prepared (e.g. the disk is full) keeps its original;
+        `on_error(path, exception)` hears about it.
+        """
+        found = {}
+        for md_path in md_paths:
+            for asset in index.assets(md_path):
+                if asset in found or os.path.splitext(asset)[1].lower() not in IMAGE_TYPES:
+                    continue
+                try:
+                    reduced = self.prepare(asset, index.digest(asset), dpi)
+                except Exception as e:
+                    if on_error:
+                        on_error(asset, e)
+                    continue
+                if reduced:
+                    found[asset] = reduced
+        return found
+
+    def prune(self, max_age_days):
+        """Remove copies not used for `max_age_days`. Returns (files, bytes) removed."""
+        if not max_age_days:
+            return 0, 0
+        cutoff = time.time() - max_age_days * 86400
+        files = freed = 0
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                    if st.st_mtime < cutoff:
+                        os.remove(path)
+                        files += 1
+                        freed += st.st_size
+                except OSError:
+                    continue
+        return files, freed
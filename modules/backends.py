@@ -0,0 +1,351 @@
+import os
+import re
+import glob
+import html
+import time
+import hashlib
+import functools
+import threading
+import multiprocessing
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from modules.deps import FRONT_MATTER, without_code
+from modules.offline import REMOTE_SCHEMES, FetchCache
+from modules.environment import ROOT_DIR, get_environment
+from modules.renderer import CRASH_ERROR, daemon_available, file_result, render_timeout
+
+BACKEND_ENV = "MD2PDF_BACKEND"  # auto | chromium | python
+CHOICES = ("auto", "chromium", "python")
+MAX_ROUTES = 50000  # remembered routing decisions
+
+# md-to-pdf's defaults: A4 with these margins, and its own markdown.css when installed
+MD_TO_PDF_CSS = os.path.join(ROOT_DIR, "node_modules", "md-to-pdf", "markdown.css")
+PAGE_CSS = "@page { size: A4; margin: 30mm 40mm 30mm 20mm; }"
+FALLBACK_CSS = """
+body { font-family: -apple-system, "Segoe UI", Helvetica, Arial, sans-serif; font-size: 11pt; line-height: 1.5; color: #24292e; }
+h1, h2 { border-bottom: 1px solid #eaecef; padding-bottom: .3em; }
+code, pre { font-family: "SFMono-Regular", Consolas, "Liberation Mono", Menlo, monospace; font-size: 85%; }
+code { background: #f6f8fa; padding: .2em .4em; border-radius: 3px; }
+pre { background: #f6f8fa; padding: 1em; border-radius: 3px; white-space: pre-wrap; }
+pre code { background: none; padding: 0; }
+table { border-collapse: collapse; }
+th, td { border: 1px solid #dfe2e5; padding: 6px 13px; }
+tr:nth-child(2n) { background: #f6f8fa; }
+blockquote { margin: 0; padding: 0 1em; color: #6a737d; border-left: .25em solid #dfe2e5; }
+img { max-width: 100%; }
+"""
+
+# Front matter keys md-to-pdf reads as render configuration
+CONFIG_KEY = re.compile(r"^(stylesheet|css|body_class|highlight_style|marked_options|marked_extensions|pdf_options|"
+                        r"launch_options|page_media_type|md_file_encoding|stylesheet_encoding|as_html|document_title|"
+                        r"script|basedir|dest)\s*:", re.MULTILINE)
+# Markup that needs a browser (scripts, embedded media, SVG/MathML) or GFM syntax Python-Markdown lacks
+NEEDS_BROWSER = [
+    ("raw HTML needing a browser", re.compile(r"<(script|iframe|canvas|video|audio|object|embed|svg|math|form|input|link)\b", re.IGNORECASE)),
+    ("strikethrough", re.compile(r"(?<!~)~~(?!~)")),
+    ("task lists", re.compile(r"^\s*[-*+]\s+\[[ xX]\]\s", re.MULTILINE)),
+]
+# Where Python-Markdown's output differs from marked (GFM), checked outside code
+RENDERS_DIFFERENTLY = [
+    # marked nests list items indented by 2 spaces; Python-Markdown needs 4 and flattens them
+    ("lists nested with less than 4 spaces", re.compile(r"^ {1,3}(?:[-*+]|\d+[.)])[ \t]", re.MULTILINE)),
+    # GFM autolinks bare URLs; Python-Markdown only links <https://...>
+    ("bare URLs", re.compile(r"(?<![(<\"'=\w/])(?:https?://|www\.)\S", re.IGNORECASE)),
+    # Block-level HTML and markdown mixed in it are parsed differently
+    ("raw HTML", re.compile(r"</?[a-zA-Z][\w-]*(?:\s[^>]*)?/?>")),
+]
+# Fences inside list items or blockquotes aren't fenced code to Python-Markdown (checked with the code)
+NESTED_FENCE = re.compile(r"^(?:[ \t]+|>[ \t]*)(?:```|~~~)", re.MULTILINE)
+REFERENCE_DEFINITION = re.compile(r"^ {0,3}\[[^\]]+\]:.*$", re.MULTILINE)
+CODE_FENCE_LANG = re.compile(r"^\s*(```|~~~)\s*[\w+#.-]+", re.MULTILINE)
+
+@functools.lru_cache(maxsize=1)
+def _python_engine():
+    """(markdown, weasyprint, pygments available) or None when the Python backend can't run."""
+    try:
+        import markdown
+        import weasyprint
+    except (ImportError, OSError):  # WeasyPrint also needs the Pango libraries
+        return None
+    try:
+        import pygments  # noqa: F401  (code highlighting via codehilite)
+        highlight = True
+    except ImportError:
+        highlight = False
+    return markdown, weasyprint, highlight
+
+@functools.lru_cache(maxsize=1)
+def _stylesheet():
+    try:
+        with open(MD_TO_PDF_CSS, encoding="utf-8") as f:
+            css = f.read()
+    except OSError:
+        css = FALLBACK_CSS
+    return PAGE_CSS + "\n" + css
+
+class Backend:
+    """
+    A way to turn markdown files into PDFs next to them. `run_conversion_command`
+    routes every document to the cheapest available backend that `supports` it.
+    """
+    name = ""
+    cost = 0  # relative cost per document; lower wins
+
+    def available(self):
+        return True
+
+    def supports(self, text):
+        """Reasons this backend can't render `text` faithfully (empty if it can)."""
+        return []
+
+    def options(self, base):
+        """Render options for the cache key (`base` is `options_fingerprint()`)."""
+        return base
+
+    def convert_batch(self, batch, on_event=None, timeout=None, assets=None, network=None):
+        """
+        Same contract as `modules.utils.convert_batch`: (ok, stdout, stderr, results).
+        `assets` maps original image paths to reduced copies to render instead;
+        `network` ({"mode", "cache"}) is the remote resource policy of modules/offline.py.
+        """
+        raise NotImplementedError
+
+class ChromiumBackend(Backend):
+    """md-to-pdf in Chromium: the warm render workers, or the CLI when they can't run."""
+    name = "chromium"
+    cost = 10
+
+    def available(self):
+        return bool(get_environment()["npx"] or daemon_available())
+
+    def convert_batch(self, batch, on_event=None, timeout=None, assets=None, network=None):
+        from modules.utils import convert_batch  # utils imports this module
+        return convert_batch(batch, daemon_available(), on_event, timeout, assets, network)
+
+class PythonBackend(Backend):
+    """
+    Python-Markdown to HTML, then WeasyPrint to PDF, in this process: no Node or
+    Chromium. Plain prose, tables, images and (with Pygments) highlighted code.
+    """
+    name = "python"
+    cost = 1
+
+    def available(self):
+        return _python_engine() is not None
+
+    def supports(self, text):
+        reasons = []
+        front = FRONT_MATTER.match(text)
+        if front and CONFIG_KEY.search(front.group(1)):
+            reasons.append("md-to-pdf front matter options")
+        body = text[front.end():] if front else text
+        reasons += [reason for reason, pattern in NEEDS_BROWSER if pattern.search(body)]
+        prose = REFERENCE_DEFINITION.sub("", without_code(body))
+        reasons += [reason for reason, pattern in RENDERS_DIFFERENTLY if pattern.search(prose)]
+        if NESTED_FENCE.search(body):
+            reasons.append("fenced code in lists or quotes")
+        if CODE_FENCE_LANG.search(body) and not (self.available() and _python_engine()[2]):
+            reasons.append("highlighted code (needs Pygments)")
+        return reasons
+
+    def options(self, base):
+        markdown, weasyprint, highlight = _python_engine()
+        return {"backend": self.name, "markdown": markdown.__version__, "weasyprint": weasyprint.__version__,
+                "highlight": highlight, "css": hashlib.sha256(_stylesheet().encode()).hexdigest()[:16]}
+
+    def to_html(self, text, title):
+        markdown, _, highlight = _python_engine()
+        front = FRONT_MATTER.match(text)
+        if front:
+            text = text[front.end():]
+        extensions = ["extra", "sane_lists", "toc"] + (["codehilite"] if highlight else [])
+        body = markdown.Markdown(extensions=extensions, extension_configs={"codehilite": {"noclasses": True}}).convert(text)
+        return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+                f"<style>{_stylesheet()}</style></head><body>{body}</body></html>")
+
+    def convert_batch(self, batch, on_event=None, timeout=None, assets=None, network=None):
+        emit = on_event or (lambda event: None)
+        timeout = timeout or render_timeout()
+        results = []
+        for md_path in batch:
+            emit({"event": "started", "path": md_path})
+            started = time.perf_counter()
+            # Local files are read from the same folder Chromium's worker would serve
+            cwd = os.getcwd()
+            basedir = cwd if md_path.startswith(cwd + os.sep) else os.path.dirname(md_path)
+            outcome = _render_isolated(md_path, basedir, assets or {}, network, timeout)
+            ms = round((time.perf_counter() - started) * 1000)
+            if "error" in outcome:
+                r = file_result(md_path, error=outcome["error"], ms=ms)
+            else:
+                pdf_path = os.path.splitext(md_path)[0] + ".pdf"
+                r = file_result(md_path, pdf=pdf_path, ms=ms, size=os.path.getsize(pdf_path))
+            if outcome.get("blocked"):
+                r["blocked"] = outcome["blocked"]
+            results.append(r)
+            emit(dict(r, event="finished" if r["ok"] else "failed", stages=outcome.get("stages", {}), backend=self.name))
+        out = "".join(f"{r['pdf']}\n" for r in results if r["ok"])
+        err = "".join(f"{r['path']}: {r['error']}\n" for r in results if not r["ok"])
+        return all(r["ok"] for r in results), out, err, results
+
+def _inside(path, folder):
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+def _url_fetcher(weasyprint, basedir, assets, network, blocked):
+    """
+    WeasyPrint url_fetcher: local files only from inside `basedir` (reduced copies
+    from `assets` in place of the originals), remote ones per the network policy.
+    """
+    substitutes = {Path(original).as_uri(): Path(copy).as_uri() for original, copy in assets.items()}
+    mode = (network or {}).get("mode", "online")
+    cache = FetchCache(network["cache"]) if mode != "online" else None
+    basedir = os.path.realpath(basedir)
+
+    def fetch(url):
+        if url.startswith("file:"):
+            path = os.path.realpath(url2pathname(urlparse(url).path))
+            if not _inside(path, basedir):
+                raise ValueError(f"Outside the document's folder: {url}")
+            return weasyprint.default_url_fetcher(substitutes.get(url, url))
+        if cache is None or not url.startswith(REMOTE_SCHEMES):
+            return weasyprint.default_url_fetcher(url)
+        hit = cache.get(url)
+        if hit:
+            return {"string": hit[0], "mime_type": hit[1], "redirected_url": url}
+        if mode == "offline":
+            blocked.append(url)
+            raise ValueError(f"Blocked in offline mode: {url}")
+        fetched = weasyprint.default_url_fetcher(url)
+        if "string" in fetched:
+            body = fetched["string"]
+        else:
+            with fetched["file_obj"] as f:
+                body = f.read()
+        cache.put(url, body, fetched.get("mime_type"))
+        return {"string": body, "mime_type": fetched.get("mime_type"), "encoding": fetched.get("encoding"),
+                "redirected_url": fetched.get("redirected_url", url)}
+    return fetch
+
+def _render_document(md_path, basedir, assets, network, conn):
+    """Child process: markdown -> PDF next to it. Sends {"stages", "blocked"} plus "error" on failure."""
+    _, weasyprint, _ = _python_engine()
+    pdf_path = os.path.splitext(md_path)[0] + ".pdf"
+    stages, blocked = {}, []
+    mark = time.perf_counter()
+    try:
+        with open(md_path, encoding="utf-8") as f:
+            text = f.read()
+        page = PythonBackend().to_html(text, os.path.splitext(os.path.basename(md_path))[0])
+        stages["parse"] = round((time.perf_counter() - mark) * 1000)
+        mark = time.perf_counter()
+        # Relative images and links resolve against the markdown file, as in md-to-pdf
+        fetch = _url_fetcher(weasyprint, basedir, assets, network, blocked)
+        document = weasyprint.HTML(string=page, base_url=md_path, url_fetcher=fetch).render()
+        stages["layout"] = round((time.perf_counter() - mark) * 1000)
+        mark = time.perf_counter()
+        tmp = f"{pdf_path}.{os.getpid()}.tmp"
+        document.write_pdf(tmp)
+        os.replace(tmp, pdf_path)
+        stages["pdf"] = round((time.perf_counter() - mark) * 1000)
+        conn.send({"stages": stages, "blocked": blocked})
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}", "stages": stages, "blocked": blocked})
+    finally:
+        conn.close()
+
+@functools.lru_cache(maxsize=1)
+def _process_context():
+    """
+    Where WeasyPrint renders run: forked from a server process that has the
+    engine imported already (cheap, and safe in this multi-threaded process),
+    or spawned on platforms without fork.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["modules.backends", "markdown", "weasyprint"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+def _render_isolated(md_path, basedir, assets, network, timeout):
+    """
+    Run `_render_document` in a child process and wait at most `timeout`
+    seconds: a document that hangs WeasyPrint is killed, like a Chromium page
+    past its deadline, instead of holding this thread.
+    """
+    context = _process_context()
+    receive, send = context.Pipe(duplex=False)
+    child = context.Process(target=_render_document, args=(md_path, basedir, assets, network, send), daemon=True)
+    child.start()
+    send.close()
+    try:
+        if receive.poll(timeout):
+            return receive.recv()
+        child.kill()
+        for leftover in glob.glob(f"{glob.escape(os.path.splitext(md_path)[0])}.pdf.{child.pid}.tmp"):
+            os.remove(leftover)
+        return {"error": f"Timed out after {timeout}s"}
+    except EOFError:
+        child.join()
+        return {"error": f"{CRASH_ERROR} (exit code {child.exitcode})"}
+    finally:
+        receive.close()
+        child.join(5)
+
+class BackendRouter:
+    """
+    Picks a backend per document: the cheapest available one that supports its
+    features, unless a backend is forced (`configure`, or MD2PDF_BACKEND).
+    Decisions are remembered by content hash, so unchanged files aren't re-read.
+    """
+
+    def __init__(self, backends=None):
+        self.backends = sorted(backends or [ChromiumBackend(), PythonBackend()], key=lambda b: b.cost)
+        self.forced = None
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def configure(self, choice=None):
+        """"auto" / None, or a backend name to send every document to."""
+        with self._lock:
+            self.forced = choice if choice and choice != "auto" else None
+
+    def choice(self):
+        override = os.environ.get(BACKEND_ENV, "auto")
+        return self.forced or (override if override in CHOICES else "auto")
+
+    def get(self, name):
+        return next(b for b in self.backends if b.name == name)
+
+    def route(self, md_path, digest):
+        choice = self.choice()
+        if choice != "auto":
+            return self.get(choice)
+        with self._lock:
+            name = self._routes.get(digest)
+        if name is None:
+            try:
+                with open(md_path, encoding="utf-8") as f:
+                    text = f.read()
+            except (OSError, UnicodeDecodeError):
+                text = None
+            fallback = self.backends[-1]
+            name = next((b.name for b in self.backends
+                         if b.available() and text is not None and not b.supports(text)), fallback.name)
+            with self._lock:
+                if len(self._routes) >= MAX_ROUTES:
+                    self._routes.clear()
+                self._routes[digest] = name
+        return self.get(name)
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_router():
+    """Process-wide backend router."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = BackendRouter()
+        return _router
@@ -0,0 +1,131 @@
+import os
+import math
+import threading
+
+from modules.system import RENDERER_MEMORY_MB, available_memory_mb, memory_limit_mb
+
+MAX_BATCH = 32          # tiny files per batch (one worker job)
+BATCH_TARGET_MB = 4     # markdown + local assets per batch; bigger documents get a batch of their own
+RESERVE_MB = 256        # left free for the app itself and the OS
+CEILING_FRACTION = 0.8  # default ceiling: this share of the machine/container memory
+
+def input_mb(md_path, index):
+    """Markdown plus referenced local assets, in MB, from sizes the dependency index already has."""
+    paths = [os.path.abspath(md_path)] + list(index.assets(md_path))
+    total = 0
+    for path in paths:
+        entry = index.files.get(path)
+        if entry:
+            total += max(0, entry[0])
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total / (1024 * 1024)
+
+def plan_batches(paths, weights, jobs, max_batch=MAX_BATCH, target_mb=BATCH_TARGET_MB):
+    """
+    Group documents into worker jobs by input size instead of a fixed count.
+    Documents of `target_mb` or more render alone; smaller ones are packed up to
+    `target_mb` and `max_batch` files, but spread over at least `jobs` batches.
+    Heaviest batches come first so a large document doesn't finish last.
+    """
+    large = [p for p in paths if weights[p] >= target_mb]
+    small = [p for p in paths if weights[p] < target_mb]
+    per_batch = max(1, min(max_batch, math.ceil(len(small) / max(1, jobs - len(large))) if small else 1))
+
+    batches = [[p] for p in large]
+    current, current_mb = [], 0.0
+    for path in small:
+        if current and (len(current) >= per_batch or current_mb + weights[path] > target_mb):
+            batches.append(current)
+            current, current_mb = [], 0.0
+        current.append(path)
+        current_mb += weights[path]
+    if current:
+        batches.append(current)
+    return sorted(batches, key=lambda batch: -sum(weights[p] for p in batch))
+
+class MemoryGovernor:
+    """
+    Decides how many renderers may run, from measured memory rather than a guess.
+    Renderer RSS (Node + Chromium and its helpers, read from /proc) is fed in
+    while conversions run; the per-worker estimate rises at once and decays
+    slowly. New batches only start while the estimate fits under both the
+    ceiling and what the system still has available.
+    """
+
+    def __init__(self, ceiling_mb=None, max_batch=None):
+        self.ceiling_mb = ceiling_mb
+        self.max_batch = max_batch
+        self.worker_mb = float(RENDERER_MEMORY_MB)
+        self._lock = threading.Lock()
+
+    def configure(self, ceiling_mb=None, max_batch=None):
+        """User limits (None or 0 = automatic)."""
+        with self._lock:
+            self.ceiling_mb = ceiling_mb or None
+            self.max_batch = max_batch or None
+
+    def ceiling(self):
+        if self.ceiling_mb:
+            return self.ceiling_mb
+        override = os.environ.get("MD2PDF_MEMORY_LIMIT_MB", "")
+        if override.isdigit() and int(override) > 0:
+            return int(override)
+        limit = memory_limit_mb()
+        return int(limit * CEILING_FRACTION) if limit else None
+
+    def batch_limit(self, default=MAX_BATCH):
+        if self.max_batch:
+            return self.max_batch
+        override = os.environ.get("MD2PDF_MAX_BATCH", "")
+        return int(override) if override.isdigit() and int(override) > 0 else default
+
+    def observe(self, renderers_rss_mb, workers):
+        """Feed one RSS sample of all renderer processes."""
+        if workers <= 0 or renderers_rss_mb <= 0:
+            return
+        per_worker = renderers_rss_mb / workers
+        with self._lock:
+            if per_worker > self.worker_mb:
+                self.worker_mb = per_worker
+            else:
+                self.worker_mb = 0.9 * self.worker_mb + 0.1 * per_worker
+
+    def budget_mb(self, renderers_rss_mb=0):
+        """Memory renderers may use in total: the ceiling, or less if the system is short."""
+        budgets = []
+        ceiling = self.ceiling()
+        if ceiling:
+            budgets.append(ceiling)
+        available = available_memory_mb()
+        if available is not None:
+            # Memory our renderers already hold counts as theirs
+            budgets.append(renderers_rss_mb + available - RESERVE_MB)
+        return min(budgets) if budgets else None
+
+    def allowed_workers(self, requested, renderers_rss_mb=0):
+        """Renderers that may run at once right now (always at least one)."""
+        budget = self.budget_mb(renderers_rss_mb)
+        if budget is None:
+            return max(1, requested)
+        return max(1, min(requested, int(budget // self.worker_mb)))
+
+    def target_mb(self, workers):
+        """Input size per batch: smaller when each worker's memory share is tight."""
+        budget = self.budget_mb()
+        if budget is None:
+            return BATCH_TARGET_MB
+        share = budget / max(1, workers)
+        # A worker needs headroom above its idle footprint for the documents it holds
+        return max(0.5, min(BATCH_TARGET_MB * 4, BATCH_TARGET_MB * share / (2 * self.worker_mb)))
+
+_governor = None
+_governor_lock = threading.Lock()
+
+def get_governor():
+    """Process-wide governor, so what one conversion learns applies to the next."""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = MemoryGovernor()
+        return _governor
@@ -0,0 +1,181 @@
+import os
+import re
+import time
+from urllib.parse import unquote
+
+from modules.deps import ASSET_REF, FENCE, FRONT_MATTER, REMOTE_PREFIXES
+
+# Opens every generated book (after any front matter), so it is never picked up as a chapter
+BOOK_MARKER = "<!-- md-to-pdf-pro book -->"
+PAGE_BREAK = '<div class="page-break" style="page-break-after: always;"></div>'
+
+HEADING = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t]*#*[ \t]*$")
+# Links to other markdown files ([text](chapter.md#part)), images excluded
+MD_LINK = re.compile(r"(?<!!)(\[[^\]]*\]\(\s*<?)([^)\s>#]+\.md)(#[^)\s>]*)?", re.IGNORECASE)
+MANIFEST_LINK = re.compile(r"\]\(\s*<?([^)\s>]+)")
+
+def _natural_key(path):
+    """'ch2.md' sorts before 'ch10.md'."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", path)]
+
+def is_book(path):
+    """True for markdown written by `build_book` (the marker follows any front matter)."""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            head = f.read(16384)
+    except OSError:
+        return False
+    return FRONT_MATTER.sub("", head, count=1).startswith(BOOK_MARKER)
+
+def read_manifest(manifest):
+    """
+    Chapter paths listed in a manifest, in order. One path per line, relative to
+    the manifest; '#' comments and blank lines are skipped. Markdown link lists
+    (a SUMMARY.md such as `- [Intro](intro.md)`) work too.
+    """
+    base = os.path.dirname(os.path.abspath(manifest))
+    paths = []
+    with open(manifest, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            link = MANIFEST_LINK.search(line)
+            ref = unquote(link.group(1)) if link else line.lstrip("-* ").strip()
+            if ref.lower().endswith(".md"):
+                paths.append(os.path.normpath(os.path.join(base, ref)))
+    return paths
+
+def order_chapters(files, manifest=None):
+    """
+    Chapters in book order: manifest entries first (in manifest order), then the
+    remaining files in natural path order. Generated books are skipped.
+    """
+    files = [os.path.abspath(f) for f in files]
+    listed = read_manifest(manifest) if manifest else []
+    rest = sorted(set(files) - set(listed), key=_natural_key)
+    ordered, seen = [], set()
+    for path in listed + rest:
+        if path not in seen and os.path.isfile(path) and not is_book(path):
+            seen.add(path)
+            ordered.append(path)
+    return ordered
+
+def _headings(lines):
+    """(line number, level, text) of ATX headings outside fenced code blocks."""
+    fence = None
+    for i, line in enumerate(lines):
+        match = FENCE.match(line)
+        if match:
+            marker = match.group(1)
+            if fence is None:
+                fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence):
+                fence = None
+            continue
+        if fence is None:
+            heading = HEADING.match(line)
+            if heading:
+                yield i, len(heading.group(1)), heading.group(2)
+
+def _rebase(ref, src_dir, out_dir):
+    """A relative reference from a chapter, re-pointed from the book's folder."""
+    if not ref or ref.lower().startswith(REMOTE_PREFIXES) or ref.startswith("/"):
+        return ref
+    path, suffix = re.match(r"([^?#]*)(.*)", ref, re.DOTALL).groups()
+    if not path:
+        return ref
+    target = os.path.normpath(os.path.join(src_dir, unquote(path)))
+    return os.path.relpath(target, out_dir).replace(os.sep, "/").replace(" ", "%20") + suffix
+
+def _chapter_text(path, number, chapters, out_dir, toc_depth):
+    """Chapter body with anchors on its headings and references re-pointed; returns (text, toc entries)."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    text = FRONT_MATTER.sub("", text, count=1)
+    src_dir = os.path.dirname(path)
+
+    def rebase_asset(match):
+        group = next(name for name, value in match.groupdict().items() if value)
+        start, end = match.span(group)
+        offset = match.start()
+        whole = match.group(0)
+        return whole[:start - offset] + _rebase(match.group(group), src_dir, out_dir) + whole[end - offset:]
+
+    def rebase_link(match):
+        target = os.path.normpath(os.path.join(src_dir, unquote(match.group(2))))
+        if target in chapters:
+            return f"{match.group(1)}#ch-{chapters[target]}"
+        return match.group(1) + _rebase(match.group(2), src_dir, out_dir) + (match.group(3) or "")
+
+    text = ASSET_REF.sub(rebase_asset, text)
+    text = MD_LINK.sub(rebase_link, text)
+
+    lines = text.splitlines()
+    entries = []
+    found = list(_headings(lines))
+    top = min((level for _, level, _ in found), default=1)
+    depth_offset = 1
+    if not found or found[0][1] != top:
+        # No leading heading: the file name becomes the chapter title
+        title = os.path.splitext(os.path.basename(path))[0].replace("_", " ").replace("-", " ")
+        entries.append((1, title, f"ch-{number}"))
+        lines.insert(0, f'<a id="ch-{number}"></a>\n')
+        found = [(i + 1, level, heading) for i, level, heading in found]
+        depth_offset = 2
+
+    for n, (i, level, heading) in enumerate(found):
+        depth = level - top + depth_offset
+        anchor = f"ch-{number}" if n == 0 and not entries else f"ch-{number}-{n}"
+        # The anchor sits inside the heading, so it adds no blank paragraph
+        lines[i] = f"{'#' * level} <a id=\"{anchor}\"></a>{heading}"
+        if depth <= toc_depth:
+            entries.append((depth, re.sub(r"<[^>]+>", "", heading), anchor))
+    return "\n".join(lines), entries
+
+def build_book(files, output, title=None, manifest=None, toc=True, toc_depth=2):
+    """
+    Write the combined markdown for a book of `files` to `output` (.md) and return
+    its path; rendering it produces the .pdf next to it in one page load.
+    Chapters are separated by page breaks and preceded by a linked table of
+    contents. Relative images and stylesheets are re-pointed from the book's
+    folder, and links between chapters become internal links. Front matter is
+    taken from the first chapter only.
+    """
+    output = os.path.abspath(output)
+    if os.path.exists(output) and not is_book(output):
+        raise FileExistsError(f"{output} exists and is not a generated book")
+    out_dir = os.path.dirname(output)
+    chapters = order_chapters(files, manifest)
+    chapters = [c for c in chapters if c != output]
+    if not chapters:
+        raise ValueError("No chapters to combine")
+    numbers = {path: i + 1 for i, path in enumerate(chapters)}
+
+    front = ""
+    with open(chapters[0], encoding="utf-8", errors="replace") as f:
+        match = FRONT_MATTER.match(f.read())
+        if match:
+            front = match.group(0)
+
+    bodies, toc_lines = [], []
+    for path in chapters:
+        body, entries = _chapter_text(path, numbers[path], numbers, out_dir, toc_depth)
+        bodies.append(body)
+        toc_lines += [f"{'  ' * (depth - 1)}- [{text}](#{anchor})" for depth, text, anchor in entries]
+
+    parts = []
+    if title:
+        parts.append(f"# {title}")
+    if toc:
+        parts.append("## Contents\n\n" + "\n".join(toc_lines))
+    if parts:
+        parts.append(PAGE_BREAK)
+    parts.append(f"\n\n{PAGE_BREAK}\n\n".join(bodies))
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = f"{output}.{os.getpid()}.{int(time.time() * 1000)}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(front + BOOK_MARKER + "\n\n" + "\n\n".join(parts) + "\n")
+    os.replace(tmp, output)
+    return output
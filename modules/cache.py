@@ -0,0 +1,83 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+from modules.deps import file_digest
+from modules.environment import default_launch_options, get_environment
+from modules.renderer import WORKER_SCRIPT
+
+CACHE_VERSION = b"md2pdf-cache-1"
+
+def engine_version():
+    """Version of the local md-to-pdf install, or 'npx' when resolved at run time."""
+    return get_environment()["engine"]
+
+def options_fingerprint(launch_options=None):
+    """Everything outside the document that changes the rendered bytes."""
+    return {
+        "launch_options": default_launch_options() if launch_options is None else launch_options,
+        "engine": engine_version(),
+        "worker": file_digest(WORKER_SCRIPT),
+    }
+
+def cache_key(md_path, options, index):
+    """
+    Content address of a render: markdown bytes + render options + asset bytes.
+    Hashes come from the dependency index, so only changed files are re-read.
+    """
+    h = hashlib.sha256(CACHE_VERSION)
+    h.update(json.dumps(options, sort_keys=True).encode())
+    h.update(index.digest(md_path).encode())
+
+    base = os.path.dirname(os.path.abspath(md_path))
+    for asset in index.assets(md_path):
+        h.update(os.path.relpath(asset, base).encode())
+        h.update(index.digest(asset).encode())
+    return h.hexdigest()
+
+class RenderCache:
+    """PDFs stored by cache key under `root/<2 hex>/<key>.pdf`."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.pdf")
+
+    def has(self, key):
+        return os.path.exists(self.path_for(key))
+
+    def restore(self, key, dest):
+        """Put the cached PDF at `dest` (hard link, or copy across devices). False on miss."""
+        src = self.path_for(key)
+        if not os.path.exists(src):
+            return False
+        if os.path.exists(dest) and os.path.samefile(src, dest):
+            return True
+
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(src, tmp)
+        except FileNotFoundError:
+            return False  # evicted between the check and the link
+        except OSError:
+            try:
+                shutil.copyfile(src, tmp)
+            except FileNotFoundError:
+                return False
+        os.replace(tmp, dest)
+        return True
+
+    def store(self, key, pdf_path):
+        """Copy a freshly rendered PDF into the cache (copied, so later writes to it can't corrupt the entry)."""
+        dest = self.path_for(key)
+        if os.path.exists(dest):
+            return dest
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(pdf_path, tmp)
+        os.replace(tmp, dest)
+        return dest
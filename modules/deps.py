@@ -0,0 +1,251 @@
+import os
+import re
+import json
+import stat
+import hashlib
+import threading
+from urllib.parse import unquote
+
+# Local files that end up inside the PDF: images, stylesheets, scripts.
+# Plain links ([text](other.md)) don't affect the rendered output.
+# One alternation so each document is scanned in a single pass.
+ASSET_REF = re.compile(
+    # <...> destinations may contain spaces: ![x](<my image.png>)
+    r"""!\[[^\]]*\]\(\s*(?:<(?P<angle>[^>\n]+)>|(?P<md>[^)\s>]+))"""
+    r"""|<(?:img|source|script)\b[^>]*?\bsrc\s*=\s*["'](?P<src>[^"']+)"""
+    r"""|<link\b[^>]*?\bhref\s*=\s*["'](?P<href>[^"']+)"""
+    r"""|url\(\s*["']?(?P<url>[^"')]+)""",
+    re.IGNORECASE,
+)
+FENCE = re.compile(r"^[ \t]{0,3}(`{3,}|~{3,})")
+CODE_SPAN = re.compile(r"(`+)(?!`).*?(?<!`)\1(?!`)", re.DOTALL)
+FRONT_MATTER = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.DOTALL)
+STYLESHEET_KEY = re.compile(r"^stylesheet:\s*(.*)$")
+REMOTE_PREFIXES = ("http://", "https://", "data:", "mailto:", "#", "//")
+
+def file_digest(path):
+    """sha256 of a regular file, read in chunks ("missing" for anything else or unreadable)."""
+    h = hashlib.sha256()
+    try:
+        f = open(path, "rb")
+        # Checked on the open file: a device or FIFO would never reach EOF
+        if not stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+            f.close()
+            return "missing"
+    except OSError:
+        return "missing"
+    with f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+MISSING = [-1, -1]
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return MISSING
+    if not stat.S_ISREG(st.st_mode):
+        return MISSING
+    return [st.st_size, st.st_mtime_ns]
+
+def _front_matter_stylesheets(text):
+    match = FRONT_MATTER.match(text)
+    if not match:
+        return []
+    found, in_list = [], False
+    for line in match.group(1).splitlines():
+        key = STYLESHEET_KEY.match(line)
+        if key:
+            value = key.group(1).strip()
+            in_list = not value
+            if value.startswith("["):
+                found += [v.strip(" '\"") for v in value.strip("[]").split(",")]
+            elif value:
+                found.append(value.strip("'\""))
+        elif in_list and line.strip().startswith("- "):
+            found.append(line.strip()[2:].strip("'\""))
+        elif not line.startswith((" ", "\t")):
+            in_list = False
+    return found
+
+def without_code(text):
+    """The document with fenced code blocks and code spans blanked out (examples aren't references)."""
+    lines, fence = text.splitlines(keepends=True), None
+    for i, line in enumerate(lines):
+        match = FENCE.match(line)
+        if match:
+            marker = match.group(1)
+            if fence is None:
+                fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence):
+                fence = None
+            lines[i] = "\n"
+        elif fence is not None:
+            lines[i] = "\n"
+    return CODE_SPAN.sub("", "".join(lines))
+
+def _inside(path, tree):
+    return path == tree or path.startswith(tree.rstrip(os.sep) + os.sep)
+
+def referenced_assets(md_path, text, tree=None):
+    """
+    Local files referenced by the document, as absolute paths.
+    Missing files are kept: creating one later must invalidate the document.
+    References that leave `tree` (default: the document's folder), through an
+    absolute path or "..", are not followed.
+    """
+    base = os.path.dirname(os.path.abspath(md_path))
+    tree = os.path.abspath(tree or base)
+    refs = _front_matter_stylesheets(text)
+    refs += [next(g for g in m.groups() if g) for m in ASSET_REF.finditer(without_code(text))]
+
+    assets = set()
+    for ref in refs:
+        ref = ref.strip()
+        if not ref or ref.lower().startswith(REMOTE_PREFIXES):
+            continue
+        ref = unquote(ref.split("#", 1)[0].split("?", 1)[0])
+        if ref.startswith("file://"):
+            ref = ref[len("file://"):]
+        path = os.path.normpath(os.path.join(base, ref))
+        if _inside(path, tree):
+            assets.add(path)
+    return sorted(assets)
+
+class DependencyIndex:
+    """
+    Persistent record of what each document depends on.
+
+    - `files`: path -> [size, mtime_ns, sha256], so unchanged files are never re-hashed
+      and a touched-but-identical file still hashes to the same content.
+    - `docs`: markdown path -> {"stat": [size, mtime_ns], "assets": [...]}, rescanned
+      only when the markdown file itself changes.
+    - `dependents`: asset -> set of documents (built in memory from `docs`).
+    - `roots`: folders the user chose to convert (CLI arguments, Local Batch,
+      watch mode). Documents under one may reference anything inside it;
+      others (uploads) only files in their own folder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.docs = {}
+        self.dependents = {}
+        self.roots = set()
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.docs = data.get("docs", {})
+        except (OSError, ValueError):
+            return
+        for doc, entry in self.docs.items():
+            for asset in entry["assets"]:
+                self.dependents.setdefault(asset, set()).add(doc)
+
+    def save(self):
+        """Write the index atomically if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"files": self.files, "docs": self.docs}, f)
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    def add_root(self, folder):
+        with self._lock:
+            self.roots.add(os.path.abspath(folder))
+
+    def tree(self, md_path):
+        """Folder a document's references must stay in: the outermost root holding it, else its own folder."""
+        md_path = os.path.abspath(md_path)
+        with self._lock:
+            holding = [root for root in self.roots if _inside(md_path, root)]
+        return min(holding, key=len) if holding else os.path.dirname(md_path)
+
+    def digest(self, path):
+        """
+        Content hash of `path`, recomputed only when its size or mtime changed.
+        Missing files, and anything that isn't a regular file, hash to "missing".
+        """
+        path = os.path.abspath(path)
+        key = _stat_key(path)
+        with self._lock:
+            entry = self.files.get(path)
+            if entry and entry[:2] == key:
+                return entry[2]
+        digest = "missing" if key == MISSING else file_digest(path)
+        with self._lock:
+            self.files[path] = key + [digest]
+            self._dirty = True
+        return digest
+
+    def changed(self, path):
+        """True if `path` differs from the last recorded stat (or was never seen)."""
+        path = os.path.abspath(path)
+        entry = self.files.get(path)
+        return not entry or entry[:2] != _stat_key(path)
+
+    def assets(self, md_path):
+        """Local assets of a document, rescanning the markdown only if it changed."""
+        md_path = os.path.abspath(md_path)
+        key, tree = _stat_key(md_path), self.tree(md_path)
+        with self._lock:
+            entry = self.docs.get(md_path)
+            if entry and entry["stat"] == key and entry.get("tree") == tree:
+                return entry["assets"]
+
+        try:
+            with open(md_path, encoding="utf-8", errors="replace") as f:
+                assets = referenced_assets(md_path, f.read(), tree)
+        except OSError:
+            assets = []
+
+        with self._lock:
+            self._unlink(md_path)
+            for asset in assets:
+                self.dependents.setdefault(asset, set()).add(md_path)
+            self.docs[md_path] = {"stat": key, "tree": tree, "assets": assets}
+            self._dirty = True
+        return assets
+
+    def inputs_changed(self, md_path):
+        """True if the document or any asset it references changed since last indexed."""
+        md_path = os.path.abspath(md_path)
+        entry = self.docs.get(md_path)
+        if not entry or entry["stat"] != _stat_key(md_path) or entry.get("tree") != self.tree(md_path):
+            return True
+        return any(self.changed(a) for a in entry["assets"])
+
+    def affected_documents(self, changed_paths):
+        """Documents to re-render for a set of changed files (markdown or assets)."""
+        affected = set()
+        with self._lock:
+            for path in changed_paths:
+                path = os.path.abspath(path)
+                if path in self.docs or path.lower().endswith(".md"):
+                    affected.add(path)
+                affected |= self.dependents.get(path, set())
+        return sorted(affected)
+
+    def forget(self, path):
+        """Drop a deleted file from the index."""
+        path = os.path.abspath(path)
+        with self._lock:
+            self.files.pop(path, None)
+            self._unlink(path)
+            self.docs.pop(path, None)
+            self._dirty = True
+
+    def _unlink(self, md_path):
+        for asset in self.docs.get(md_path, {}).get("assets", []):
+            self.dependents.get(asset, set()).discard(md_path)
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import shutil
+import platform
+import threading
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE_TIMEOUT = 15    # seconds for `node` to report the Chromium path
+INSTALL_TIMEOUT = 600  # seconds for `npm install` on a fresh Cloud container
+
+def is_cloud():
+    """Detect if running on Streamlit Cloud."""
+    return os.environ.get("STREAMLIT_RUNTIME_ENV") == "cloud" or "AMPLIFY_ID" in os.environ
+
+def default_launch_options():
+    """Puppeteer launch options for the current OS."""
+    # Linux often requires --no-sandbox for available Chrome/Puppeteer
+    if platform.system() == "Linux":
+        return {"args": ["--no-sandbox"]}
+    return {}
+
+def _engine_version(package_dir):
+    try:
+        with open(os.path.join(package_dir, "package.json")) as f:
+            return json.load(f)["version"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return "npx"
+
+def pinned_engine():
+    """The md-to-pdf version package.json pins (render_worker.js relies on its internals), or None."""
+    try:
+        with open(os.path.join(ROOT_DIR, "package.json")) as f:
+            return json.load(f)["dependencies"]["md-to-pdf"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _chromium_path(node):
+    """The browser Puppeteer will launch: PUPPETEER_EXECUTABLE_PATH, else asked from the local install."""
+    override = os.environ.get("PUPPETEER_EXECUTABLE_PATH")
+    if override:
+        return override if os.path.exists(override) else None
+    try:
+        proc = subprocess.run([node, "-e", "process.stdout.write(require('puppeteer').executablePath())"],
+                              cwd=ROOT_DIR, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    path = proc.stdout.strip()
+    return path if proc.returncode == 0 and path and os.path.exists(path) else None
+
+def probe_environment():
+    """
+    Look up everything a conversion needs from the host: Node/npx, the local
+    md-to-pdf install and its binary, the Chromium executable and launch flags.
+    Spawns `node` once, so callers should use the cached `get_environment()`.
+    """
+    started = time.perf_counter()
+    node = shutil.which("node")
+    package_dir = os.path.join(ROOT_DIR, "node_modules", "md-to-pdf")
+    if not os.path.isdir(package_dir):
+        package_dir = None
+    binary = os.path.join(ROOT_DIR, "node_modules", ".bin",
+                          "md-to-pdf.cmd" if platform.system() == "Windows" else "md-to-pdf")
+    return {
+        "os": platform.system(),
+        "cloud": is_cloud(),
+        "node": node,
+        "npx": shutil.which("npx"),
+        "npm": shutil.which("npm"),
+        "md_to_pdf": package_dir,
+        "md_to_pdf_bin": binary if package_dir and os.path.exists(binary) else None,
+        "engine": _engine_version(package_dir),
+        "chromium": _chromium_path(node) if node and package_dir else None,
+        "launch_options": default_launch_options(),
+        "probe_ms": round((time.perf_counter() - started) * 1000),
+    }
+
+def install_dependencies():
+    """
+    On Cloud, run `npm install` once if `node_modules` is missing.
+    Returns True when it ran (the environment is probed again afterwards).
+    """
+    env = get_environment()
+    if not env["cloud"] or not env["npm"] or os.path.exists(os.path.join(ROOT_DIR, "node_modules")):
+        return False
+    try:
+        subprocess.run([env["npm"], "install"], cwd=ROOT_DIR, capture_output=True, timeout=INSTALL_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        pass
+    get_environment(refresh=True)
+    return True
+
+_environment = None
+_environment_lock = threading.Lock()
+
+def get_environment(refresh=False):
+    """The host probe, done once per process (again after `refresh=True`)."""
+    global _environment
+    with _environment_lock:
+        if _environment is None or refresh:
+            _environment = probe_environment()
+        return _environment
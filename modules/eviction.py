@@ -0,0 +1,243 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from modules.metrics import get_metrics
+
+CACHE_MAX_MB = 2048        # render store + converted uploads (MD2PDF_CACHE_MAX_MB)
+CACHE_MAX_FILES = 20000    # entries: cached renders + uploaded documents (MD2PDF_CACHE_MAX_FILES)
+CACHE_MAX_AGE_DAYS = 30    # unused this long -> removed regardless of size (MD2PDF_CACHE_MAX_AGE_DAYS)
+MIN_IDLE = 300             # seconds; anything used more recently is never evicted
+LEASE_TTL = 12 * 3600      # a viewer session that stops refreshing its lease releases its files
+EVICT_DELAY = 5            # seconds to coalesce eviction requests from back-to-back conversions
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _env_limit(name, default):
+    value = os.environ.get(name, "")
+    return float(value) if value.replace(".", "", 1).isdigit() else default
+
+class CacheEvictor:
+    """
+    Keeps the persistent temp directory under a size, entry-count and age limit
+    by removing the least recently used cache entries (from the manifest's last
+    access times) on a background thread. Running conversions and open viewer
+    sessions hold leases on their files; leased files are never removed.
+    A limit of 0 turns that limit off. Reduced image copies (`assets`) are
+    removed by age only. Links published for the viewer (`static`) are
+    removed once no open viewer leases them: each pins its PDF's inode, so
+    the other evictions would otherwise free no disk space.
+    """
+
+    def __init__(self, folder, manifest, store, uploads, assets=None, static=None):
+        self.folder = folder
+        self.manifest = manifest
+        self.store = store
+        self.uploads = uploads
+        self.assets = assets
+        self.static = static
+        self.limits = {}
+        self.last_run = None
+        self._leases = {}  # owner -> (paths, expiry)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def configure(self, max_mb=None, max_files=None, max_age_days=None):
+        """Overrides for the environment/default limits (None = keep)."""
+        with self._lock:
+            for name, value in (("max_mb", max_mb), ("max_files", max_files), ("max_age_days", max_age_days)):
+                if value is not None:
+                    self.limits[name] = value
+
+    def max_mb(self):
+        return self.limits.get("max_mb", _env_limit("MD2PDF_CACHE_MAX_MB", CACHE_MAX_MB))
+
+    def max_files(self):
+        return self.limits.get("max_files", _env_limit("MD2PDF_CACHE_MAX_FILES", CACHE_MAX_FILES))
+
+    def max_age_days(self):
+        return self.limits.get("max_age_days", _env_limit("MD2PDF_CACHE_MAX_AGE_DAYS", CACHE_MAX_AGE_DAYS))
+
+    def lease(self, owner, paths, ttl=None):
+        """Protect `paths` for `owner` (replacing its previous lease) until released or `ttl` runs out."""
+        with self._lock:
+            expiry = time.time() + ttl if ttl else None
+            self._leases[owner] = ({os.path.abspath(p) for p in paths}, expiry)
+
+    def release(self, owner):
+        with self._lock:
+            self._leases.pop(owner, None)
+
+    @contextmanager
+    def leased(self, paths):
+        """Protect `paths` for the duration of a block."""
+        owner = object()
+        self.lease(owner, paths)
+        try:
+            yield
+        finally:
+            self.release(owner)
+
+    def in_use(self):
+        now = time.time()
+        with self._lock:
+            for owner in [o for o, (_, expiry) in self._leases.items() if expiry and expiry < now]:
+                del self._leases[owner]
+            return set().union(*(paths for paths, _ in self._leases.values()))
+
+    def request(self):
+        """Schedule an eviction pass on the background thread (coalesced)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="md2pdf-evict", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait()
+            time.sleep(EVICT_DELAY)
+            self._wake.clear()
+            try:
+                self.evict()
+            except Exception:
+                # Eviction is housekeeping: try again after the next conversion
+                pass
+
+    def _remove_document(self, md_path, pdf_path, digest=None):
+        """Delete a converted upload, and its blob once no session links to it."""
+        _unlink(md_path)
+        _unlink(pdf_path)
+        if digest:
+            self.uploads.release(digest, os.path.splitext(md_path)[1].lower())
+
+    def discard(self, md_paths):
+        """Remove converted documents (markdown + PDF) below the folder now, unless another owner leases them."""
+        protected = self.in_use()
+        root = os.path.abspath(self.folder) + os.sep
+        rows = {}
+        for md_path in map(os.path.abspath, md_paths):
+            if md_path.startswith(root) and os.path.dirname(md_path) not in rows:
+                rows[os.path.dirname(md_path)] = {r["md_path"]: r for r in self.manifest.documents(os.path.dirname(md_path))}
+        removed = []
+        for md_path in map(os.path.abspath, md_paths):
+            if not md_path.startswith(root):
+                continue
+            row = rows[os.path.dirname(md_path)].get(md_path, {})
+            pdf_path = row.get("pdf_path") or os.path.splitext(md_path)[0] + ".pdf"
+            if protected.intersection((md_path, pdf_path)):
+                continue
+            self._remove_document(md_path, pdf_path, row.get("digest"))
+            removed.append(md_path)
+        self.manifest.forget(md_paths=removed)
+        return removed
+
+    def _prune_static(self, protected, now):
+        """Remove viewer links nobody leases (linked in the last MIN_IDLE seconds excepted). Returns (files, bytes)."""
+        files = freed = 0
+        try:
+            names = os.listdir(self.static)
+        except OSError:
+            return 0, 0
+        for name in names:
+            path = os.path.join(self.static, name)
+            try:
+                st = os.stat(path)
+                # Making a link updates the inode's ctime, so a fresh link is recognised even for an old PDF
+                if path in protected or st.st_ctime > now - MIN_IDLE:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            files += 1
+            if st.st_nlink == 1:
+                freed += st.st_size
+        return files, freed
+
+    def _paths(self, entry):
+        if entry["kind"] == "render":
+            return [self.store.path_for(entry["id"])]
+        return [entry["id"], entry["pdf_path"]]
+
+    def evict(self):
+        """
+        One pass: drop entries unused for longer than the age limit, then the least
+        recently used ones until size and count fit. Returns {"files", "bytes"} removed.
+        """
+        now = time.time()
+        self.manifest.import_store(self.store.root)
+        entries = self.manifest.entries(self.folder)
+        # A session's PDF is a hard link to its store entry: size by inode, so
+        # the shared file counts once and only frees space with its last link
+        inodes, links, sizes = [], {}, {}
+        for entry in entries:
+            held = set()
+            for path in self._paths(entry):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                held.add((st.st_dev, st.st_ino))
+                sizes[(st.st_dev, st.st_ino)] = st.st_size
+            for inode in held:
+                links[inode] = links.get(inode, 0) + 1
+            inodes.append(held)
+        size = sum(sizes.values())
+        count = len(entries)
+        max_bytes = self.max_mb() * 1024 * 1024
+        max_files = self.max_files()
+        cutoff = now - self.max_age_days() * 86400 if self.max_age_days() else None
+        protected = self.in_use()
+
+        keys, documents, freed = [], [], 0
+        for entry, held in zip(entries, inodes):
+            if entry["accessed_at"] > now - MIN_IDLE:
+                break
+            expired = cutoff is not None and entry["accessed_at"] < cutoff
+            if not expired and not (max_bytes and size > max_bytes) and not (max_files and count > max_files):
+                break
+            paths = self._paths(entry)
+            if protected.intersection(paths):
+                continue
+            try:
+                if entry["kind"] == "render":
+                    _unlink(paths[0])
+                    keys.append(entry["id"])
+                else:
+                    self._remove_document(entry["id"], entry["pdf_path"], entry["digest"])
+                    documents.append(entry["id"])
+            except OSError:
+                continue
+            released = 0
+            for inode in held:
+                links[inode] -= 1
+                if not links[inode]:
+                    released += sizes[inode]
+            size -= released
+            count -= 1
+            freed += released
+
+        self.manifest.forget(render_keys=keys, md_paths=documents)
+        removed = len(keys) + len(documents)
+        if self.assets is not None:
+            pruned, pruned_bytes = self.assets.prune(self.max_age_days())
+            removed += pruned
+            freed += pruned_bytes
+        if self.static is not None:
+            pruned, pruned_bytes = self._prune_static(protected, now)
+            removed += pruned
+            freed += pruned_bytes
+        self.last_run = {"at": now, "files": removed, "bytes": freed, "entries": count, "size": size}
+        metrics = get_metrics()
+        metrics.count("cache_evictions", removed)
+        metrics.count("cache_evicted_bytes", freed)
+        metrics.gauge("cache_bytes", size)
+        metrics.gauge("cache_entries", count)
+        metrics.log("evict", files=removed, bytes=freed, entries=count, size=size)
+        return {"files": removed, "bytes": freed}
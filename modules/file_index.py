@@ -0,0 +1,293 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from modules.split import is_part
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watchdog is optional: without it the index is refreshed by rescans
+    Observer = None
+    FileSystemEventHandler = object
+
+# Folders that never hold documents worth converting, skipped without descending
+DEFAULT_IGNORE_PATTERNS = [
+    "node_modules/", ".git/", ".hg/", ".svn/", "__pycache__/", ".venv/", "venv/",
+    ".tox/", ".nox/", ".mypy_cache/", ".pytest_cache/", ".ruff_cache/", ".next/",
+    "build/", "dist/", "target/", "site-packages/",
+]
+MAX_INDEXES = 4  # roots kept indexed (and watched) at once
+
+def _glob_to_regex(pattern):
+    """Translate one gitignore glob (without flags) to a regex body."""
+    out, i = "", 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out, i = out + "(?:.*/)?", i + 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out, i = out + "/.*", i + 3
+        elif pattern.startswith("**", i):
+            out, i = out + ".*", i + 2
+        elif pattern[i] == "*":
+            out, i = out + "[^/]*", i + 1
+        elif pattern[i] == "?":
+            out, i = out + "[^/]", i + 1
+        elif pattern[i] == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 1)
+            out, i = out + pattern[i:end + 1].replace("[!", "[^"), end + 1
+        else:
+            out, i = out + re.escape(pattern[i]), i + 1
+    return out
+
+def compile_pattern(pattern):
+    """(regex, negate, dir_only) for a gitignore line, or None for blanks/comments."""
+    pattern = pattern.rstrip("\n").rstrip()
+    if not pattern or pattern.startswith("#"):
+        return None
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    # A slash anywhere but the end anchors the pattern to its .gitignore's folder
+    anchored = "/" in pattern
+    body = _glob_to_regex(pattern.lstrip("/"))
+    prefix = "^" if anchored else "^(?:.*/)?"
+    return re.compile(prefix + body + "$"), negate, dir_only
+
+class IgnoreRules:
+    """gitignore-style matcher: root patterns plus any .gitignore found while walking."""
+
+    def __init__(self, patterns=(), use_gitignore=True):
+        self.use_gitignore = use_gitignore
+        # base folder (relative, "" for root) -> compiled rules, in precedence order
+        self.rule_sets = OrderedDict()
+        self.rule_sets[""] = [r for r in map(compile_pattern, patterns) if r]
+
+    def load_gitignore(self, root, rel_dir):
+        if not self.use_gitignore:
+            return
+        path = os.path.join(root, rel_dir, ".gitignore")
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                rules = [r for r in map(compile_pattern, f) if r]
+        except OSError:
+            return
+        self.rule_sets[rel_dir] = self.rule_sets.get(rel_dir, []) + rules
+
+    def _match(self, rel_path, is_dir):
+        ignored = False
+        for base, rules in self.rule_sets.items():
+            if base and not rel_path.startswith(base + "/"):
+                continue
+            sub = rel_path[len(base) + 1:] if base else rel_path
+            for regex, negate, dir_only in rules:
+                if dir_only and not is_dir:
+                    continue
+                if regex.match(sub):
+                    ignored = not negate
+        return ignored
+
+    def ignored(self, rel_path, is_dir=False):
+        """True if the path or any of its parent folders is ignored ('/'-separated, relative)."""
+        parts = rel_path.split("/")
+        for i in range(1, len(parts)):
+            if self._match("/".join(parts[:i]), True):
+                return True
+        return self._match(rel_path, is_dir)
+
+def pdf_status(md_mtime, pdf_mtime):
+    """Display state of the PDF next to a markdown file."""
+    if pdf_mtime is None:
+        return "—"
+    return "✅ Converted" if pdf_mtime >= md_mtime else "⚠️ Outdated"
+
+class FileIndex:
+    """
+    Markdown files under `root` with size, mtime and PDF status.
+    Built once with an iterative os.scandir walk that never enters ignored
+    folders, then kept current from watchdog events instead of rescanning.
+    `version` increases on every change so callers can memoize derived views.
+    """
+
+    def __init__(self, root, patterns=None, use_gitignore=True):
+        self.root = os.path.abspath(root)
+        self.patterns = list(DEFAULT_IGNORE_PATTERNS if patterns is None else patterns)
+        self.use_gitignore = use_gitignore
+        self.files = {}
+        self.version = 0
+        self.watching = False
+        self._observer = None
+        self._lock = threading.RLock()
+        self.scan()
+
+    def _rel(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def scan(self):
+        """Full rebuild of the index."""
+        rules = IgnoreRules(self.patterns, self.use_gitignore)
+        files = {}
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            rules.load_gitignore(self.root, rel_dir)
+            pdfs = {}
+            mds = []
+            try:
+                with os.scandir(os.path.join(self.root, rel_dir)) as it:
+                    for entry in it:
+                        rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if not rules.ignored(rel, True):
+                                    stack.append(rel)
+                                continue
+                            lower = entry.name.lower()
+                            if lower.endswith(".md") and not rules.ignored(rel) and not is_part(entry.name):
+                                st = entry.stat()
+                                mds.append((entry.path, st.st_size, st.st_mtime))
+                            elif lower.endswith(".pdf"):
+                                pdfs[os.path.splitext(entry.path)[0]] = entry.stat().st_mtime
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            for path, size, mtime in mds:
+                files[path] = self._entry(size, mtime, pdfs.get(os.path.splitext(path)[0]))
+
+        with self._lock:
+            self.rules = rules
+            self.files = files
+            self.version += 1
+
+    @staticmethod
+    def _entry(size, mtime, pdf_mtime):
+        return {"size": size, "mtime": mtime, "pdf": pdf_status(mtime, pdf_mtime)}
+
+    def snapshot(self):
+        """Sorted list of (path, metadata) pairs."""
+        with self._lock:
+            return sorted(self.files.items())
+
+    # --- Incremental updates -------------------------------------------------
+
+    def refresh(self, path):
+        """Re-stat one markdown or PDF path after a change."""
+        path = os.path.abspath(path)
+        lower = path.lower()
+        if lower.endswith(".pdf"):
+            md = next((p for p in (os.path.splitext(path)[0] + ext for ext in (".md", ".MD")) if p in self.files), None)
+            if md:
+                self.refresh(md)
+            return
+        if not lower.endswith(".md") or is_part(path) or self.rules.ignored(self._rel(path)):
+            return
+
+        with self._lock:
+            try:
+                st = os.stat(path)
+            except OSError:
+                changed = self.files.pop(path, None) is not None
+            else:
+                pdf = os.path.splitext(path)[0] + ".pdf"
+                pdf_mtime = os.path.getmtime(pdf) if os.path.exists(pdf) else None
+                entry = self._entry(st.st_size, st.st_mtime, pdf_mtime)
+                changed = self.files.get(path) != entry
+                self.files[path] = entry
+            if changed:
+                self.version += 1
+
+    def remove_tree(self, path):
+        """Drop everything under a deleted or moved-away folder."""
+        prefix = os.path.abspath(path) + os.sep
+        with self._lock:
+            gone = [p for p in self.files if p.startswith(prefix)]
+            for p in gone:
+                del self.files[p]
+            if gone:
+                self.version += 1
+
+    def add_tree(self, path):
+        """Index a folder that appeared (created or moved in)."""
+        rel = self._rel(path)
+        if self.rules.ignored(rel, True):
+            return
+        for dirpath, dirnames, filenames in os.walk(path):
+            rel_dir = self._rel(dirpath)
+            dirnames[:] = [d for d in dirnames if not self.rules.ignored(f"{rel_dir}/{d}", True)]
+            for name in filenames:
+                if name.lower().endswith(".md"):
+                    self.refresh(os.path.join(dirpath, name))
+
+    def start_watching(self):
+        """Follow filesystem events with watchdog. Returns False if it isn't available."""
+        if self.watching:
+            return True
+        if Observer is None:
+            return False
+        observer = Observer()
+        observer.schedule(_IndexEventHandler(self), self.root, recursive=True)
+        try:
+            observer.start()
+        except OSError:
+            # e.g. inotify watch limit reached on very large trees
+            return False
+        self._observer = observer
+        self.watching = True
+        return True
+
+    def stop_watching(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+        self.watching = False
+
+class _IndexEventHandler(FileSystemEventHandler):
+    """Maps watchdog events onto FileIndex updates."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def on_any_event(self, event):
+        index = self.index
+        if event.event_type not in ("created", "modified", "deleted", "moved"):
+            return
+        dest = getattr(event, "dest_path", None)
+        if event.is_directory:
+            if event.event_type in ("deleted", "moved"):
+                index.remove_tree(event.src_path)
+            if event.event_type == "created":
+                index.add_tree(event.src_path)
+            elif dest:
+                index.add_tree(dest)
+            return
+        index.refresh(event.src_path)
+        if dest:
+            index.refresh(dest)
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def get_file_index(root, patterns=None, use_gitignore=True, watch=True):
+    """
+    Shared index per (root, ignore rules). The least recently used index is
+    dropped (and its watcher stopped) once more than MAX_INDEXES are open.
+    """
+    key = (os.path.abspath(root), tuple(DEFAULT_IGNORE_PATTERNS if patterns is None else patterns), use_gitignore)
+    with _indexes_lock:
+        index = _indexes.pop(key, None)
+        if index is None:
+            index = FileIndex(root, patterns, use_gitignore)
+        _indexes[key] = index
+        while len(_indexes) > MAX_INDEXES:
+            _, old = _indexes.popitem(last=False)
+            old.stop_watching()
+    if watch:
+        index.start_watching()
+    else:
+        index.stop_watching()
+    return index
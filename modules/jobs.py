@@ -0,0 +1,191 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.utils import get_evictor, run_conversion_command
+from modules.book import build_book
+from modules.metrics import get_metrics
+
+MAX_JOBS_KEPT = 50     # finished jobs remembered for the jobs panel
+MAX_EVENTS_KEPT = 200  # per-job event log shown in the UI
+MAX_RUNNING_JOBS = 3   # jobs of different owners that run at the same time
+
+class ConversionJob:
+    """
+    One queued `run_conversion_command` call and its live state.
+    With `book` (keyword arguments for `build_book`) the files are chapters
+    combined into a single document first, and `files` becomes that document.
+    """
+
+    def __init__(self, files, label, kind="upload", concurrency=None, book=None, timeout=None, split=None,
+                 optimize=None, images=None, network=None, owner=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.owner = owner  # the Streamlit session that submitted the job
+        self.files = list(files)
+        self.book = book
+        self.label = label
+        self.kind = kind
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.split = split
+        self.optimize = optimize
+        self.images = images
+        self.network = network
+        self.status = "queued"  # queued -> running -> done | failed | cancelled
+        self.progress = 0.0
+        self.message = "Waiting in queue..."
+        self.events = deque(maxlen=MAX_EVENTS_KEPT)
+        self.results = {}
+        self.misses = 0
+        self.hits = 0
+        self.stderr = ""
+        self.created = time.time()
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.status == "queued":
+            self.message = "Cancelling..."
+
+    def partial_results(self):
+        """Per-file results so far, in submission order (finished files only)."""
+        with self._lock:
+            return [self.results[os.path.abspath(p)] for p in self.files if os.path.abspath(p) in self.results]
+
+    def failed(self):
+        return [r for r in self.partial_results() if not r["ok"]]
+
+    def _on_progress(self, fraction, text):
+        self.progress = fraction
+        self.message = text
+
+    def _on_event(self, event):
+        self.events.append(event)
+        if event["event"] in ("cached", "finished", "failed"):
+            with self._lock:
+                self.results[os.path.abspath(event["path"])] = {k: v for k, v in event.items() if k != "event"}
+
+    def _run(self):
+        if self.cancel_event.is_set():
+            self.status, self.message, self.finished = "cancelled", "Cancelled before start.", time.time()
+            return
+
+        self.status = "running"
+        self.message = "Starting..."
+        try:
+            if self.book:
+                self.message = f"Combining {len(self.files)} chapters..."
+                self.files = [build_book(self.files, **self.book)]
+            success, out, err, misses, hits, results = run_conversion_command(
+                self.files, progress_callback=self._on_progress, concurrency=self.concurrency,
+                event_callback=self._on_event, cancel_event=self.cancel_event, timeout=self.timeout,
+                split=self.split, optimize=self.optimize,
+                images=self.images, network=self.network)
+            with self._lock:
+                self.results = {os.path.abspath(p): r for p, r in zip(self.files, results)}
+            self.misses, self.hits, self.stderr = misses, hits, err
+            self.progress = 1.0
+            if self.cancel_event.is_set():
+                self.status, self.message = "cancelled", "Cancelled."
+            elif success:
+                self.status, self.message = "done", f"Rendered {misses}, Cache hits {hits}"
+            else:
+                self.status, self.message = "failed", f"{len(self.failed())} of {len(self.files)} files failed"
+        except Exception as e:
+            self.status, self.message, self.stderr = "failed", f"Runtime Error: {e}", str(e)
+        finally:
+            self.finished = time.time()
+
+class JobManager:
+    """
+    Process-wide queue of conversion jobs, shared by every Streamlit session.
+    Each owner (session) has its own lane: its jobs run one at a time, in order
+    (each job is already parallel inside `run_conversion_command`), so one
+    session's batches queue instead of competing for renderers. Lanes of
+    different owners run side by side, up to `max_running`, so one user's long
+    local batch doesn't hold up everyone else's uploads.
+    """
+
+    def __init__(self, max_running=MAX_RUNNING_JOBS):
+        self.jobs = OrderedDict()
+        self._lanes = {}  # owner -> deque of jobs waiting behind its running one
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix="md2pdf-job")
+
+    def submit(self, files, label, kind="upload", concurrency=None, book=None, timeout=None, split=None, optimize=None,
+               images=None, network=None, owner=None):
+        """Queue a conversion and return its job ID immediately."""
+        job = ConversionJob(files, label, kind=kind, concurrency=concurrency, book=book, timeout=timeout, split=split,
+                            optimize=optimize, images=images, network=network, owner=owner)
+        # Queued uploads must survive cache eviction until the job has run
+        get_evictor().lease(job.id, job.files)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._prune()
+            # Starts now unless one of this owner's jobs is running; then it waits in the lane
+            start = owner not in self._lanes
+            self._lanes.setdefault(owner, deque())
+            if not start:
+                self._lanes[owner].append(job)
+        self._update_queue_depth()
+        if start:
+            self._executor.submit(self._run_job, job)
+        return job.id
+
+    def _run_job(self, job):
+        try:
+            job._run()
+        finally:
+            get_evictor().release(job.id)
+            with self._lock:
+                lane = self._lanes[job.owner]
+                following = lane.popleft() if lane else None
+                if following is None:
+                    del self._lanes[job.owner]
+            if following:
+                self._executor.submit(self._run_job, following)
+        self._update_queue_depth()
+        get_metrics().log("job", id=job.id, kind=job.kind, status=job.status, files=len(job.files),
+                          seconds=round(job.finished - job.created, 2))
+
+    def _update_queue_depth(self):
+        with self._lock:
+            get_metrics().gauge("queue_jobs", sum(1 for j in self.jobs.values() if j.active))
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job:
+            job.cancel()
+
+    def list(self, owner=None):
+        """Newest first; only `owner`'s jobs if given."""
+        with self._lock:
+            return [j for j in reversed(self.jobs.values()) if owner is None or j.owner == owner]
+
+    def _prune(self):
+        finished = [j for j in self.jobs.values() if not j.active]
+        for job in finished[:max(0, len(finished) - MAX_JOBS_KEPT)]:
+            del self.jobs[job.id]
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_job_manager():
+    """The shared job manager (module state survives Streamlit reruns and sessions)."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
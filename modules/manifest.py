@@ -0,0 +1,197 @@
+import os
+import re
+import glob
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    md_path     TEXT PRIMARY KEY,  -- absolute path of the source markdown
+    folder      TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    digest      TEXT,              -- sha256 of the markdown when it was rendered
+    cache_key   TEXT,
+    pdf_path    TEXT NOT NULL,
+    bytes       INTEGER NOT NULL DEFAULT 0,
+    pages       INTEGER,
+    render_ms   INTEGER NOT NULL DEFAULT 0,
+    rendered_at REAL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_folder ON documents (folder, accessed_at);
+CREATE INDEX IF NOT EXISTS documents_pdf ON documents (pdf_path);
+CREATE TABLE IF NOT EXISTS renders (
+    cache_key   TEXT PRIMARY KEY,  -- entry of the content-addressed store
+    bytes       INTEGER NOT NULL DEFAULT 0,
+    pages       INTEGER,
+    render_ms   INTEGER NOT NULL DEFAULT 0,
+    created_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS renders_accessed ON renders (accessed_at);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+"""
+
+PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+
+def pdf_page_count(path):
+    """Pages in a PDF, counted from its page objects (None if it can't be read)."""
+    try:
+        with open(path, "rb") as f:
+            return len(PAGE_OBJECT.findall(f.read())) or None
+    except OSError:
+        return None
+
+class CacheManifest:
+    """
+    SQLite index of the render cache directory: one row per converted document
+    (source, content hash, PDF, size, pages, render time, last access) and one
+    per cached render. Session restore and the viewer query it instead of
+    scanning the directory, so their cost doesn't grow with the cache.
+
+    A connection is opened per call, so a wiped cache directory simply starts
+    a new database and several processes can share one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SCHEMA)
+        return db
+
+    def _run(self, sql, params=(), many=False):
+        with self._lock:
+            db = self._connect()
+            try:
+                with db:
+                    cursor = db.executemany(sql, params) if many else db.execute(sql, params)
+                    return [dict(row) for row in cursor.fetchall()]
+            finally:
+                db.close()
+
+    def record(self, entries):
+        """
+        Store the outcome of a conversion: dicts with "path", "pdf", "bytes", "ms",
+        "cached" and optionally "key", "digest" and "pages". Cache hits keep the
+        page count and render time recorded when the PDF was first rendered.
+        """
+        now = time.time()
+        rows = [(os.path.abspath(e["path"]), os.path.dirname(os.path.abspath(e["path"])),
+                 os.path.basename(e["path"]), e.get("digest"), e.get("key"), os.path.abspath(e["pdf"]),
+                 e.get("bytes", 0), e.get("pages"), 0 if e.get("cached") else e.get("ms", 0),
+                 None if e.get("cached") else now, now)
+                for e in entries]
+        if not rows:
+            return
+        self._run("""
+            INSERT INTO documents (md_path, folder, name, digest, cache_key, pdf_path, bytes, pages,
+                                   render_ms, rendered_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (md_path) DO UPDATE SET
+                digest = excluded.digest,
+                cache_key = excluded.cache_key,
+                pdf_path = excluded.pdf_path,
+                bytes = excluded.bytes,
+                pages = COALESCE(excluded.pages, CASE WHEN documents.cache_key = excluded.cache_key
+                                                      THEN documents.pages END,
+                                 (SELECT pages FROM renders WHERE renders.cache_key = excluded.cache_key)),
+                render_ms = CASE WHEN excluded.rendered_at IS NULL THEN documents.render_ms ELSE excluded.render_ms END,
+                rendered_at = COALESCE(excluded.rendered_at, documents.rendered_at),
+                accessed_at = excluded.accessed_at
+        """, rows, many=True)
+
+    def record_renders(self, entries):
+        """Register new entries of the render store: dicts with "key", "bytes", "pages", "ms"."""
+        now = time.time()
+        self._run("""
+            INSERT INTO renders (cache_key, bytes, pages, render_ms, created_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (cache_key) DO UPDATE SET accessed_at = excluded.accessed_at
+        """, [(e["key"], e.get("bytes", 0), e.get("pages"), e.get("ms", 0), now, now) for e in entries], many=True)
+
+    def touch_renders(self, keys):
+        """Mark store entries as used now (cache hits)."""
+        now = time.time()
+        self._run("UPDATE renders SET accessed_at = ? WHERE cache_key = ?", [(now, key) for key in keys], many=True)
+
+    def documents(self, folder, limit=None):
+        """Documents converted in `folder`, most recently used first."""
+        return self._run("SELECT * FROM documents WHERE folder = ? ORDER BY accessed_at DESC LIMIT ?",
+                         (os.path.abspath(folder), -1 if limit is None else limit))
+
+    def lookup(self, pdf_paths):
+        """pdf path -> row, for the PDFs the manifest knows."""
+        paths = [os.path.abspath(p) for p in pdf_paths]
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            rows = self._run(f"SELECT * FROM documents WHERE pdf_path IN ({','.join('?' * len(chunk))})", chunk)
+            found.update((row["pdf_path"], row) for row in rows)
+        return found
+
+    def entries(self, folder):
+        """
+        Everything eviction may remove, least recently used first: store entries
+        ("render", cache key) and documents converted in or below `folder` ("document", md path).
+        """
+        folder = os.path.abspath(folder)
+        return self._run("""
+            SELECT 'render' AS kind, cache_key AS id, NULL AS pdf_path, NULL AS digest, bytes, accessed_at FROM renders
+            UNION ALL
+            SELECT 'document', md_path, pdf_path, digest, bytes, accessed_at FROM documents
+            WHERE folder = ? OR substr(folder, 1, ?) = ?
+            ORDER BY accessed_at
+        """, (folder, len(folder) + 1, folder + os.sep))
+
+    def forget(self, render_keys=(), md_paths=()):
+        """Drop rows whose files were removed."""
+        with self._lock:
+            db = self._connect()
+            try:
+                with db:
+                    db.executemany("DELETE FROM renders WHERE cache_key = ?", [(k,) for k in render_keys])
+                    db.executemany("DELETE FROM documents WHERE md_path = ?", [(os.path.abspath(p),) for p in md_paths])
+            finally:
+                db.close()
+
+    def stats(self):
+        rows = self._run("SELECT COUNT(*) AS renders, COALESCE(SUM(bytes), 0) AS bytes FROM renders")
+        return rows[0]
+
+    def import_store(self, root):
+        """One-time import of render store entries written before the manifest existed."""
+        marker = f"imported:{os.path.abspath(root)}"
+        if self._run("SELECT value FROM meta WHERE name = ?", (marker,)):
+            return
+        rows = []
+        for pdf_path in glob.glob(os.path.join(root, "??", "*.pdf")):
+            st = os.stat(pdf_path)
+            key = os.path.basename(pdf_path)[:-4]
+            rows.append((key, st.st_size, st.st_mtime, st.st_mtime))
+        self._run("INSERT OR IGNORE INTO renders (cache_key, bytes, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                  rows, many=True)
+        self._run("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (marker, str(time.time())))
+
+    def import_folder(self, folder):
+        """
+        One-time import of md/pdf pairs converted before the manifest existed
+        (the directory scan session restore used to do on every visit).
+        """
+        marker = f"imported:{os.path.abspath(folder)}"
+        if self._run("SELECT value FROM meta WHERE name = ?", (marker,)):
+            return
+        entries = []
+        for md_path in glob.glob(os.path.join(folder, "*.md")):
+            pdf_path = os.path.splitext(md_path)[0] + ".pdf"
+            if os.path.exists(pdf_path):
+                entries.append({"path": md_path, "pdf": pdf_path, "bytes": os.path.getsize(pdf_path),
+                                "pages": pdf_page_count(pdf_path), "cached": True})
+        self.record(entries)
+        self._run("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (marker, str(time.time())))
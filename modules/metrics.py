@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+METRICS_FILE_ENV = "MD2PDF_METRICS_FILE"  # e.g. a node_exporter textfile collector path
+LOG_MAX_BYTES = 2 * 1024 * 1024
+
+logger = logging.getLogger("md2pdf.metrics")
+
+# Exported as md2pdf_<name>_total (counters) and md2pdf_<name> (gauges): name -> help text
+COUNTERS = {
+    "documents_rendered": "Documents rendered by a renderer",
+    "documents_cached": "Documents restored from the render cache",
+    "documents_failed": "Documents that failed to render",
+    "bytes_in": "Markdown bytes read for conversion",
+    "bytes_out": "PDF bytes written",
+    "uploads": "Files saved from the upload tab",
+    "upload_bytes": "Bytes saved from the upload tab",
+    "uploads_deduplicated": "Uploads whose content was already in the upload store",
+    "renderer_starts": "Render worker (Node + Chromium) launches",
+    "retries": "Documents re-rendered after a renderer crash or failed batch",
+    "cache_evictions": "Cache entries removed by the LRU eviction",
+    "cache_evicted_bytes": "Bytes freed by the LRU eviction",
+}
+GAUGES = {
+    "queue_batches": "Batches of the current conversion not yet finished",
+    "queue_jobs": "Conversion jobs queued or running",
+    "renderers_alive": "Warm render workers",
+    "child_rss_mb": "Resident memory of all child processes (MB)",
+    "child_peak_rss_mb": "Peak resident memory of all child processes (MB)",
+    "cache_bytes": "Bytes in the render cache and converted uploads after the last eviction pass",
+    "cache_entries": "Entries in the render cache and converted uploads after the last eviction pass",
+}
+
+class Metrics:
+    """
+    Process-wide conversion metrics: stage timings, counters and gauges.
+    Every observation is also written as a JSON line to the structured log
+    (`metrics.log`), and `write_prometheus` exports the totals in the
+    Prometheus text format (`metrics.prom`).
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.prometheus_path = None
+        self._lock = threading.Lock()
+
+    def configure(self, directory):
+        """Log and export into `directory` (once per process)."""
+        with self._lock:
+            if self.prometheus_path:
+                return
+            self.prometheus_path = os.environ.get(METRICS_FILE_ENV) or os.path.join(directory, "metrics.prom")
+            if not logger.handlers:
+                handler = RotatingFileHandler(os.path.join(directory, "metrics.log"), maxBytes=LOG_MAX_BYTES, backupCount=2)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+
+    def log(self, event, **fields):
+        logger.info(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, default=str))
+
+    def observe(self, stage, ms, **fields):
+        """Record one duration for a stage (milliseconds)."""
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["last_ms"] = ms
+        self.log("stage", stage=stage, ms=round(ms, 1), **fields)
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        """Time a block as `stage`; the yielded dict adds fields to the log line."""
+        extra = dict(fields)
+        started = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            self.observe(stage, (time.perf_counter() - started) * 1000, **extra)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+            if name == "child_rss_mb":
+                self.gauges["child_peak_rss_mb"] = max(self.gauges.get("child_peak_rss_mb", 0), value)
+
+    def cache_hit_ratio(self):
+        hits, rendered = self.counters["documents_cached"], self.counters["documents_rendered"]
+        return hits / (hits + rendered) if hits + rendered else None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "uptime_s": round(time.time() - self.started),
+                "stages": {name: dict(entry) for name, entry in self.stages.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "cache_hit_ratio": self.cache_hit_ratio(),
+            }
+
+    def prometheus_text(self):
+        snap = self.snapshot()
+        lines = [
+            "# HELP md2pdf_stage_seconds Time spent per conversion stage",
+            "# TYPE md2pdf_stage_seconds summary",
+        ]
+        for stage, entry in sorted(snap["stages"].items()):
+            lines.append(f'md2pdf_stage_seconds_sum{{stage="{stage}"}} {entry["total_ms"] / 1000:.6f}')
+            lines.append(f'md2pdf_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+        lines += ["# HELP md2pdf_stage_max_seconds Slowest observation per stage",
+                  "# TYPE md2pdf_stage_max_seconds gauge"]
+        for stage, entry in sorted(snap["stages"].items()):
+            lines.append(f'md2pdf_stage_max_seconds{{stage="{stage}"}} {entry["max_ms"] / 1000:.6f}')
+        for name, help_text in COUNTERS.items():
+            lines += [f"# HELP md2pdf_{name}_total {help_text}", f"# TYPE md2pdf_{name}_total counter",
+                      f"md2pdf_{name}_total {snap['counters'].get(name, 0):g}"]
+        for name, help_text in GAUGES.items():
+            if name in snap["gauges"]:
+                lines += [f"# HELP md2pdf_{name} {help_text}", f"# TYPE md2pdf_{name} gauge",
+                          f"md2pdf_{name} {snap['gauges'][name]:g}"]
+        if snap["cache_hit_ratio"] is not None:
+            lines += ["# HELP md2pdf_cache_hit_ratio Cached documents / all converted documents",
+                      "# TYPE md2pdf_cache_hit_ratio gauge", f"md2pdf_cache_hit_ratio {snap['cache_hit_ratio']:.4f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        """Atomically rewrite the Prometheus text file (no-op until configured)."""
+        if not self.prometheus_path:
+            return
+        tmp = f"{self.prometheus_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp, self.prometheus_path)
+        except OSError:
+            pass
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    """The process-wide metrics registry."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
@@ -0,0 +1,56 @@
+import os
+import json
+import hashlib
+import threading
+
+NETWORK_MODES = ("online", "cache", "offline")
+REMOTE_SCHEMES = ("http://", "https://")
+
+def network_mode(value=None):
+    """
+    How renderers treat remote images, fonts and stylesheets (`value`, else env
+    MD2PDF_NETWORK): "online" fetches them, "cache" serves them from the fetch
+    cache and stores what it had to download, "offline" serves cache hits and
+    blocks everything else at once.
+    """
+    mode = value or os.environ.get("MD2PDF_NETWORK", "online")
+    return mode if mode in NETWORK_MODES else "online"
+
+class FetchCache:
+    """
+    Remote resources stored by URL: the body under `root/<2 hex>/<sha256 of url>`
+    and `<body>.json` with the URL and content type. render_worker.js reads and
+    writes the same layout, so either side can fill it for the other. An
+    air-gapped machine can use a copy of a cache filled in "cache" mode elsewhere
+    (point MD2PDF_FETCH_CACHE at it).
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, url):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get(self, url):
+        """(body, content type) for a cached URL, or None."""
+        path = self.path_for(url)
+        try:
+            with open(path + ".json", encoding="utf-8") as f:
+                content_type = json.load(f).get("content_type")
+            with open(path, "rb") as f:
+                return f.read(), content_type
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, body, content_type=None):
+        path = self.path_for(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(path + suffix, "wb") as f:
+            f.write(body)
+        os.replace(path + suffix, path)
+        # The sidecar goes last: readers treat a body without one as a miss
+        with open(path + ".json" + suffix, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "content_type": content_type}, f)
+        os.replace(path + ".json" + suffix, path + ".json")
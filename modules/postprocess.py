@@ -0,0 +1,211 @@
+import io
+import os
+import math
+import time
+import zlib
+import hashlib
+import threading
+
+try:
+    import pikepdf
+except ImportError:  # pikepdf is optional: without it PDFs are kept as rendered
+    pikepdf = None
+try:
+    from PIL import Image
+except ImportError:  # without Pillow images are deduplicated but not resampled
+    Image = None
+
+OPTIMIZE_DPI = 0      # target image resolution of the optimize stage (MD2PDF_OPTIMIZE_DPI; 0 = off)
+DEFAULT_DPI = 150     # what `--optimize` without a value asks for
+JPEG_QUALITY = 85
+DPI_SLACK = 1.25      # images within this factor of the target are left alone
+POSTPROCESS_VERSION = 1  # bump when the output of `optimize_pdf` changes (part of the cache key)
+
+def optimize_dpi(value=None):
+    """Target image DPI of the optimize stage (`value`, else env MD2PDF_OPTIMIZE_DPI; 0 = off)."""
+    if value is not None:
+        return value
+    override = os.environ.get("MD2PDF_OPTIMIZE_DPI", "")
+    return int(override) if override.isdigit() else OPTIMIZE_DPI
+
+def optimize_available():
+    return pikepdf is not None
+
+def optimize_options(dpi):
+    """Cache key entry for the stage, so optimized and plain renders are cached apart."""
+    return {"dpi": dpi, "version": POSTPROCESS_VERSION, "resample": Image is not None}
+
+def _stream_digest(obj, *parts):
+    h = hashlib.sha256(obj.read_raw_bytes())
+    for part in parts:
+        h.update(repr(part).encode())
+    return h.hexdigest()
+
+def _image_digest(image):
+    header = [str(image.get(key)) for key in ("/Width", "/Height", "/BitsPerComponent", "/ColorSpace", "/Filter", "/DecodeParms")]
+    smask = image.get("/SMask")
+    return _stream_digest(image, header, _stream_digest(smask) if smask is not None else None)
+
+def _page_xobjects(page):
+    resources = page.obj.get("/Resources")
+    return resources.get("/XObject") if resources is not None else None
+
+def _page_fonts(page):
+    resources = page.obj.get("/Resources")
+    return resources.get("/Font") if resources is not None else None
+
+def _dedupe_images(pdf):
+    """Point every use of identical image data at one object. Returns the number of references replaced."""
+    seen, replaced = {}, 0
+    for page in pdf.pages:
+        xobjects = _page_xobjects(page)
+        if xobjects is None:
+            continue
+        for name in list(xobjects.keys()):
+            image = xobjects[name]
+            if image.get("/Subtype") != "/Image":
+                continue
+            first = seen.setdefault(_image_digest(image), image)
+            if first.objgen != image.objgen:
+                xobjects[name] = first
+                replaced += 1
+    return replaced
+
+def _descriptors(font):
+    """Font descriptors of a font dict, including a Type0 font's descendant."""
+    if font.get("/Subtype") == "/Type0":
+        for descendant in font.get("/DescendantFonts", []):
+            yield from _descriptors(descendant)
+    descriptor = font.get("/FontDescriptor")
+    if descriptor is not None:
+        yield descriptor
+
+def _dedupe_fonts(pdf):
+    """
+    Share identical embedded font programs (merged split parts each carry their
+    own copy of the same subset). Returns the number of references replaced.
+    """
+    seen, replaced = {}, 0
+    for page in pdf.pages:
+        fonts = _page_fonts(page)
+        if fonts is None:
+            continue
+        for name in list(fonts.keys()):
+            for descriptor in _descriptors(fonts[name]):
+                for key in ("/FontFile", "/FontFile2", "/FontFile3"):
+                    program = descriptor.get(key)
+                    if program is None:
+                        continue
+                    first = seen.setdefault(_stream_digest(program, key, str(program.get("/Subtype"))), program)
+                    if first.objgen != program.objgen:
+                        descriptor[key] = first
+                        replaced += 1
+    return replaced
+
+def _multiply(m, ctm):
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = ctm
+    return (a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D, e * A + f * C + E, e * B + f * D + F)
+
+def _drawn_sizes(pdf):
+    """Image objgen -> largest (width, height) in points it is drawn at on a page."""
+    sizes = {}
+    for page in pdf.pages:
+        xobjects = _page_xobjects(page)
+        if xobjects is None:
+            continue
+        ctm, stack = (1, 0, 0, 1, 0, 0), []
+        for operands, operator in pikepdf.parse_content_stream(page, "q Q cm Do"):
+            op = str(operator)
+            if op == "q":
+                stack.append(ctm)
+            elif op == "Q":
+                ctm = stack.pop() if stack else (1, 0, 0, 1, 0, 0)
+            elif op == "cm":
+                ctm = _multiply(tuple(float(v) for v in operands), ctm)
+            elif op == "Do":
+                image = xobjects.get(operands[0])
+                if image is None or image.get("/Subtype") != "/Image":
+                    continue
+                width, height = math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3])
+                previous = sizes.get(image.objgen, (0, 0))
+                sizes[image.objgen] = (max(previous[0], width), max(previous[1], height))
+    return sizes
+
+def _downsample(pdf, dpi):
+    """
+    Resample images drawn above `dpi` down to it: JPEGs stay JPEG (re-encoded),
+    losslessly stored images stay lossless. Images with masks, unusual color
+    spaces or ones only used inside forms are left alone. Returns images changed.
+    """
+    changed = 0
+    sizes = _drawn_sizes(pdf)
+    done = set()
+    for page in pdf.pages:
+        xobjects = _page_xobjects(page)
+        if xobjects is None:
+            continue
+        for name in list(xobjects.keys()):
+            image = xobjects[name]
+            if image.objgen in done or image.objgen not in sizes or image.get("/Subtype") != "/Image":
+                continue
+            done.add(image.objgen)
+            if any(key in image for key in ("/SMask", "/Mask", "/ImageMask")) or image.get("/BitsPerComponent") != 8:
+                continue
+            if str(image.get("/ColorSpace")) not in ("/DeviceRGB", "/DeviceGray"):
+                continue
+            drawn_w, drawn_h = sizes[image.objgen]
+            width, height = int(image["/Width"]), int(image["/Height"])
+            scale = min(1.0, dpi * drawn_w / 72 / width if drawn_w else 1.0, dpi * drawn_h / 72 / height if drawn_h else 1.0)
+            if scale * DPI_SLACK >= 1:
+                continue
+            try:
+                picture = pikepdf.PdfImage(image).as_pil_image()
+            except Exception:
+                continue
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            picture = picture.resize(size, Image.LANCZOS)
+            jpeg = str(image.get("/Filter")) == "/DCTDecode"
+            if jpeg:
+                buffer = io.BytesIO()
+                picture.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True)
+                data, codec = buffer.getvalue(), pikepdf.Name.DCTDecode
+            else:
+                data, codec = zlib.compress(picture.tobytes(), 9), pikepdf.Name.FlateDecode
+            if len(data) >= len(image.read_raw_bytes()):
+                continue
+            image.write(data, filter=codec)
+            image.Width, image.Height = size
+            if "/DecodeParms" in image:
+                del image["/DecodeParms"]
+            changed += 1
+    return changed
+
+def optimize_pdf(path, dpi=DEFAULT_DPI):
+    """
+    Rewrite a rendered PDF in place: identical images and font programs shared,
+    images resampled to `dpi`, unused objects dropped, streams compressed into
+    object streams, and the file linearized so viewers can show the first page
+    before the rest arrives. Chromium already embeds only the glyphs it uses, so
+    fonts need no further subsetting. The original is kept if the result is
+    larger. Returns {"before", "after", "images", "fonts", "ms"}.
+    """
+    started = time.perf_counter()
+    before = os.path.getsize(path)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.opt.tmp"
+    with pikepdf.open(path) as pdf:
+        images = _dedupe_images(pdf)
+        fonts = _dedupe_fonts(pdf)
+        if Image is not None and dpi:
+            images += _downsample(pdf, dpi)
+        pdf.remove_unreferenced_resources()
+        pdf.save(tmp, linearize=True, compress_streams=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    after = os.path.getsize(tmp)
+    if after < before:
+        os.replace(tmp, path)
+    else:
+        os.remove(tmp)
+        after = before
+    return {"before": before, "after": after, "images": images, "fonts": fonts,
+            "ms": round((time.perf_counter() - started) * 1000)}
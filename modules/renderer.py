@@ -0,0 +1,320 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+
+from modules.metrics import get_metrics
+from modules.environment import ROOT_DIR, default_launch_options, get_environment, install_dependencies
+
+WORKER_SCRIPT = os.path.join(ROOT_DIR, "render_worker.js")
+
+RENDER_TIMEOUT = 120  # seconds per document (MD2PDF_TIMEOUT overrides)
+STARTUP_TIMEOUT = 60  # seconds for Node + Chromium to come up
+HANG_GRACE = 30       # extra seconds before a silent worker is considered hung
+MAX_CRASHES = 3       # worker restarts within one render() call
+
+# Error prefix for files a worker was rendering when it died; the culprit is
+# unknown until each of them is retried alone
+CRASH_ERROR = "Renderer crashed while rendering this file"
+
+def render_timeout():
+    """Per-file timeout in seconds."""
+    override = os.environ.get("MD2PDF_TIMEOUT", "")
+    return int(override) if override.isdigit() and int(override) > 0 else RENDER_TIMEOUT
+
+def daemon_available():
+    """The warm worker needs `node` and a local `md-to-pdf` install (npm install)."""
+    env = get_environment()
+    return bool(env["node"] and env["md_to_pdf"])
+
+def file_result(path, pdf=None, error=None, ms=0, size=0, cached=False):
+    """Per-document outcome shared by the worker, the CLI fallback and the cache."""
+    return {"path": path, "pdf": pdf, "ok": pdf is not None and error is None, "error": error,
+            "ms": ms, "bytes": size, "cached": cached}
+
+class RenderDaemon:
+    """
+    Long-lived `render_worker.js` process that keeps one Chromium warm.
+    Jobs are sent as JSON lines over stdin; per-file events come back on stdout.
+    The worker is (re)started lazily, so a crash only costs the next job a relaunch.
+    """
+
+    def __init__(self, launch_options=None, pages=2):
+        self.launch_options = default_launch_options() if launch_options is None else launch_options
+        self.pages = pages
+        self.proc = None
+        self.info = {}
+        self.restarts = 0
+        self._events = None
+        self._stderr = deque(maxlen=50)
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        """Spawn the worker and wait for Chromium to be ready."""
+        if self.alive():
+            return
+        if self.proc is not None:
+            self.restarts += 1
+
+        env = dict(os.environ)
+        env["MD2PDF_LAUNCH_OPTIONS"] = json.dumps(self.launch_options)
+        env["MD2PDF_PAGES"] = str(self.pages)
+
+        self._events = queue.Queue()
+        self._stderr.clear()
+        started = time.perf_counter()
+        self.proc = subprocess.Popen(
+            [get_environment()["node"] or "node", WORKER_SCRIPT],
+            cwd=ROOT_DIR, env=env, text=True, bufsize=1,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        threading.Thread(target=self._read_stdout, args=(self.proc, self._events), daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(self.proc,), daemon=True).start()
+
+        ready = self._next_event(STARTUP_TIMEOUT)
+        if not ready or ready.get("event") != "ready":
+            self.kill()
+            raise RuntimeError(f"Renderer failed to start: {self.stderr_tail()}")
+        self.info = ready
+
+        metrics = get_metrics()
+        metrics.count("renderer_starts")
+        metrics.observe("node_start", ready.get("node_ms", 0), pid=ready.get("pid"))
+        metrics.observe("chromium_launch", ready.get("launch_ms", 0), pid=ready.get("pid"))
+        metrics.observe("renderer_ready", (time.perf_counter() - started) * 1000, pid=ready.get("pid"), restart=self.restarts > 0)
+
+    def warm(self):
+        """Start the worker now rather than on its first job."""
+        with self._lock:
+            self.start()
+
+    def stop(self):
+        """Close stdin so the worker shuts Chromium down cleanly."""
+        if self.alive():
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=10)
+            except Exception:
+                self.kill()
+
+    def kill(self):
+        if self.alive():
+            self.proc.kill()
+            self.proc.wait()
+
+    def stderr_tail(self):
+        return "\n".join(self._stderr)
+
+    def render(self, file_paths, basedir=None, timeout=RENDER_TIMEOUT, on_event=None, assets=None, network=None):
+        """
+        Render markdown files to PDFs next to them.
+        `on_event` is called with each "started" / "finished" / "failed" event as it
+        arrives (on this thread). Returns one dict per input:
+        {"path", "pdf", "ok", "error", "ms", "bytes"}.
+
+        `timeout` applies per file. If the worker dies or hangs, the files it was
+        rendering at that moment fail with CRASH_ERROR (callers may retry them
+        alone) and the files it never reached are sent again on a fresh worker.
+        `assets` maps original image paths to copies the worker serves instead.
+        `network` ({"mode", "cache"}, see modules/offline.py) decides how remote
+        resources are fetched; URLs it refused are listed under "blocked".
+        """
+        paths = [os.path.abspath(p) for p in file_paths]
+        results = {}
+        with self._lock:
+            for attempt in range(MAX_CRASHES):
+                pending = [p for p in paths if p not in results]
+                if not pending:
+                    break
+                self.start()
+                suspects = self._render_once(pending, basedir or os.getcwd(), timeout, results, on_event, assets, network)
+                if suspects is None:
+                    break
+                tail = self.stderr_tail()
+                for p in suspects:
+                    results[p] = file_result(p, error=f"{CRASH_ERROR}{': ' + tail if tail else ''}")
+                    if on_event:
+                        on_event(dict(results[p], event="failed"))
+
+        for p in paths:
+            if p not in results:
+                results[p] = file_result(p, error=f"{CRASH_ERROR} (gave up after {MAX_CRASHES} restarts): {self.stderr_tail()}")
+                if on_event:
+                    on_event(dict(results[p], event="failed"))
+        return [results[p] for p in paths]
+
+    def _render_once(self, paths, basedir, timeout, results, on_event=None, assets=None, network=None):
+        """
+        Send one job and collect its events. Returns None when the job completed,
+        or the files that were in flight if the worker died or stopped responding.
+        """
+        self._next_id += 1
+        job_id = self._next_id
+        in_flight = {}
+        try:
+            self._send({"id": job_id, "op": "render", "files": paths, "basedir": os.path.abspath(basedir),
+                        "timeout": int(timeout * 1000), "assets": assets or {}, "network": network or {"mode": "online"}})
+        except OSError:
+            self.kill()
+            return []
+
+        while True:
+            # The worker enforces per-file timeouts itself; this guards against a hung
+            # browser: the oldest file in flight gets its timeout plus a grace period.
+            oldest = min(in_flight.values(), default=time.monotonic())
+            msg = self._next_event(max(1, oldest + timeout + HANG_GRACE - time.monotonic()))
+            if msg is None or msg.get("event") == "exit":
+                self.kill()
+                return list(in_flight)
+            if msg.get("id") != job_id:
+                continue
+            event = msg.get("event")
+            if event == "started":
+                in_flight[msg["path"]] = time.monotonic()
+                if on_event:
+                    on_event({"event": "started", "path": msg["path"]})
+            elif event in ("finished", "failed"):
+                in_flight.pop(msg["path"], None)
+                result = file_result(msg["path"], pdf=msg.get("pdf"), error=msg.get("error"), ms=msg.get("ms", 0), size=msg.get("bytes", 0))
+                if msg.get("blocked"):
+                    result["blocked"] = msg["blocked"]
+                results[msg["path"]] = result
+                if on_event:
+                    # Per-stage timings from the worker ride along on the event only
+                    on_event(dict(result, event=event, stages=msg.get("stages", {})))
+            elif event == "error":
+                for p in paths:
+                    results.setdefault(p, file_result(p, error=msg.get("error")))
+                return None
+            elif event == "done":
+                return None
+
+    def _send(self, message):
+        self.proc.stdin.write(json.dumps(message) + "\n")
+        self.proc.stdin.flush()
+
+    def _next_event(self, timeout):
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    @staticmethod
+    def _read_stdout(proc, events):
+        for line in proc.stdout:
+            try:
+                events.put(json.loads(line))
+            except ValueError:
+                continue
+        events.put({"event": "exit"})
+
+    def _read_stderr(self, proc):
+        for line in proc.stderr:
+            self._stderr.append(line.rstrip())
+
+class RenderPool:
+    """
+    Bounded set of warm workers. Each worker serves one batch at a time;
+    concurrency is bounded by the caller's thread pool, not here.
+    """
+
+    def __init__(self):
+        self.workers = []
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def worker(self):
+        """Check out an idle worker, spawning a new one if all are busy."""
+        with self._lock:
+            if self._idle:
+                daemon = self._idle.pop()
+            else:
+                daemon = RenderDaemon()
+                self.workers.append(daemon)
+        try:
+            yield daemon
+        finally:
+            with self._lock:
+                self._idle.append(daemon)
+
+    def prestart(self, size):
+        """
+        Launch workers until `size` exist. They are idle (so jobs can check them
+        out) while still starting; a job that gets one waits for it to be ready.
+        """
+        with self._lock:
+            new = [RenderDaemon() for _ in range(size - len(self.workers))]
+            self.workers.extend(new)
+            self._idle.extend(new)
+        for daemon in new:
+            daemon.warm()
+
+    def shrink(self, size):
+        """Stop idle workers beyond `size` so a lowered override frees memory."""
+        with self._lock:
+            while len(self.workers) > size and self._idle:
+                daemon = self._idle.pop(0)
+                self.workers.remove(daemon)
+                daemon.stop()
+
+    def alive_count(self):
+        return sum(1 for d in self.workers if d.alive())
+
+    def stop(self):
+        for daemon in self.workers:
+            daemon.stop()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Process-wide worker pool shared by the Streamlit sessions and the CLI."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool()
+            atexit.register(_pool.stop)
+        return _pool
+
+_warm_up = None
+_warm_up_lock = threading.Lock()
+
+def start_warm_up(workers=1):
+    """
+    Once per process, in the background: install or verify the Node dependencies
+    and launch `workers` renderers, so the first conversion finds Chromium up.
+    MD2PDF_WARM_UP=0 turns it off. Returns the warm-up thread.
+    """
+    global _warm_up
+    with _warm_up_lock:
+        if _warm_up is None:
+            _warm_up = threading.Thread(target=_run_warm_up, args=(workers,), name="md2pdf-warm-up", daemon=True)
+            if os.environ.get("MD2PDF_WARM_UP", "1") != "0":
+                _warm_up.start()
+        return _warm_up
+
+def warming_up():
+    return _warm_up is not None and _warm_up.is_alive()
+
+def _run_warm_up(workers):
+    metrics = get_metrics()
+    with metrics.timer("warm_up") as fields:
+        install_dependencies()
+        fields["workers"] = 0
+        if daemon_available():
+            try:
+                get_pool().prestart(workers)
+                fields["workers"] = workers
+            except Exception as e:
+                # The first conversion retries the launch and reports the error
+                fields["error"] = str(e)
@@ -0,0 +1,242 @@
+import os
+import re
+import threading
+from urllib.parse import quote, unquote
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NullObject, NumberObject
+except ImportError:  # pypdf is optional: without it large documents render in one piece
+    PdfReader = PdfWriter = None
+
+from modules.book import FENCE, HEADING
+from modules.deps import FRONT_MATTER
+
+SPLIT_MB = 0      # markdown larger than this renders in parts (MD2PDF_SPLIT_MB; 0 = off)
+PART_MB = 0.5     # target markdown per part; bounds what one renderer holds in memory
+# Links that cross parts point here while rendering; merging turns them back into internal links
+LINK_PREFIX = "https://md2pdf-part.invalid/"
+PART_NAME = re.compile(r"^\..+\.part-\d{3}\.md$")
+# Header/footer templates print page numbers, which would restart in every part
+PAGE_NUMBERS = re.compile(r"displayHeaderFooter|headerTemplate|footerTemplate")
+FRAGMENT_LINK = re.compile(r"(\]\(\s*<?|href=[\"'])#([^)\s>\"']+)")
+ID_ATTR = re.compile(r"\b(?:id|name)=[\"']([^\"']+)[\"']")
+SLUG_PUNCTUATION = re.compile(r"[\u2000-\u206F\u2E00-\u2E7F\\'!\"#$%&()*+,./:;<=>?@\[\]^`{|}~]")
+
+def split_mb(value=None):
+    """Size above which documents are split, in MB (`value`, else env MD2PDF_SPLIT_MB; 0 = off)."""
+    if value is not None:
+        return value
+    override = os.environ.get("MD2PDF_SPLIT_MB", "")
+    return float(override) if override.replace(".", "", 1).isdigit() else SPLIT_MB
+
+def merge_available():
+    return PdfReader is not None
+
+def is_part(path):
+    """True for the temporary part files written by `split_document`."""
+    return bool(PART_NAME.match(os.path.basename(path)))
+
+def part_path(md_path, number):
+    folder, name = os.path.split(md_path)
+    return os.path.join(folder, f".{os.path.splitext(name)[0]}.part-{number:03d}.md")
+
+def splittable(md_path, threshold):
+    """True if `md_path` is over `threshold` MB and can be rendered in parts."""
+    if not threshold or not merge_available() or is_part(md_path):
+        return False
+    try:
+        if os.path.getsize(md_path) <= threshold * 1024 * 1024:
+            return False
+        with open(md_path, encoding="utf-8", errors="replace") as f:
+            front = FRONT_MATTER.match(f.read(65536))
+    except OSError:
+        return False
+    return not (front and PAGE_NUMBERS.search(front.group(0)))
+
+def _slug(text, seen):
+    """Heading id the way marked's slugger makes it (lowercase, no punctuation, '-2' for repeats)."""
+    slug = re.sub(r"<[!/a-z].*?>", "", text.lower().strip(), flags=re.IGNORECASE)
+    slug = re.sub(r"\s", "-", SLUG_PUNCTUATION.sub("", slug))
+    if slug in seen:
+        base, count = slug, seen[slug]
+        while slug in seen:
+            count += 1
+            slug = f"{base}-{count}"
+        seen[base] = count
+    seen[slug] = 0
+    return slug
+
+def _outside_fences(lines):
+    """Indexes of lines that are not inside fenced code blocks."""
+    fence = None
+    for i, line in enumerate(lines):
+        match = FENCE.match(line)
+        if match:
+            marker = match.group(1)
+            if fence is None:
+                fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence):
+                fence = None
+            continue
+        if fence is None:
+            yield i
+
+def split_document(md_path, part_mb=PART_MB):
+    """
+    Write `md_path` as part files next to it (so relative assets still resolve),
+    cut at top-level headings into pieces of about `part_mb`. Every part keeps
+    the document's front matter; headings get explicit anchors, and links to an
+    anchor in another part are pointed at LINK_PREFIX for `merge_parts` to
+    resolve. Returns the part paths, or [] if the document has nothing to cut at.
+    """
+    with open(md_path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    front = FRONT_MATTER.match(text)
+    head = front.group(0) if front else ""
+    lines = text[len(head):].splitlines(keepends=True)
+    prose = list(_outside_fences(lines))
+
+    headings, seen = [], {}
+    for i in prose:
+        match = HEADING.match(lines[i].rstrip("\r\n"))
+        if match:
+            level, title = len(match.group(1)), match.group(2)
+            slug = _slug(title, seen)
+            # The anchor sits inside the heading, as in book mode, so it adds no blank paragraph
+            lines[i] = f"{'#' * level} <a id=\"{slug}\"></a>{title}\n"
+            headings.append((i, level, slug))
+    if not headings:
+        return []
+    top = min(level for _, level, _ in headings)
+    cuts = [i for i, level, _ in headings if level == top and i > 0]
+
+    # Consecutive top-level sections are grouped until a part reaches part_mb
+    limit = part_mb * 1024 * 1024
+    bounds, start, size, section = [], 0, 0, 0
+    for cut in cuts + [len(lines)]:
+        size += sum(len(line.encode("utf-8")) for line in lines[section:cut])
+        section = cut
+        if size >= limit or cut == len(lines):
+            bounds.append((start, cut))
+            start, size = cut, 0
+    if len(bounds) < 2:
+        return []
+
+    owner = {}  # anchor -> part number
+    for number, (first, last) in enumerate(bounds):
+        for i in prose:
+            if first <= i < last:
+                for anchor in ID_ATTR.findall(lines[i]):
+                    owner.setdefault(anchor, number)
+
+    targets = [set() for _ in bounds]  # anchors each part must keep for links from other parts
+    for number, (first, last) in enumerate(bounds):
+        for i in prose:
+            if first <= i < last:
+                def relink(match):
+                    anchor = unquote(match.group(2))
+                    if owner.get(anchor, number) == number:
+                        return match.group(0)
+                    targets[owner[anchor]].add(anchor)
+                    return f"{match.group(1)}{LINK_PREFIX}{quote(anchor)}"
+                lines[i] = FRAGMENT_LINK.sub(relink, lines[i])
+
+    paths = []
+    for number, (first, last) in enumerate(bounds):
+        path = part_path(md_path, number + 1)
+        body = "".join(lines[first:last])
+        if targets[number]:
+            # Linked anchors get a named destination in the part's PDF
+            links = "".join(f'<a href="#{anchor}"></a>' for anchor in sorted(targets[number]))
+            body += f'\n\n<div style="display: none;">{links}</div>\n'
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(head + body)
+        paths.append(path)
+    return paths
+
+def remove_parts(paths):
+    """Delete part files and the PDFs rendered from them."""
+    for path in paths:
+        for leftover in (path, os.path.splitext(path)[0] + ".pdf"):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+
+def _destinations(reader, offset):
+    """Named destination -> (page index in the merged PDF, top) for one part."""
+    found = {}
+    for name, dest in reader.named_destinations.items():
+        try:
+            page = reader.get_destination_page_number(dest)
+        except Exception:
+            continue
+        if page >= 0:
+            found[str(name).lstrip("/")] = (offset + page, dest.get("/Top"))
+    return found
+
+def merge_parts(part_pdfs, pdf_path):
+    """
+    Concatenate the PDFs of a split document into `pdf_path`. Bookmarks of the
+    parts are kept; links into another part (LINK_PREFIX) and named links are
+    turned into direct links to the target page. Returns the page count.
+    """
+    writer = PdfWriter()
+    starts, local = [], []
+    for number, part in enumerate(part_pdfs):
+        reader = PdfReader(part)
+        if number == 0 and reader.metadata:
+            writer.add_metadata(reader.metadata)
+        starts.append(len(writer.pages))
+        local.append(_destinations(reader, len(writer.pages)))
+        writer.append(reader, import_outline=True)
+    anchors = {}
+    for dests in local:
+        for name, target in dests.items():
+            anchors.setdefault(name, target)
+
+    for number, start in enumerate(starts):
+        end = starts[number + 1] if number + 1 < len(starts) else len(writer.pages)
+        for index in range(start, end):
+            page = writer.pages[index]
+            if "/Annots" not in page:
+                continue
+            kept = ArrayObject()
+            for ref in page["/Annots"]:
+                annot = ref.get_object()
+                target, dead = _link_target(annot, local[number], anchors)
+                if target:
+                    page_index, top = target
+                    annot[NameObject("/A")] = DictionaryObject({
+                        NameObject("/S"): NameObject("/GoTo"),
+                        NameObject("/D"): ArrayObject([writer.pages[page_index].indirect_reference, NameObject("/XYZ"),
+                                                       NullObject(), NumberObject(top) if top is not None else NullObject(),
+                                                       NullObject()]),
+                    })
+                    annot.pop(NameObject("/Dest"), None)
+                if not dead:
+                    kept.append(ref)
+            page[NameObject("/Annots")] = kept
+
+    tmp = f"{pdf_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        writer.write(f)
+    os.replace(tmp, pdf_path)
+    return len(writer.pages)
+
+def _link_target(annot, local, anchors):
+    """(target, dead) for a link annotation: where it should point, and whether it can only be dropped."""
+    if annot.get("/Subtype") != "/Link":
+        return None, False
+    action = annot.get("/A")
+    action = action.get_object() if action is not None else {}
+    if action.get("/S") == "/URI" and str(action.get("/URI", "")).startswith(LINK_PREFIX):
+        # A cross-part link whose anchor never made it into a PDF has nowhere to go
+        target = anchors.get(unquote(str(action["/URI"])[len(LINK_PREFIX):]))
+        return target, target is None
+    name = annot.get("/Dest") if "/Dest" in annot else action.get("/D") if action.get("/S") == "/GoTo" else None
+    if isinstance(name, str):
+        # Named destinations of different parts can share a name; resolve against the link's own part
+        return local.get(name.lstrip("/")), False
+    return None, False
@@ -87,6 +87,22 @@ PREMIUM_STYLE = """
         color: #3b82f6;
         background-color: white;
     }
+    a.download-link {
+        display: block;
+        text-align: center;
+        text-decoration: none;
+        background-color: #f1f5f9;
+        color: #334155 !important;
+        border: 1px solid #cbd5e1;
+        border-radius: 8px;
+        font-weight: 600;
+        padding: 0.6rem 1rem;
+    }
+    a.download-link:hover {
+        border-color: #3b82f6;
+        color: #3b82f6 !important;
+        background-color: white;
+    }
 
     /* Inputs */
     div[data-testid="stFileUploader"] {
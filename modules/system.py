@@ -0,0 +1,95 @@
+import os
+
+RENDERER_MEMORY_MB = 400  # rough footprint of one worker: Node + Chromium + 2 pages
+
+def available_memory_mb():
+    """MemAvailable from /proc/meminfo, or None where it can't be read (macOS/Windows)."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def memory_limit_mb():
+    """
+    Memory this process may use: MemTotal, or the container's cgroup limit if lower.
+    None where neither can be read.
+    """
+    limits = []
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    limits.append(int(line.split()[1]) // 1024)
+                    break
+    except (OSError, ValueError):
+        pass
+    # cgroup v2, then v1 ("max" / a huge number mean unlimited)
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            limits.append(int(value) // (1024 * 1024))
+        break
+    return min(limits) if limits else None
+
+def default_concurrency():
+    """
+    Number of render workers to run in parallel.
+    MD2PDF_JOBS overrides; otherwise bounded by CPU cores and free memory.
+    """
+    override = os.environ.get("MD2PDF_JOBS", "")
+    if override.isdigit() and int(override) > 0:
+        return int(override)
+
+    # Each worker renders 2 pages and Chromium forks helper processes, so half the cores
+    jobs = max(1, (os.cpu_count() or 1) // 2)
+    memory = available_memory_mb()
+    if memory is not None:
+        jobs = min(jobs, max(1, memory // RENDERER_MEMORY_MB))
+    return jobs
+
+def descendant_pids(pid=None):
+    """All live descendants of `pid` (default: this process), read from /proc. Empty elsewhere."""
+    pid = os.getpid() if pid is None else pid
+    children = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after the last ')'
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+def rss_mb(pids):
+    """Summed resident memory (VmRSS) of the given processes, in MB."""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except (OSError, ValueError):
+            continue
+    return total / 1024
@@ -1,7 +1,20 @@
 import streamlit as st
 import os
-import glob
-from modules.utils import run_conversion_command, create_zip, display_pdf, check_dependencies, is_cloud
+from datetime import datetime
+from modules.utils import create_zip, find_zip, zip_volumes, ZIP_KEEP, static_url, display_pdf, check_dependencies, get_dependency_index, get_evictor, get_manifest, get_upload_store, is_cloud, MAX_STATIC_FILE_SIZE
+from modules.jobs import get_job_manager
+from modules.file_index import DEFAULT_IGNORE_PATTERNS, get_file_index
+from modules.renderer import daemon_available, get_pool, render_timeout, warming_up
+from modules.environment import get_environment
+from modules.system import default_concurrency
+from modules.metrics import get_metrics
+from modules.batching import get_governor
+from modules.watcher import start_watch, stop_watch, get_watch
+from modules.backends import CHOICES, get_router
+from modules.split import merge_available, split_mb
+from modules.postprocess import DEFAULT_DPI, optimize_available, optimize_dpi
+from modules.assets import asset_dpi, assets_available
+from modules.offline import NETWORK_MODES, network_mode
 
 def render_sidebar_shared(slot="bottom"):
     """Render shared sidebar elements (Status, Nav, Version)."""
@@ -11,9 +24,26 @@ def render_sidebar_shared(slot="bottom"):
     st.markdown("### System Status")
     if npx_path:
         st.success(f"**Ready** (`{os_name}`)")
+    elif get_router().get("python").available():
+        st.warning("🟡 **Node.js Missing**: plain documents only (Python renderer)")
     else:
         st.error("🔴 **Node.js Missing**")
         st.stop()
+    if warming_up():
+        st.caption("🔥 Warming up renderer...")
+    elif daemon_available():
+        pool = get_pool()
+        warm = pool.alive_count()
+        if warm:
+            restarts = sum(d.restarts for d in pool.workers)
+            st.caption(f"⚡ {warm} renderer(s) warm (restarts: {restarts})")
+        else:
+            st.caption("💤 Renderer idle (starts on first conversion)")
+    cached = get_manifest().stats()
+    if cached["renders"]:
+        st.caption(f"🗄️ Render cache: {cached['renders']} PDFs · {cached['bytes'] / (1024 * 1024):.1f} MB")
+    render_environment_panel()
+    render_metrics_panel()
     st.divider()
 
     # Navigation (Only needed if we are NOT in viewer, or as a secondary nav)
@@ -24,6 +54,179 @@ def render_sidebar_shared(slot="bottom"):
         st.divider()
         st.caption("v3.3 Optimized | by KhoiBui16")
 
+def describe_pdf(row):
+    """Tooltip for a viewer entry from its manifest row."""
+    if not row:
+        return None
+    parts = [f"{row['pages']} pages" if row["pages"] else None, f"{row['bytes'] / 1024:.0f} KB"]
+    if row["render_ms"]:
+        parts.append(f"rendered in {row['render_ms'] / 1000:.1f}s")
+    return " · ".join(p for p in parts if p)
+
+def render_environment_panel():
+    """What the cached host probe found (see modules/environment.py)."""
+    env = get_environment()
+    with st.expander("🧰 Environment", expanded=False):
+        st.markdown(
+            f"- **Node.js**: `{env['node'] or 'not found'}`\n"
+            f"- **md-to-pdf**: `{env['engine']}`{' (local)' if env['md_to_pdf_bin'] else ''}\n"
+            f"- **Chromium**: `{env['chromium'] or 'bundled / unknown'}`\n"
+            f"- **Launch flags**: `{' '.join(env['launch_options'].get('args', [])) or 'none'}`\n"
+            f"- **Python renderer**: {'available' if get_router().get('python').available() else 'not installed (markdown + weasyprint)'}")
+        st.caption(f"Probed once per process in {env['probe_ms']} ms")
+
+def render_metrics_panel():
+    """Compact view of the process metrics (also in metrics.prom / metrics.log in the cache dir)."""
+    snap = get_metrics().snapshot()
+    counters, gauges, stages = snap["counters"], snap["gauges"], snap["stages"]
+    with st.expander("📈 Metrics", expanded=False):
+        if not stages:
+            st.caption("No conversions yet.")
+            return
+        ratio = snap["cache_hit_ratio"]
+        c1, c2 = st.columns(2)
+        c1.metric("Rendered", f"{counters.get('documents_rendered', 0):.0f}")
+        c2.metric("Cache hits", "—" if ratio is None else f"{ratio:.0%}")
+        lines = []
+        for name, label in (("render_parse", "Parse"), ("render_wait", "Page wait"), ("render_layout", "Layout"),
+                            ("render_pdf", "PDF write"), ("cache_lookup", "Cache lookup"),
+                            ("renderer_ready", "Renderer start"), ("upload_save", "Upload save")):
+            entry = stages.get(name)
+            if entry:
+                lines.append(f"- {label}: avg {entry['total_ms'] / entry['count']:.0f} ms · max {entry['max_ms']:.0f} ms")
+        st.markdown("\n".join(lines))
+        st.caption(f"In {counters.get('bytes_in', 0) / 1048576:.1f} MB · Out {counters.get('bytes_out', 0) / 1048576:.1f} MB · "
+                   f"Failed {counters.get('documents_failed', 0):.0f} · Queue {gauges.get('queue_jobs', 0)} job(s) · "
+                   f"Peak renderer RSS {gauges.get('child_peak_rss_mb', 0):.0f} MB")
+
+def format_event(event):
+    """One markdown line for a per-document conversion event (None for noise)."""
+    kind = event["event"]
+    if kind not in ("cached", "finished", "failed", "retry", "part", "optimized"):
+        return None
+    name = os.path.basename(event["path"])
+    if kind == "optimized":
+        saved = event["before"] - event["after"]
+        return f"🗜️ `{name}` — optimized, {saved / 1024:.0f} KB saved ({100 * saved // max(1, event['before'])}%)"
+    if kind == "part":
+        return f"🧩 `{name}` — part {event['part']} of {event['parts']} {'rendered' if event['ok'] else 'failed'}"
+    if kind == "retry":
+        return f"🔁 `{name}` — retrying ({event['error'].splitlines()[0]})"
+    if kind == "cached":
+        return f"♻️ `{name}` — from cache"
+    blocked = f" · ⛔ {len(event['blocked'])} remote resource(s) blocked" if event.get("blocked") else ""
+    if kind == "finished":
+        return f"✅ `{name}` — {event['ms'] / 1000:.1f}s, {event['bytes'] / 1024:.0f} KB{blocked}"
+    return f"❌ `{name}` — {event['error']}{blocked}"
+
+def add_processed(results):
+    """Add successful conversions to the viewer list, skipping PDFs already there."""
+    existing_pdfs = {p[1] for p in st.session_state.processed_files}
+    for r in results:
+        if r["ok"] and r["pdf"] not in existing_pdfs:
+            st.session_state.processed_files.append((r["path"], r["pdf"]))
+
+def conversion_options():
+    """This session's ⚙️ Settings as `run_conversion_command` keyword arguments."""
+    return {"timeout": st.session_state.get("render_timeout"), "split": st.session_state.get("split_mb"),
+            "optimize": st.session_state.get("optimize_dpi") if st.session_state.get("optimize") else 0,
+            "images": st.session_state.get("asset_dpi"), "network": st.session_state.get("network")}
+
+def submit_job(files, label, kind, book=None):
+    """Queue a background conversion owned by this session."""
+    return get_job_manager().submit(files, label, kind=kind, concurrency=st.session_state.get("concurrency"), book=book,
+                                    owner=st.session_state.session_id, **conversion_options())
+
+JOB_ICONS = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌", "cancelled": "⏹️"}
+
+def _jobs_body(compact=False):
+    # Only this session's jobs: labels, logs and results of other sessions stay private
+    jobs = get_job_manager().list(owner=st.session_state.session_id)
+    merged = st.session_state.setdefault("merged_jobs", set())
+
+    if not jobs:
+        if not compact:
+            st.caption("No conversion jobs yet.")
+        return
+    if compact:
+        st.markdown("### 🧵 Jobs")
+
+    finished_now = False
+    for job in jobs[:10 if not compact else 3]:
+        done = len(job.partial_results())
+        with st.container(border=True):
+            st.markdown(f"{JOB_ICONS[job.status]} **{job.label}** · `{job.id}`")
+            if job.active:
+                st.progress(job.progress, text=job.message)
+                if st.button("⏹ Cancel", key=f"cancel_{job.id}_{compact}", width="stretch"):
+                    job.cancel()
+            else:
+                st.caption(f"{job.message} · {done}/{len(job.files)} files")
+            if compact:
+                continue
+
+            failed = job.failed()
+            if failed and not job.active:
+                show_failures(failed, job.stderr)
+            lines = [line for line in map(format_event, list(job.events)) if line]
+            if lines:
+                with st.expander(f"📜 Log ({done}/{len(job.files)} files)"):
+                    st.markdown("\n\n".join(lines[-50:]))
+            if not job.active and any(r["ok"] for r in job.partial_results()):
+                if st.button("👁️ Open results in Viewer", key=f"open_{job.id}"):
+                    add_processed(job.partial_results())
+                    merged.add(job.id)
+                    st.session_state.current_view = "viewer"
+                    st.rerun()
+
+        # This session's jobs land in the viewer list as soon as they finish
+        if not job.active and job.id not in merged:
+            add_processed(job.partial_results())
+            merged.add(job.id)
+            finished_now = True
+
+    if finished_now:
+        st.rerun()
+
+_jobs_live = st.fragment(run_every=1.0)(_jobs_body)
+
+def render_jobs_panel(compact=False):
+    """Background jobs with live progress; polls once a second only while a job is active."""
+    if any(j.active for j in get_job_manager().list(owner=st.session_state.session_id)):
+        _jobs_live(compact)
+    else:
+        _jobs_body(compact)
+
+def book_options(key, out_dir, default_title, manifest=False):
+    """Book mode settings for a tab; returns `build_book` keyword arguments."""
+    c1, c2 = st.columns(2)
+    with c1:
+        title = st.text_input("Book title", default_title, key=f"book_title_{key}")
+    with c2:
+        name = st.text_input("Output file name", f"{safe_name(title) or 'book'}.pdf", key=f"book_name_{key}")
+    manifest_path = None
+    if manifest:
+        order = st.radio("Chapter order", ["Path order", "Manifest file"], horizontal=True, key=f"book_order_{key}",
+                         help="A manifest lists chapter paths (or SUMMARY.md-style links), one per line, relative to the manifest")
+        if order == "Manifest file":
+            manifest_path = st.text_input("Manifest path", os.path.join(out_dir, "SUMMARY.md"), key=f"book_manifest_{key}")
+    toc = st.checkbox("Table of contents", value=True, key=f"book_toc_{key}")
+    output = os.path.join(out_dir, os.path.splitext(safe_name(name) or "book")[0] + ".md")
+    return {"output": output, "title": title or None, "manifest": manifest_path, "toc": toc}
+
+def safe_name(text):
+    return "".join(c if c.isalnum() or c in "-_. " else "_" for c in text).strip().replace(" ", "_")
+
+def show_failures(failed, stderr=""):
+    """List failed documents with their own error, raw renderer output kept in an expander."""
+    st.error("**Failed files:**\n" + "\n".join(f"- `{os.path.basename(r['path'])}`" for r in failed))
+    for r in failed:
+        with st.expander(f"⚠️ {os.path.basename(r['path'])}"):
+            st.code(r["error"] or "Unknown error", language=None)
+    if stderr.strip():
+        with st.expander("Renderer output"):
+            st.code(stderr, language=None)
+
 def render_home():
     st.title("📄 Markdown to PDF Pro")
     st.markdown("##### Professional Converter & Viewer")
@@ -43,28 +246,93 @@ def render_home():
         
         st.divider()
         st.markdown("### 🧭 Navigation")
-        if st.button("👁️ Open PDF Viewer", type="primary", width=\ stretch\):
+        if st.button("👁️ Open PDF Viewer", type="primary", width="stretch"):
              st.session_state.current_view = "viewer"
              st.rerun()
         
         if st.session_state.processed_files:
             c1, c2 = st.columns(2)
             with c1:
-                if st.button("🗑️ Clear History", width=\ stretch\, help="Clear list"):
+                if st.button("🗑️ Clear History", width="stretch", help="Clear list"):
                     st.session_state.processed_files = []
                     st.session_state.viewer_file = None
                     st.rerun()
             with c2:
-                if st.button("🧹 Wipe Cache", width=\ stretch\, help="Delete physical files from disk"):
-                    import shutil
-                    if os.path.exists(st.session_state.temp_dir):
-                        shutil.rmtree(st.session_state.temp_dir)
-                        os.makedirs(st.session_state.temp_dir)
+                if st.button("🧹 Delete Files", width="stretch",
+                             help="Delete this session's uploads and PDFs from disk (other sessions' files and the shared render cache are kept)"):
+                    evictor = get_evictor()
+                    evictor.release(st.session_state.get("session_id"))
+                    evictor.release((st.session_state.get("session_id"), "viewer"))
+                    evictor.discard([md for md, _ in st.session_state.processed_files])
                     st.session_state.processed_files = []
                     st.session_state.viewer_file = None
-                    st.success("Cache wiped!")
+                    st.success("Files deleted!")
                     st.rerun()
 
+        st.divider()
+        st.markdown("### ⚙️ Settings")
+        if 'concurrency' not in st.session_state:
+            st.session_state.concurrency = 1 if is_cloud() else default_concurrency()
+        st.number_input("Parallel renderers", min_value=1, max_value=max(os.cpu_count() or 1, st.session_state.concurrency), key="concurrency",
+                        help="Batches rendered at once. Default is based on CPU cores and free memory.")
+        # Server-wide settings: the widgets show what the server uses now, and only
+        # a change made here (on_change) applies, so other sessions' reruns can't undo it
+        governor = get_governor()
+        st.session_state.memory_ceiling = governor.ceiling_mb or 0
+        st.session_state.max_batch = governor.max_batch or 0
+        st.number_input("Memory ceiling (MB)", min_value=0, step=256, key="memory_ceiling",
+                        on_change=lambda: governor.configure(ceiling_mb=st.session_state.memory_ceiling,
+                                                             max_batch=governor.max_batch),
+                        help="Renderers start only while their measured memory fits under this. 0 = automatic "
+                             f"(now {governor.ceiling() or '—'} MB). Applies to the whole server.")
+        st.number_input("Max files per batch", min_value=0, key="max_batch",
+                        on_change=lambda: governor.configure(ceiling_mb=governor.ceiling_mb,
+                                                             max_batch=st.session_state.max_batch),
+                        help="Upper bound for packing small files into one renderer job. 0 = automatic. "
+                             "Applies to the whole server.")
+        evictor = get_evictor()
+        st.session_state.cache_max_mb = int(evictor.max_mb())
+        st.number_input("Cache limit (MB)", min_value=0, step=256, key="cache_max_mb",
+                        on_change=lambda: evictor.configure(max_mb=st.session_state.cache_max_mb),
+                        help="Least recently used cached PDFs and uploads are removed above this, never files "
+                             "an open session or a running job uses. 0 = no size limit. Applies to the whole server.")
+        if evictor.last_run:
+            st.caption(f"Last cleanup removed {evictor.last_run['files']} file(s), "
+                       f"{evictor.last_run['bytes'] / (1024 * 1024):.1f} MB · cache now {evictor.last_run['size'] / (1024 * 1024):.0f} MB")
+        router = get_router()
+        st.session_state.backend = router.choice()
+        st.selectbox("Renderer", CHOICES, key="backend",
+                     on_change=lambda: router.configure(st.session_state.backend),
+                     help="auto: plain documents (prose, tables, images, code) render in-process with Python, "
+                          "the rest in Chromium. Applies to the whole server.")
+        st.session_state.setdefault("network", network_mode())
+        st.selectbox("Remote resources", NETWORK_MODES, key="network",
+                     help="online: fetch remote images, fonts and stylesheets. cache: serve them from the local "
+                          "fetch cache and store new downloads. offline: cache only; anything else is blocked at once "
+                          "and listed in the job log.")
+        st.session_state.setdefault("render_timeout", render_timeout())
+        st.number_input("Per-file timeout (s)", min_value=5, step=30, key="render_timeout",
+                        help="A document still rendering after this fails on its own; the rest of its batch goes on.")
+        if merge_available():
+            st.session_state.setdefault("split_mb", split_mb())
+            st.number_input("Split documents above (MB)", min_value=0.0, step=0.5, key="split_mb",
+                            help="Larger markdown files render as parts cut at top-level headings, in parallel, "
+                                 "then are merged into one PDF. 0 turns splitting off.")
+        if assets_available():
+            st.session_state.setdefault("asset_dpi", asset_dpi())
+            st.number_input("Reduce large images to (DPI)", min_value=0, max_value=1200, step=50, key="asset_dpi",
+                            help="Images wider than the page at this resolution render from a reduced copy; "
+                                 "your files are not changed. 0 renders the originals.")
+        if optimize_available():
+            st.session_state.setdefault("optimize", bool(optimize_dpi()))
+            st.session_state.setdefault("optimize_dpi", optimize_dpi() or DEFAULT_DPI)
+            st.toggle("🗜️ Optimize PDFs", key="optimize",
+                      help="Share duplicate images and fonts, resample images and linearize new PDFs for a fast first page.")
+            if st.session_state.optimize:
+                st.number_input("Image resolution (DPI)", min_value=50, max_value=600, step=25, key="optimize_dpi")
+        st.caption(f"Renderer estimate: {governor.worker_mb:.0f} MB each · up to "
+                   f"{governor.allowed_workers(st.session_state.concurrency)} at once")
+
         st.divider()
         st.markdown("### 📝 Quick Guide")
         st.info("1. Upload/Select Files\n2. Convert\n3. Click **Viewer** to read")
@@ -80,41 +348,34 @@ def render_home():
         uploaded_files = st.file_uploader("Drop MD files here:", type=["md"], accept_multiple_files=True)
         
         if uploaded_files:
-            if st.button("🚀 Convert Now", type="primary", width=\ stretch\):
-                with st.status("Processing...", expanded=True) as status:
-                    input_paths = []
-                    # Save files
+            as_book = st.toggle("📚 Combine into one PDF (book mode)", key="book_upload",
+                                help="Chapters in file-name order, one render, with page breaks and a table of contents")
+            if as_book:
+                book = book_options("upload", st.session_state.temp_dir, "Book")
+            if st.button("🚀 Convert Now", type="primary", width="stretch"):
+                input_paths = []
+                metrics = get_metrics()
+                # Save files
+                # Stored once by content hash and linked into this session's own folder
+                store = get_upload_store()
+                with metrics.timer("upload_save", files=len(uploaded_files)) as fields:
+                    new_blobs = 0
                     for f in uploaded_files:
-                        save_path = os.path.join(st.session_state.temp_dir, f.name)
-                        with open(save_path, "wb") as w: w.write(f.getbuffer())
+                        save_path, new_blob = store.save(st.session_state.session_id, f.name, f.getbuffer())
+                        new_blobs += new_blob
                         input_paths.append(save_path)
-                    
-                    status.write("⚙️ Running Engine...")
-                    
-                    # Progress logic
-                    p_bar = st.progress(0, text="Starting...")
-                    def up(p, t): p_bar.progress(p, text=t)
-                    
-                    s, o, e, new, skip = run_conversion_command(input_paths, progress_callback=up)
-                    p_bar.empty()
-                    
-                    if s:
-                        # Re-scan processed files from input
-                        results = []
-                        for md_p in input_paths:
-                            pdf_p = os.path.splitext(md_p)[0] + ".pdf"
-                            if os.path.exists(pdf_p): results.append((md_p, pdf_p))
-                        
-                        # UPDATE session state
-                        existing_pdfs = {p[1] for p in st.session_state.processed_files}
-                        for r in results:
-                            if r[1] not in existing_pdfs:
-                                st.session_state.processed_files.append(r)
-                        
-                        status.update(label=f"✅ Done! (Processed {new}, Cached {skip})", state="complete")
-                    else:
-                        status.update(label="❌ Failed", state="error")
-                        st.error(e)
+                    fields["bytes"] = sum(f.size for f in uploaded_files)
+                    fields["deduplicated"] = len(uploaded_files) - new_blobs
+                metrics.count("uploads", len(uploaded_files))
+                metrics.count("upload_bytes", fields["bytes"])
+                metrics.count("uploads_deduplicated", fields["deduplicated"])
+                
+                # Conversion runs in the background; the jobs panel below polls it
+                if as_book:
+                    submit_job(input_paths, f"Book · {len(input_paths)} chapter(s)", kind="upload", book=book)
+                else:
+                    submit_job(input_paths, f"Upload · {len(input_paths)} file(s)", kind="upload")
+                st.rerun()
 
     # --- LOCAL BATCH ---
     with tab_local:
@@ -128,26 +389,51 @@ def render_home():
         if 'local_path' not in st.session_state: st.session_state.local_path = os.getcwd()
         path_in = st.text_input("Local Folder Path:", st.session_state.local_path)
         
+        with st.expander("⚙️ Scan Options", expanded=False):
+            ignore_text = st.text_area("Ignore patterns (gitignore syntax, one per line)",
+                                       "\n".join(DEFAULT_IGNORE_PATTERNS), height=120, key="ignore_patterns")
+            o1, o2, o3 = st.columns(3)
+            with o1:
+                use_gitignore = st.checkbox("Respect .gitignore", value=True, key="use_gitignore")
+            with o2:
+                live_updates = st.checkbox("Live updates", value=True, key="live_updates",
+                                           help="Keep the list current with filesystem events (watchdog) instead of rescanning")
+            with o3:
+                rescan = st.button("🔄 Rescan", width="stretch")
+        
         if os.path.isdir(path_in):
-            # Recursive search for .md files in all subfolders
-            mds = glob.glob(os.path.join(path_in, "**", "*.md"), recursive=True)
+            # Cached index of .md files in all subfolders (ignored folders are never entered)
+            patterns = [line.strip() for line in ignore_text.splitlines() if line.strip()]
+            index = get_file_index(path_in, patterns, use_gitignore, watch=live_updates)
+            # Documents in the chosen folder may reference images anywhere inside it
+            get_dependency_index().add_root(path_in)
+            if rescan:
+                index.scan()
+            entries = index.snapshot()
+            mds = [p for p, _ in entries]
             
             if mds:
-                st.success(f"📂 Found **{len(mds)}** Markdown files")
+                st.success(f"📂 Found **{len(mds)}** Markdown files" + (" · 👀 live" if index.watching else ""))
                 
-                # Build dataframe for selection
-                import pandas as pd
-                df_data = []
-                for f in mds:
-                    rel_path = os.path.relpath(f, path_in)
-                    df_data.append({
-                        "Select": False,  # Default unchecked
-                        "File": os.path.basename(f),
-                        "Path": rel_path,
-                        "Full Path": f
-                    })
-                
-                df = pd.DataFrame(df_data)
+                # Build dataframe for selection only when the index changed
+                df_key = (index.root, id(index), index.version)
+                if st.session_state.get("local_df_key") != df_key:
+                    import pandas as pd
+                    df_data = []
+                    for f, meta in entries:
+                        rel_path = os.path.relpath(f, index.root)
+                        df_data.append({
+                            "Select": False,  # Default unchecked
+                            "File": os.path.basename(f),
+                            "Path": rel_path,
+                            "Size (KB)": round(meta["size"] / 1024, 1),
+                            "Modified": datetime.fromtimestamp(meta["mtime"]).strftime("%Y-%m-%d %H:%M"),
+                            "PDF": meta["pdf"],
+                            "Full Path": f
+                        })
+                    st.session_state.local_df = pd.DataFrame(df_data)
+                    st.session_state.local_df_key = df_key
+                df = st.session_state.local_df.copy()
                 
                 # Wrap in expander for collapse/expand
                 with st.expander("📋 Select Files to Convert", expanded=True):
@@ -163,11 +449,14 @@ def render_home():
                             "Select": st.column_config.CheckboxColumn("✓", width="small"),
                             "File": st.column_config.TextColumn("File Name", width="large"),
                             "Path": st.column_config.TextColumn("Path", width="large"),
+                            "Size (KB)": st.column_config.NumberColumn("Size (KB)", width="small"),
+                            "Modified": st.column_config.TextColumn("Modified", width="small"),
+                            "PDF": st.column_config.TextColumn("PDF", width="small"),
                             "Full Path": None  # Hidden
                         },
-                        disabled=["File", "Path", "Full Path"],
+                        disabled=["File", "Path", "Size (KB)", "Modified", "PDF", "Full Path"],
                         hide_index=True,
-                        width=\ stretch\,
+                        width="stretch",
                         height=350,
                         key="file_selector_df"
                     )
@@ -179,29 +468,56 @@ def render_home():
                 st.caption(f"**{len(sel)}** / {len(mds)} files selected")
                 
                 if st.button("🚀 Convert Selected Files", type="primary", disabled=len(sel)==0):
-                    with st.status("Converting...", expanded=True) as status:
-                        # Progress logic
-                        p_bar = st.progress(0, text="Initializing...")
-                        def up(p, t): p_bar.progress(p, text=t)
-
-                        s, o, e, new, skip = run_conversion_command(sel, progress_callback=up)
-                        p_bar.empty()
-
-                        if s:
-                            results = []
-                            for f in sel:
-                                pdf_p = os.path.splitext(f)[0] + ".pdf"
-                                if os.path.exists(pdf_p): results.append((f, pdf_p))
-                            
-                            st.session_state.processed_files = results 
-                            status.update(label="✅ Done!", state="complete")
-                            st.session_state.current_view = "viewer"
-                            st.rerun()
-                        else:
-                            st.error(e)
+                    submit_job(sel, f"Local · {os.path.basename(os.path.abspath(path_in))} · {len(sel)} file(s)", kind="local")
+                    st.rerun()
+
+                with st.expander("📚 Book Mode: combine selected files into one PDF"):
+                    book = book_options("local", index.root, os.path.basename(index.root), manifest=True)
+                    use_manifest = bool(book["manifest"])
+                    missing_manifest = use_manifest and not os.path.isfile(book["manifest"])
+                    if missing_manifest:
+                        st.warning("Manifest not found.")
+                    if st.button("📚 Build Book", disabled=missing_manifest or not (sel or use_manifest)):
+                        submit_job(sel, f"Book · {os.path.basename(book['output'])} · {len(sel)} file(s)", kind="local", book=book)
+                        st.rerun()
+
+                render_watch_toggle(index.root, patterns, use_gitignore)
             else:
                 st.warning("No .md files found in this folder or subfolders.")
 
+    # --- BACKGROUND JOBS ---
+    st.divider()
+    st.markdown("### 🧵 Conversion Jobs")
+    render_jobs_panel()
+
+def render_watch_toggle(root, patterns, use_gitignore):
+    """Watch mode for the Local Batch folder: re-convert documents as they are saved."""
+    watching = get_watch(root) is not None
+    on = st.toggle("👀 Watch folder & auto-convert on save", value=watching, key=f"watch_{root}",
+                   help="Re-renders changed .md files (and documents whose images changed) in the background")
+    if on and not watching:
+        try:
+            start_watch(root, patterns=patterns, use_gitignore=use_gitignore,
+                        concurrency=st.session_state.get("concurrency"), options=conversion_options())
+        except RuntimeError as e:
+            st.error(str(e))
+            return
+    elif not on and watching:
+        stop_watch(root)
+        return
+
+    session = get_watch(root)
+    if session and session.history:
+        run = session.history[-1]
+        stamp = datetime.fromtimestamp(run["time"]).strftime("%H:%M:%S")
+        failed = [r for r in run["results"] if not r["ok"]]
+        note = f"Last auto-convert {stamp}: {len(run['files'])} file(s) · Rendered {run.get('misses', 0)}, Cache hits {run.get('hits', 0)}"
+        if failed or run["error"]:
+            note += f" · ❌ {len(failed) or 'run'} failed"
+        st.caption(note)
+    elif session:
+        st.caption("Watching for changes...")
+
 def render_viewer():
     if not st.session_state.processed_files:
         st.info("💡 **Viewer is Empty**")
@@ -214,9 +530,10 @@ def render_viewer():
         with st.sidebar:
             st.markdown("## 📄 PDF Pro")
             st.divider()
-            if st.button("🏠 Back to Home", type="secondary", width=\ stretch\):
+            if st.button("🏠 Back to Home", type="secondary", width="stretch"):
                  st.session_state.current_view = "home"
                  st.rerun()
+            render_jobs_panel(compact=True)
             render_sidebar_shared(slot="top_no_caption")
         return
 
@@ -234,12 +551,14 @@ def render_viewer():
 
         if file_map:
             st.write("---")
+            details = get_manifest().lookup(file_map.values())
             # Use columns for selection and a per-file delete button
             for name, path in file_map.items():
                 col_n, col_d = st.columns([4, 1])
                 with col_n:
                     is_active = (st.session_state.viewer_file == path)
-                    if st.button(f"{'👁️' if is_active else '📄'} {name}", key=f"sel_{name}", width=\ stretch\):
+                    if st.button(f"{'👁️' if is_active else '📄'} {name}", key=f"sel_{name}", width="stretch",
+                                 help=describe_pdf(details.get(os.path.abspath(path)))):
                         st.session_state.viewer_file = path
                         st.rerun()
                 with col_d:
@@ -253,18 +572,36 @@ def render_viewer():
             st.write("")
             all_pdfs = [p[1] for p in st.session_state.processed_files]
             if all_pdfs:
-                 zip_path = create_zip(all_pdfs)
-                 with open(zip_path, "rb") as f:
-                     st.download_button("📦 Download All (.zip)", f, "batch_result.zip", "application/zip", width=\ stretch\)
+                 # Built only on request and memoized on file contents; volumes keep each
+                 # archive under the static server's limit, so none is loaded into this process
+                 volumes = zip_volumes(all_pdfs)
+                 zip_paths = [find_zip(volume) for volume in volumes]
+                 if None in zip_paths:
+                     if st.button("📦 Prepare ZIP", width="stretch", help="Pack all PDFs for download"):
+                         with st.spinner("Packing PDFs..."):
+                             for volume in volumes:
+                                 create_zip(volume, keep=max(ZIP_KEEP, len(volumes)))
+                         st.rerun()
+                 else:
+                     for number, zip_path in enumerate(zip_paths, 1):
+                         label, name = ("All", "batch_result.zip") if len(zip_paths) == 1 else (f"part {number} of {len(zip_paths)}", f"batch_result_{number}.zip")
+                         if os.path.getsize(zip_path) <= MAX_STATIC_FILE_SIZE:
+                             st.markdown(f'<a class="download-link" href="{static_url(zip_path)}" download="{name}">📦 Download {label} (.zip)</a>',
+                                         unsafe_allow_html=True)
+                         else:
+                             # Only a single PDF over the limit gets here
+                             st.caption(f"📦 {label}: too large to download here ({os.path.getsize(zip_path) // (1024 * 1024)} MB). "
+                                        f"It is on the server at `{zip_path}`.")
         
         st.divider()
+        render_jobs_panel(compact=True)
         
         # 2. NAVIGATION & STATUS
-        if st.button("🏠 Back to Home", type="secondary", width=\ stretch\):
+        if st.button("🏠 Back to Home", type="secondary", width="stretch"):
              st.session_state.current_view = "home"
              st.rerun()
 
-        if st.button("🗑️ Clear All Results", width=\ stretch\, help="Reset workspace"):
+        if st.button("🗑️ Clear All Results", width="stretch", help="Reset workspace"):
             st.session_state.processed_files = []
             st.session_state.viewer_file = None
             st.session_state.current_view = "home"
@@ -291,6 +628,6 @@ def render_viewer():
         st.divider()
         
         # Full Height Preview
-        display_pdf(pdf_path)
+        display_pdf(pdf_path, owner=st.session_state.session_id)
     else:
         st.error("File not found or deleted.")
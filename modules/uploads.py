@@ -0,0 +1,74 @@
+import os
+import re
+import hashlib
+import threading
+
+SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+class UploadStore:
+    """
+    Uploaded files stored once by content hash (`blobs/<2 hex>/<sha256><ext>`),
+    and one folder per browser session (`sessions/<id>/`) that maps display names
+    to those blobs with hard links. Sessions can't overwrite each other's files;
+    identical uploads share one blob, and the content-addressed render cache
+    renders them once.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.sessions_dir = os.path.join(root, "sessions")
+
+    def session_dir(self, session_id):
+        if not SESSION_ID.match(session_id or ""):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        path = os.path.join(self.sessions_dir, session_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def blob_path(self, digest, ext=".md"):
+        return os.path.join(self.blob_dir, digest[:2], f"{digest}{ext}")
+
+    def save(self, session_id, name, data):
+        """
+        Store `data` under `name` in the session's folder. Returns (path, new_blob);
+        new_blob is False when the same content was already stored.
+        """
+        name = os.path.basename(name)
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self.blob_path(digest, os.path.splitext(name)[1].lower())
+        new_blob = not os.path.exists(blob)
+        if new_blob:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            tmp = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, blob)
+
+        dest = os.path.join(self.session_dir(session_id), name)
+        if os.path.exists(dest) and os.path.samefile(blob, dest):
+            return dest, new_blob
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            # No hard links on this file system: the session gets its own copy
+            with open(tmp, "wb") as f:
+                f.write(data)
+        os.replace(tmp, dest)
+        # The previous PDF belongs to the previous content under this name
+        stale_pdf = os.path.splitext(dest)[0] + ".pdf"
+        if os.path.exists(stale_pdf):
+            os.remove(stale_pdf)
+        return dest, new_blob
+
+    def release(self, digest, ext=".md"):
+        """Remove a blob no session links to any more."""
+        blob = self.blob_path(digest, ext)
+        try:
+            if os.stat(blob).st_nlink <= 1:
+                os.remove(blob)
+                return True
+        except FileNotFoundError:
+            pass
+        return False
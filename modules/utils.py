@@ -1,104 +1,642 @@
 import os
+import glob
+import json
+import hashlib
+import time
+import queue
+import sqlite3
 import tempfile
 import shutil
-import platform
+import threading
 import subprocess
 import zipfile
-import base64
-import streamlit as st
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from modules.environment import ROOT_DIR, get_environment, is_cloud, pinned_engine
+from modules.renderer import CRASH_ERROR, daemon_available, file_result, get_pool, render_timeout
+from modules.system import default_concurrency, descendant_pids, rss_mb
+from modules.metrics import get_metrics
+from modules.batching import MAX_BATCH, get_governor, input_mb, plan_batches
+from modules.cache import RenderCache, cache_key, options_fingerprint
+from modules.deps import DependencyIndex
+from modules.manifest import CacheManifest, pdf_page_count
+from modules.eviction import LEASE_TTL, CacheEvictor
+from modules.uploads import UploadStore
+from modules.backends import get_router
+from modules.split import PART_MB, merge_parts, remove_parts, split_document, split_mb, splittable
+from modules.postprocess import optimize_available, optimize_dpi, optimize_options, optimize_pdf
+from modules.assets import IMAGE_TYPES, AssetCache, asset_dpi, asset_options, assets_available
+from modules.offline import FetchCache, network_mode
 
-def is_cloud():
-    """Detect if running on Streamlit Cloud."""
-    return os.environ.get("STREAMLIT_RUNTIME_ENV") == "cloud" or "AMPLIFY_ID" in os.environ
+# Served by Streamlit at /app/static/pdf/ (see .streamlit/config.toml)
+STATIC_PDF_DIR = os.path.join(ROOT_DIR, "static", "pdf")
+STATIC_ZIP_DIR = os.path.join(ROOT_DIR, "static", "zip")
+
+# Streamlit refuses to serve static files above 200 MB
+MAX_STATIC_FILE_SIZE = 200 * 1024 * 1024
+ZIP_KEEP = 5  # memoized "Download All" archives kept on disk
+
+_zip_lock = threading.Lock()
+
+RETRY_BUDGET = 10   # batches re-run per conversion after an unattributed failure
+MAX_ATTEMPTS = 4    # per file: first try plus bisection rounds down to a batch of one
+BATCH_ERROR = "md-to-pdf failed for this batch"
+# Failures that say nothing about the file itself: the renderer went away under it
+TRANSIENT_ERRORS = (CRASH_ERROR, BATCH_ERROR, "Target closed", "Protocol error", "Session closed",
+                    "Navigation failed because browser has disconnected")
 
 def check_dependencies():
-    """Check if Node.js/npx is available and install packages if on Cloud."""
-    npx_path = shutil.which("npx")
-    os_name = "Cloud" if is_cloud() else platform.system()
-    
-    # On Cloud, if node_modules is missing, try npm install once
-    if is_cloud() and npx_path and not os.path.exists("node_modules"):
-        try:
-            subprocess.run("npm install", shell=True, capture_output=True)
-        except:
-            pass
-            
-    return npx_path, os_name
+    """
+    Node.js/npx path and OS label, from the probe cached for the process.
+    Installing packages on Cloud is left to the background warm-up (`start_warm_up`).
+    """
+    env = get_environment()
+    return env["npx"], "Cloud" if env["cloud"] else env["os"]
+
+def retry_budget():
+    """Re-run batches allowed per conversion (env MD2PDF_RETRY_BUDGET, 0 disables retries)."""
+    override = os.environ.get("MD2PDF_RETRY_BUDGET", "")
+    return int(override) if override.isdigit() else RETRY_BUDGET
+
+def is_transient(error):
+    return bool(error) and any(marker in error for marker in TRANSIENT_ERRORS)
+
+def split_retry(paths):
+    """Halve a failed group so the file to blame ends up alone; one file is retried as is."""
+    if len(paths) <= 1:
+        return [paths]
+    middle = len(paths) // 2
+    return [paths[:middle], paths[middle:]]
 
-def run_conversion_command(file_paths, progress_callback=None):
+def run_conversion_command(file_paths, progress_callback=None, concurrency=None, event_callback=None, cancel_event=None,
+                           timeout=None, retries=None, split=None, optimize=None, images=None,
+                           network=None):
     """
-    Run md-to-pdf on files, SKIPPING those that are already up-to-date.
-    Uses batches to prevent RAM crashes on large selections.
+    Run md-to-pdf on files, SKIPPING those whose content is already in the render cache.
+    The cache key covers the markdown bytes, render options and referenced assets,
+    so touched or re-uploaded files with identical content are not rendered again.
+    Documents are batched by input size (large ones alone, tiny ones packed), and up
+    to `concurrency` batches run at once (default: from cores and free RAM), fewer
+    while the measured renderer memory is near the ceiling (see `get_governor`).
+
+    Progress is reported per document: `progress_callback(fraction, text)` and
+    `event_callback(event)` with "cached" / "started" / "finished" / "failed" / "part" / "log"
+    events, both called on the caller's thread.
+    Setting `cancel_event` (a threading.Event) drops batches that haven't started;
+    batches already on a renderer finish.
+
+    A file that runs longer than `timeout` seconds fails on its own (default
+    `render_timeout()`). Files that failed because the renderer crashed or a CLI
+    batch aborted are retried in halves of their batch, so a single bad document
+    ends up failing alone while the rest still convert; `retries` caps the re-run
+    batches per call (default `retry_budget()`) and each is announced as a
+    "retry" event.
+    Documents over `split` MB of markdown (default `split_mb()`, 0 = off) render
+    as parts cut at top-level headings, in parallel, and are merged back into
+    one PDF with bookmarks and internal links kept (see modules/split.py).
+    With `optimize` (a target image DPI; default `optimize_dpi()`, 0 = off) every
+    new PDF goes through modules/postprocess.py before it is cached, and an
+    "optimized" event reports the bytes saved; cache hits are already optimized.
+    Local images wider than the page at `images` DPI (default `asset_dpi()`, 0 = off)
+    are rendered from reduced copies in the asset cache (see modules/assets.py).
+    `network` ("online", "cache" or "offline"; default `network_mode()`) selects how
+    renderers fetch remote resources (see modules/offline.py). URLs a render was
+    refused are listed in its result under "blocked", and such a PDF is not cached.
+    Documents are routed per file to a renderer backend (see modules/backends.py):
+    the in-process Python one for plain documents when it is installed, Chromium
+    for the rest.
+    Returns (success, stdout, stderr, cache_misses, cache_hits, results) where
+    `results` has one dict per input, in input order, with its absolute "path":
+    {"path", "pdf", "ok", "error", "ms", "bytes", "cached", "backend"}.
     """
+    # Renderers report absolute paths; every per-file lookup (retries, held failures) uses them
+    file_paths = [os.path.abspath(p) for p in file_paths]
+    # Inputs and outputs stay on disk while this runs, whatever the cache limits
+    pdf_paths = [os.path.splitext(p)[0] + ".pdf" for p in file_paths]
+    with get_evictor().leased(list(file_paths) + pdf_paths):
+        return _run_conversion(file_paths, progress_callback, concurrency, event_callback, cancel_event, timeout, retries,
+                               split_mb(split), optimize_dpi(optimize) if optimize_available() else 0,
+                               asset_dpi(images) if assets_available() else 0, network_mode(network))
+
+def _run_conversion(file_paths, progress_callback, concurrency, event_callback, cancel_event, timeout, retries, split, dpi,
+                    image_dpi, network):
+    cache = get_render_cache()
+    index = get_dependency_index()
+    metrics = get_metrics()
+    metrics.configure(get_fixed_temp_dir())
+    conversion_started = time.perf_counter()
+    options = options_fingerprint()
+    router = get_router()
+    fetch = {"mode": network, "cache": get_fetch_cache().root} if network != "online" else None
+    routes = {}
+    keys = {}
+    pages = {}
+    results = {}
     to_process = []
-    skipped = []
+    to_split = set()
+    hits = 0
     
+    lookup_started = time.perf_counter()
     for md_path in file_paths:
         pdf_path = os.path.splitext(md_path)[0] + ".pdf"
-        if os.path.exists(pdf_path):
-            md_mtime = os.path.getmtime(md_path)
-            pdf_mtime = os.path.getmtime(pdf_path)
-            if pdf_mtime > md_mtime:
-                skipped.append(md_path)
-                continue
+        # Each document goes to the cheapest renderer that handles its features
+        backend = routes[md_path] = router.route(md_path, index.digest(md_path))
+        render_options = backend.options(options)
+        if splittable(md_path, split):
+            # Parts start on a new page, so a split render is a different PDF
+            render_options = dict(render_options, split=PART_MB)
+            to_split.add(md_path)
+        if dpi:
+            render_options = dict(render_options, optimize=optimize_options(dpi))
+        if image_dpi and any(os.path.splitext(a)[1].lower() in IMAGE_TYPES for a in index.assets(md_path)):
+            render_options = dict(render_options, images=asset_options(image_dpi))
+        key = keys[md_path] = cache_key(md_path, render_options, index)
+        if cache.restore(key, pdf_path):
+            hits += 1
+            results[md_path] = dict(file_result(md_path, pdf=pdf_path, size=os.path.getsize(pdf_path), cached=True),
+                                    backend=backend.name)
+            if event_callback:
+                event_callback(dict(results[md_path], event="cached"))
+            continue
+        # A PDF hard-linked from the cache must not be overwritten in place by the CLI
+        if os.path.exists(pdf_path) and os.stat(pdf_path).st_nlink > 1:
+            os.remove(pdf_path)
         to_process.append(md_path)
     
+    index.save()
+    metrics.observe("cache_lookup", (time.perf_counter() - lookup_started) * 1000, files=len(file_paths), hits=hits)
+    metrics.count("documents_cached", hits)
+    # A missing input fails on its own when rendered; the counter just skips it
+    metrics.count("bytes_in", sum(os.path.getsize(p) for p in to_process if os.path.isfile(p)))
+    
     if not to_process:
-        return True, "No files changed.", "", 0, len(skipped)
+        record_manifest(metrics, file_paths, results, keys, pages, index)
+        finish_metrics(metrics, conversion_started, len(file_paths), hits, 0, 0)
+        return True, "No files changed.", "", 0, hits, [results[p] for p in file_paths]
 
     # BATCHED PROCESSING
-    # Slightly larger batch for performance, but careful with RAM
-    batch_size = 8 if not is_cloud() else 4 
+    # Batches are sized by input bytes and started only while the measured
+    # renderer memory fits under the ceiling (see modules/batching.py)
     total_new = len(to_process)
+    governor = get_governor()
+
+    # Very large documents render as parts on several renderers, then are merged
+    parts = {}   # part file -> the document it belongs to
+    splits = {}  # document -> its part files, in order
+    for md_path in to_process:
+        if md_path in to_split:
+            try:
+                pieces = split_document(md_path)
+            except OSError:
+                pieces = []
+            if pieces:
+                splits[md_path] = pieces
+                for part in pieces:
+                    parts[part] = md_path
+                    routes[part] = routes[md_path]
+    renders = [p for p in to_process if p not in splits] + list(parts)
+
+    jobs = concurrency or (1 if is_cloud() else default_concurrency())
+    jobs = max(1, min(jobs, len(renders)))
+    weights = {p: input_mb(p, index) for p in to_process if p not in splits}
+    weights.update((part, os.path.getsize(part) / (1024 * 1024)) for part in parts)
+    # Batches never mix backends; Chromium's go first since they take longest
+    batches = []
+    for backend in sorted({routes[p] for p in renders}, key=lambda b: -b.cost):
+        batches += plan_batches([p for p in renders if routes[p] is backend], weights,
+                                governor.allowed_workers(jobs, rss_mb(descendant_pids())),
+                                max_batch=governor.batch_limit(8 if is_cloud() else MAX_BATCH),
+                                target_mb=governor.target_mb(jobs))
     
-    extra_flags = ""
-    if platform.system() == "Linux":
-        extra_flags = " --launch-options '{\"args\": [\"--no-sandbox\"]}'"
+    # Chromium batches prefer the warm render workers and fall back to spawning the CLI
+    use_daemon = daemon_available()
 
-    success_all = True
+    timeout = timeout or render_timeout()
+    budget = retry_budget() if retries is None else retries
+    attempts = {p: 0 for p in renders}
+    held = {}  # transient failures waiting for their batch to finish, maybe to be retried
+    ran_alone = set()
+    settled = {md_path: 0 for md_path in splits}  # parts with a final result
+    ready = []  # split documents whose parts are all done, waiting to be merged
     all_out, all_err = "", ""
-    
-    for i in range(0, total_new, batch_size):
-        batch = to_process[i:i+batch_size]
-        quoted_files = [f'"{f}"' for f in batch]
-        file_args = " ".join(quoted_files)
-        
-        # Binary selection
-        binary = "npx md-to-pdf"
-        if os.path.exists("node_modules/.bin/md-to-pdf"):
-            binary = "node_modules/.bin/md-to-pdf" if platform.system() != "Windows" else "node_modules\\.bin\\md-to-pdf.cmd"
-        elif platform.system() == "Windows":
-             # Try global npx on windows if local fails
-             binary = "npx md-to-pdf"
-
-        command = f"{binary}{extra_flags} {file_args}"
-        
-        if progress_callback:
-            percent = i / total_new
-            msg = f"Processing files {i+1} to {min(i+batch_size, total_new)} of {total_new}..."
-            progress_callback(percent, msg)
+    done = 0
+
+    if progress_callback:
+        progress_callback(0.0, f"Converting {total_new} files in {len(batches)} batch(es) with up to {jobs} parallel renderer(s)...")
+
+    # Workers push events from their threads; they are handled here, on the caller's
+    # thread, so Streamlit widgets can be updated and the count stays ordered.
+    events = queue.Queue()
 
+    def handle(event):
+        nonlocal done
+        if event["event"] == "failed" and is_transient(event["error"]) and attempts[event["path"]] < MAX_ATTEMPTS:
+            held[event["path"]] = event
+            return
+        if event.get("path") in parts:
+            handle_part(event)
+            return
+        if event["event"] == "optimized":
+            metrics.observe("optimize", event["ms"], path=event["path"], before=event["before"], after=event["after"])
+            metrics.count("bytes_saved", event["before"] - event["after"])
+        if event["event"] in ("finished", "failed"):
+            record_render_metrics(metrics, event)
+            done += 1
+            if progress_callback:
+                name = os.path.basename(event["path"])
+                progress_callback(done / total_new, f"{'Converted' if event['ok'] else 'Failed'} {name} ({done} of {total_new})")
+        if event_callback:
+            event_callback(event)
+
+    def handle_part(event):
+        # Callers see the document: its first part starting, retries, and a log line per part
+        md_path = parts[event["path"]]
+        pieces = splits[md_path]
+        number = pieces.index(event["path"]) + 1
+        if event["event"] == "started" and number == 1:
+            handle(dict(event, path=md_path))
+        elif event["event"] == "retry":
+            handle(dict(event, path=md_path, error=f"Part {number} of {len(pieces)}: {event['error']}"))
+        elif event["event"] in ("finished", "failed"):
+            if event["ok"]:
+                metrics.observe("render_part", event["ms"], path=md_path, part=number)
+            settled[md_path] += 1
+            if settled[md_path] == len(pieces):
+                ready.append(md_path)
+            if event_callback:
+                event_callback({"event": "part", "path": md_path, "part": number, "parts": len(pieces),
+                                "ok": event["ok"], "error": event["error"], "ms": event["ms"]})
+
+    def merge_split(md_path):
+        pieces = splits[md_path]
+        pdf_path = os.path.splitext(md_path)[0] + ".pdf"
+        ms = sum(results[p]["ms"] for p in pieces)
+        failed_part = next((n for n, p in enumerate(pieces, 1) if not results[p]["ok"]), None)
+        if failed_part:
+            r = file_result(md_path, error=f"Part {failed_part} of {len(pieces)}: {results[pieces[failed_part - 1]]['error']}", ms=ms)
+        else:
+            merge_started = time.perf_counter()
+            try:
+                pages[md_path] = merge_parts([results[p]["pdf"] for p in pieces], pdf_path)
+                merge_ms = (time.perf_counter() - merge_started) * 1000
+                metrics.observe("merge", merge_ms, path=md_path, parts=len(pieces))
+                r = file_result(md_path, pdf=pdf_path, ms=ms + round(merge_ms), size=os.path.getsize(pdf_path))
+                if dpi:
+                    r = optimize_result(r, dpi, handle)
+                blocked = [url for p in pieces for url in results[p].get("blocked", [])]
+                if blocked:
+                    r["blocked"] = blocked
+                else:
+                    cache.store(keys[md_path], pdf_path)
+            except Exception as e:
+                r = file_result(md_path, error=f"Merging {len(pieces)} parts failed: {type(e).__name__}: {e}", ms=ms)
+        remove_parts(pieces)
+        results[md_path] = dict(r, backend=routes[md_path].name)
+        attempts[md_path] = MAX_ATTEMPTS  # its parts have had their retries
+        handle(dict(results[md_path], event="finished" if r["ok"] else "failed"))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        waiting = deque(batches)
+        futures = {}
+        pending = set()
+        cancelled = False
+        allowed = 1
+        next_sample = 0
+        while waiting or pending or not events.empty():
+            # Renderer memory decides how many batches may run; sampled twice a second
+            if time.monotonic() >= next_sample:
+                next_sample = time.monotonic() + 0.5
+                renderers_mb = rss_mb(descendant_pids())
+                workers = get_pool().alive_count() if use_daemon else len(pending)
+                governor.observe(renderers_mb, workers)
+                allowed = governor.allowed_workers(jobs, renderers_mb)
+                if use_daemon and workers > allowed:
+                    get_pool().shrink(allowed)
+                metrics.gauge("queue_batches", len(waiting) + len(pending))
+                metrics.gauge("child_rss_mb", round(renderers_mb, 1))
+            while waiting and len(pending) < allowed and not cancelled:
+                batch = waiting.popleft()
+                # Parts are optimized once merged
+                future = executor.submit(render_batch, routes[batch[0]], batch, [parts.get(p, p) for p in batch],
+                                         events.put, timeout, image_dpi, 0 if batch[0] in parts else dpi, fetch)
+                futures[future] = batch
+                pending.add(future)
+            try:
+                handle(events.get(timeout=0.1))
+            except queue.Empty:
+                pass
+            if cancel_event is not None and cancel_event.is_set() and not cancelled:
+                cancelled = True
+                # Batches already on a renderer finish; the rest are dropped
+                for batch in waiting:
+                    for md_path in batch:
+                        results[md_path] = dict(file_result(md_path, error="Cancelled"), backend=routes[md_path].name)
+                        handle(dict(results[md_path], event="failed"))
+                waiting.clear()
+            finished = [f for f in pending if f.done()]
+            # A finished batch has queued all its events; handle them before its results
+            while finished and not events.empty():
+                handle(events.get_nowait())
+            for future in finished:
+                pending.discard(future)
+                _, out, err, batch_results = future.result()
+                with metrics.timer("cache_store"):
+                    for md_path, r in zip(futures[future], batch_results):
+                        results[md_path] = r = dict(r, path=md_path, backend=routes[md_path].name)
+                        if r["ok"] and md_path not in parts:
+                            # A render missing blocked resources is redone once they can be fetched
+                            if not r.get("blocked"):
+                                cache.store(keys[md_path], r["pdf"])
+                            pages[md_path] = pdf_page_count(r["pdf"])
+                all_out += out
+                all_err += err
+                # Transient failures go back to the front of the queue in halves
+                batch = futures.pop(future)
+                suspects = [p for p in batch if p in held]
+                if len(batch) == 1:
+                    # Alone it gets one more try, in case the failure was the renderer's
+                    suspects = [p for p in suspects if p not in ran_alone]
+                    ran_alone.update(batch)
+                groups = split_retry(suspects) if suspects else []
+                if groups and not cancelled and budget >= len(groups):
+                    budget -= len(groups)
+                    for group in reversed(groups):
+                        waiting.appendleft(group)
+                    for md_path in suspects:
+                        results.pop(md_path, None)
+                        attempts[md_path] += 1
+                        metrics.count("retries")
+                        handle({"event": "retry", "path": md_path, "error": held.pop(md_path)["error"], "attempt": attempts[md_path]})
+                for md_path in batch:
+                    if md_path in held:
+                        event = held.pop(md_path)
+                        attempts[md_path] = MAX_ATTEMPTS
+                        handle(event)
+            # A split document is merged once every part has its final result
+            for md_path in [d for d in ready if all(p in results for p in splits[d])]:
+                ready.remove(md_path)
+                merge_split(md_path)
+
+    for pieces in splits.values():
+        remove_parts(pieces)
+    if use_daemon:
+        get_pool().shrink(jobs)
+    failed = sum(1 for p in to_process if not results[p]["ok"])
+    record_manifest(metrics, file_paths, results, keys, pages, index)
+    finish_metrics(metrics, conversion_started, len(file_paths), hits, total_new - failed, failed, jobs=jobs)
+            
+    return failed == 0 and not cancelled, all_out, all_err, total_new, hits, [results[p] for p in file_paths]
+
+def render_batch(backend, batch, documents, on_event, timeout, image_dpi, dpi, network=None):
+    """
+    One batch on a worker thread: reduced copies of the oversized images its
+    `documents` reference, the backend (with the `network` policy), then the
+    optimize stage for each new PDF.
+    """
+    assets = {}
+    if image_dpi:
+        started = time.perf_counter()
+
+        def skipped(path, e):
+            # The original image is rendered instead
+            on_event({"event": "log", "line": f"{path}: not reduced ({type(e).__name__}: {e})"})
+        assets = get_asset_cache().substitutes(documents, get_dependency_index(), image_dpi, skipped)
+        get_metrics().observe("assets", (time.perf_counter() - started) * 1000, files=len(documents), reduced=len(assets))
+    ok, out, err, results = backend.convert_batch(batch, on_event, timeout, assets=assets, network=network)
+    if dpi:
+        results = [optimize_result(r, dpi, on_event) if r["ok"] else r for r in results]
+    return ok, out, err, results
+
+def optimize_result(r, dpi, emit):
+    """Optimize one rendered PDF in place; the result gets its new size and the bytes saved."""
+    try:
+        report = optimize_pdf(r["pdf"], dpi)
+    except Exception as e:
+        # A PDF pikepdf can't rewrite is still a good PDF
+        emit({"event": "log", "line": f"{r['path']}: not optimized ({type(e).__name__}: {e})"})
+        return r
+    emit(dict(report, event="optimized", path=r["path"]))
+    return dict(r, bytes=report["after"], saved=report["before"] - report["after"])
+
+def record_manifest(metrics, file_paths, results, keys, pages, index):
+    """Note converted documents and new store entries in the cache manifest."""
+    entries = [dict(results[p], key=keys[p], digest=index.digest(p), pages=pages.get(p))
+               for p in dict.fromkeys(file_paths) if results[p]["ok"]]
+    manifest = get_manifest()
+    try:
+        with metrics.timer("manifest", documents=len(entries)):
+            manifest.record(entries)
+            manifest.record_renders([e for e in entries if not e["cached"]])
+            manifest.touch_renders([e["key"] for e in entries if e["cached"]])
+    except sqlite3.Error as e:
+        # The manifest only speeds up lookups; a locked or broken one must not fail a conversion
+        metrics.log("manifest_error", error=str(e))
+    get_evictor().request()
+
+def record_render_metrics(metrics, event):
+    """Per-document counters and the worker's stage timings (parse, wait, layout, pdf)."""
+    metrics.count("urls_blocked", len(event.get("blocked", [])))
+    if event["event"] == "failed":
+        metrics.count("documents_failed")
+        metrics.log("failed", path=event["path"], error=event["error"], ms=event["ms"])
+        return
+    metrics.count("documents_rendered")
+    metrics.count("bytes_out", event["bytes"])
+    metrics.observe("render", event["ms"], path=event["path"], bytes=event["bytes"], backend=event.get("backend", "chromium"))
+    for stage, ms in event.get("stages", {}).items():
+        metrics.observe(f"render_{stage}", ms)
+
+def finish_metrics(metrics, started, files, hits, rendered, failed, jobs=0):
+    """Close one conversion: total time, gauges, and a fresh Prometheus file."""
+    metrics.observe("conversion", (time.perf_counter() - started) * 1000,
+                    files=files, hits=hits, rendered=rendered, failed=failed, jobs=jobs)
+    metrics.gauge("queue_batches", 0)
+    metrics.gauge("renderers_alive", get_pool().alive_count())
+    metrics.gauge("child_rss_mb", round(rss_mb(descendant_pids()), 1))
+    metrics.write_prometheus()
+
+def convert_batch(batch, use_daemon=True, on_event=None, timeout=None, assets=None, network=None):
+    """
+    Convert one batch on a pooled warm worker, or with the CLI as fallback.
+    Per-file events go to `on_event` as they happen. `assets` (original image ->
+    reduced copy) and `network` (see modules/offline.py) only apply on the warm
+    workers; the CLI reads the original images and fetches remote resources itself.
+    Returns (ok, stdout, stderr, results) with one result dict per input.
+    """
+    note = ""
+    if use_daemon:
         try:
-            process = subprocess.run(command, shell=True, capture_output=True, text=True)
-            all_out += process.stdout
-            all_err += process.stderr
-            if process.returncode != 0:
-                success_all = False
+            with get_pool().worker() as daemon:
+                results = daemon.render(batch, timeout=timeout or render_timeout(), on_event=on_event, assets=assets,
+                                         network=network)
+            out = "".join(f"{r['pdf']}\n" for r in results if r["ok"])
+            err = "".join(f"{r['path']}: {r['error']}\n" for r in results if not r["ok"])
+            return all(r["ok"] for r in results), out, err, results
         except Exception as e:
-            all_err += f"\nRuntime Error: {str(e)}"
-            success_all = False
-            
-    return success_all, all_out, all_err, total_new, len(skipped)
-
-def create_zip(file_paths, zip_name="converted_docs.zip"):
-    """Create a zip file from list of paths."""
-    zip_path = os.path.join(os.path.dirname(file_paths[0]), zip_name)
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for file in file_paths:
-            if os.path.exists(file):
-                 zipf.write(file, os.path.basename(file))
+            note = f"\nRenderer Error: {str(e)}\nFalling back to md-to-pdf CLI.\n"
+
+    emit = on_event or (lambda event: None)
+    for md_path in batch:
+        emit({"event": "started", "path": md_path})
+
+    started = time.time()
+    ok, out, err = run_cli_batch(batch, on_output=lambda line: emit({"event": "log", "line": line}))
+    elapsed = int((time.time() - started) * 1000)
+
+    # The CLI only reports per batch: a fresh PDF means that file succeeded
+    results = []
+    for md_path in batch:
+        pdf_path = os.path.splitext(md_path)[0] + ".pdf"
+        if os.path.exists(pdf_path) and os.path.getmtime(pdf_path) >= started - 1:
+            r = file_result(md_path, pdf=pdf_path, ms=elapsed, size=os.path.getsize(pdf_path))
+        elif len(batch) > 1:
+            # One bad file can abort the whole CLI run, so this one isn't to blame yet
+            r = file_result(md_path, error=f"{BATCH_ERROR}: {(err or 'md-to-pdf did not produce a PDF').strip()}", ms=elapsed)
+        else:
+            r = file_result(md_path, error=(err or "md-to-pdf did not produce a PDF").strip(), ms=elapsed)
+        results.append(r)
+        emit(dict(r, event="finished" if r["ok"] else "failed"))
+    return ok and all(r["ok"] for r in results), out, note + err, results
+
+def run_cli_batch(batch, on_output=None):
+    """
+    Convert one batch with a fresh `md-to-pdf` CLI process.
+    Output lines are passed to `on_output` as they arrive.
+    """
+    quoted_files = [f'"{f}"' for f in batch]
+    file_args = " ".join(quoted_files)
+
+    env = get_environment()
+    extra_flags = ""
+    if env["launch_options"]:
+        extra_flags = f" --launch-options '{json.dumps(env['launch_options'])}'"
+
+    # Local install if there is one, else npx resolves the pinned md-to-pdf at run time
+    pin = pinned_engine()
+    binary = f'"{env["md_to_pdf_bin"]}"' if env["md_to_pdf_bin"] else f"npx md-to-pdf{'@' + pin if pin else ''}"
+
+    command = f"{binary}{extra_flags} {file_args}"
+
+    try:
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        output = ""
+        for line in process.stdout:
+            output += line
+            if on_output:
+                on_output(line.rstrip())
+        process.wait()
+        if process.returncode == 0:
+            return True, output, ""
+        return False, "", output
+    except Exception as e:
+        return False, "", f"\nRuntime Error: {str(e)}"
+
+def zip_manifest(file_paths):
+    """[arcname, content digest, path] per existing file; repeated names get a ' (n)' suffix."""
+    index = get_dependency_index()
+    seen = {}
+    entries = []
+    for path in file_paths:
+        if not os.path.exists(path):
+            continue
+        name = os.path.basename(path)
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            stem, ext = os.path.splitext(name)
+            name = f"{stem} ({seen[name]}){ext}"
+        entries.append([name, index.digest(path), path])
+    return entries
+
+def zip_key(entries):
+    """Memo key of an archive: the set of (name, content hash) pairs."""
+    members = sorted((name, digest) for name, digest, _ in entries)
+    return hashlib.sha256(json.dumps(members).encode()).hexdigest()[:20]
+
+def find_zip(file_paths):
+    """Path of an already built archive for exactly these files, or None."""
+    zip_path = os.path.join(STATIC_ZIP_DIR, f"{zip_key(zip_manifest(file_paths))}.zip")
+    return zip_path if os.path.exists(zip_path) else None
+
+def zip_volumes(file_paths):
+    """
+    `file_paths` cut, in order, into groups whose archive fits under
+    MAX_STATIC_FILE_SIZE, so every volume is streamed by the static file server.
+    Adding files only changes the last volume. A single file over the limit gets
+    a volume of its own (too large to serve).
+    """
+    volumes, current, size = [], [], 0
+    for path in file_paths:
+        try:
+            # Member size plus room for the local and central directory headers
+            need = os.path.getsize(path) + 2 * (100 + len(os.path.basename(path).encode()))
+        except OSError:
+            continue
+        if current and size + need > MAX_STATIC_FILE_SIZE - 64 * 1024:
+            volumes.append(current)
+            current, size = [], 0
+        current.append(path)
+        size += need
+    return volumes + [current] if current else volumes
+
+def create_zip(file_paths, keep=ZIP_KEEP):
+    """
+    Build (or reuse) the archive for `file_paths`, memoized on names + content hashes.
+    PDFs are already compressed, so members are STORED. When a previous archive
+    holds a subset of the files, it is copied and only the new files are appended;
+    removing files means packing the archive again. The `keep` most recently used
+    archives are kept on disk.
+    """
+    entries = zip_manifest(file_paths)
+    key = zip_key(entries)
+    zip_path = os.path.join(STATIC_ZIP_DIR, f"{key}.zip")
+    manifest_dir = os.path.join(get_fixed_temp_dir(), "zips")
+
+    with _zip_lock:
+        if os.path.exists(zip_path):
+            os.utime(zip_path)
+            return zip_path
+        os.makedirs(STATIC_ZIP_DIR, exist_ok=True)
+        os.makedirs(manifest_dir, exist_ok=True)
+
+        # Largest earlier archive whose members are all still wanted
+        wanted = {(name, digest) for name, digest, _ in entries}
+        base, base_members = None, set()
+        for manifest in glob.glob(os.path.join(manifest_dir, "*.json")):
+            candidate = os.path.join(STATIC_ZIP_DIR, os.path.basename(manifest)[:-5] + ".zip")
+            try:
+                with open(manifest) as f:
+                    members = {tuple(m) for m in json.load(f)}
+            except (OSError, ValueError):
+                continue
+            if os.path.exists(candidate) and members <= wanted and len(members) > len(base_members):
+                base, base_members = candidate, members
+
+        tmp = f"{zip_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        # Copy rather than append in place: the old archive may be mid-download
+        if base:
+            shutil.copyfile(base, tmp)
+        with zipfile.ZipFile(tmp, 'a' if base else 'w', compression=zipfile.ZIP_STORED) as zipf:
+            for name, digest, path in entries:
+                if (name, digest) not in base_members:
+                    zipf.write(path, name)
+        os.replace(tmp, zip_path)
+
+        with open(os.path.join(manifest_dir, f"{key}.json"), "w") as f:
+            json.dump(sorted(wanted), f)
+
+        # Keep only the most recent archives
+        archives = sorted(glob.glob(os.path.join(STATIC_ZIP_DIR, "*.zip")), key=os.path.getmtime, reverse=True)
+        for old in archives[keep:]:
+            os.remove(old)
+            stale = os.path.join(manifest_dir, os.path.basename(old)[:-4] + ".json")
+            if os.path.exists(stale):
+                os.remove(stale)
     return zip_path
 
+def static_url(path):
+    """URL of a file under ./static as served by Streamlit."""
+    return "./app/static/" + os.path.relpath(path, os.path.join(ROOT_DIR, "static")).replace(os.sep, "/")
+
 def get_fixed_temp_dir():
     """Create a persistent temp directory for the project."""
     temp_dir = os.path.join(tempfile.gettempdir(), "md_to_pdf_pro_cache")
@@ -106,11 +644,99 @@ def get_fixed_temp_dir():
         os.makedirs(temp_dir)
     return temp_dir
 
-def display_pdf(file_path):
-    """Embed PDF in Iframe with optimized height and zoom."""
-    with open(file_path, "rb") as f:
-        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
+def get_render_cache():
+    """Content-addressed PDF store inside the persistent temp directory."""
+    return RenderCache(os.path.join(get_fixed_temp_dir(), "store"))
+
+_asset_cache = None
+_asset_cache_lock = threading.Lock()
+
+def get_asset_cache():
+    """Reduced copies of oversized images, inside the persistent temp directory."""
+    global _asset_cache
+    with _asset_cache_lock:
+        if _asset_cache is None:
+            _asset_cache = AssetCache(os.path.join(get_fixed_temp_dir(), "assets"))
+        return _asset_cache
+
+def get_fetch_cache():
+    """Remote resources for the "cache" and "offline" network modes (MD2PDF_FETCH_CACHE, else in the temp directory)."""
+    return FetchCache(os.environ.get("MD2PDF_FETCH_CACHE") or os.path.join(get_fixed_temp_dir(), "fetch"))
+
+def get_upload_store():
+    """Content-addressed uploads with per-session folders, inside the persistent temp directory."""
+    return UploadStore(get_fixed_temp_dir())
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+def get_manifest():
+    """SQLite index of converted documents and cached renders, in the persistent temp directory."""
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = CacheManifest(os.path.join(get_fixed_temp_dir(), "manifest.db"))
+        return _manifest
+
+_evictor = None
+_evictor_lock = threading.Lock()
+
+def get_evictor():
+    """Process-wide LRU eviction for the persistent temp directory (see modules/eviction.py)."""
+    global _evictor
+    with _evictor_lock:
+        if _evictor is None:
+            _evictor = CacheEvictor(get_fixed_temp_dir(), get_manifest(), get_render_cache(), get_upload_store(),
+                                    get_asset_cache(), STATIC_PDF_DIR)
+        return _evictor
+
+_dependency_index = None
+_dependency_lock = threading.Lock()
+
+def get_dependency_index():
+    """Process-wide document -> asset index, persisted next to the render cache."""
+    global _dependency_index
+    with _dependency_lock:
+        if _dependency_index is None:
+            _dependency_index = DependencyIndex(os.path.join(get_fixed_temp_dir(), "deps.json"))
+        return _dependency_index
+
+def published_path(file_path):
+    """Where `publish_pdf` puts a PDF under ./static (named by content hash)."""
+    return os.path.join(STATIC_PDF_DIR, f"{get_dependency_index().digest(file_path)[:20]}.pdf")
+
+def publish_pdf(file_path):
+    """
+    Expose a PDF through Streamlit's static file server and return its URL.
+    Files are named by content hash, so the URL changes only when the PDF does
+    and the browser can keep its cached copy across reruns.
+    """
+    dest = published_path(file_path)
+    if not os.path.exists(dest):
+        os.makedirs(STATIC_PDF_DIR, exist_ok=True)
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        # Streamlit refuses symlinks that leave ./static, so hard link or copy
+        try:
+            os.link(file_path, tmp)
+        except OSError:
+            shutil.copyfile(file_path, tmp)
+        os.replace(tmp, dest)
+    return static_url(dest)
+
+def display_pdf(file_path, owner=None):
+    """
+    Embed PDF in Iframe with optimized height and zoom. With `owner` (a session
+    id), the published link is leased to it so eviction keeps it while shown.
+    """
+    import streamlit as st  # only the web UI needs it; keeps md_to_pdf.py free of Streamlit
+    
+    if owner:
+        # Leased before publishing, so an eviction pass can't remove the fresh link
+        get_evictor().lease((owner, "viewer"), [published_path(file_path)], ttl=LEASE_TTL)
+    # The browser fetches the file itself (range requests, ETag revalidation),
+    # so only this short tag goes over the websocket on each rerun.
+    url = publish_pdf(file_path)
     
     # Use #view=FitH to make PDF page fill the iframe width horizontally
-    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}#view=FitH" class="pdf-viewer-frame"></iframe>'
+    pdf_display = f'<iframe src="{url}#view=FitH" class="pdf-viewer-frame"></iframe>'
     st.markdown(pdf_display, unsafe_allow_html=True)
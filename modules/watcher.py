@@ -0,0 +1,158 @@
+import os
+import time
+import threading
+from collections import deque
+
+from modules.file_index import FileIndex, Observer, FileSystemEventHandler
+from modules.utils import run_conversion_command, get_dependency_index
+from modules.split import is_part
+
+DEBOUNCE_SECONDS = 0.5  # quiet time after the last event before rendering
+MAX_DELAY_SECONDS = 5   # render anyway if events never stop for this long
+HISTORY_KEPT = 20
+
+class WatchSession:
+    """
+    Re-renders markdown under `root` when it (or an asset it references) changes.
+
+    Filesystem events are collected into a set, so repeated saves of the same file
+    coalesce, and flushed once the folder has been quiet for `debounce` seconds.
+    Only the affected documents go to `run_conversion_command`, whose content
+    cache turns saves without real changes into hits; the render workers stay warm
+    between flushes. `options` are further `run_conversion_command` keyword
+    arguments (timeout, retries, split, optimize, images, network).
+    """
+
+    def __init__(self, root, patterns=None, use_gitignore=True, concurrency=None,
+                 debounce=DEBOUNCE_SECONDS, on_result=None, options=None):
+        self.root = os.path.abspath(root)
+        self.concurrency = concurrency
+        self.options = dict(options or {})
+        self.debounce = debounce
+        self.on_result = on_result
+        self.history = deque(maxlen=HISTORY_KEPT)
+        self.rules = FileIndex(self.root, patterns, use_gitignore).rules
+        self._pending = set()
+        self._first_event = None
+        self._last_event = None
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._observer = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if Observer is None:
+            raise RuntimeError("Watch mode needs the 'watchdog' package (pip install -r requirements.txt).")
+        self._observer = Observer()
+        self._observer.schedule(_WatchHandler(self), self.root, recursive=True)
+        self._observer.start()
+        self._thread = threading.Thread(target=self._loop, name="md2pdf-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+
+    def notify(self, path):
+        """Record a changed path (called from the watchdog thread)."""
+        path = os.path.abspath(path)
+        lower = path.lower()
+        # Our own output (PDFs, worker temp files, parts of split documents) must not trigger another render
+        if lower.endswith((".pdf", ".tmp")) or is_part(path):
+            return
+        rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+        if rel.startswith("../") or self.rules.ignored(rel):
+            return
+        now = time.monotonic()
+        with self._cond:
+            if not self._pending:
+                self._first_event = now
+            self._pending.add(path)
+            self._last_event = now
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                # Trailing-edge debounce, bounded so a constant stream still renders
+                while not self._stopped:
+                    now = time.monotonic()
+                    wait = min(self._last_event + self.debounce, self._first_event + MAX_DELAY_SECONDS) - now
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if self._stopped:
+                    return
+                changed, self._pending = self._pending, set()
+            try:
+                self.flush(changed)
+            except Exception as e:
+                self.history.append({"time": time.time(), "files": [], "results": [], "error": str(e)})
+
+    def flush(self, changed):
+        """Render the documents affected by a set of changed paths."""
+        index = get_dependency_index()
+        for path in changed:
+            if not os.path.exists(path):
+                index.forget(path)
+        docs = [d for d in index.affected_documents(changed)
+                if os.path.isfile(d) and d.startswith(self.root + os.sep)
+                and not self.rules.ignored(os.path.relpath(d, self.root).replace(os.sep, "/"))]
+        if not docs:
+            return None
+
+        success, out, err, misses, hits, results = run_conversion_command(docs, concurrency=self.concurrency,
+                                                                          **self.options)
+        run = {"time": time.time(), "files": docs, "results": results, "misses": misses, "hits": hits,
+               "error": None if success else err}
+        self.history.append(run)
+        if self.on_result:
+            self.on_result(run)
+        return run
+
+class _WatchHandler(FileSystemEventHandler):
+    def __init__(self, session):
+        self.session = session
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in ("created", "modified", "deleted", "moved"):
+            return
+        self.session.notify(event.src_path)
+        dest = getattr(event, "dest_path", None)
+        if dest:
+            self.session.notify(dest)
+
+_watches = {}
+_watches_lock = threading.Lock()
+
+def start_watch(root, **options):
+    """Start (or return the running) watch session for a folder; shared across sessions."""
+    root = os.path.abspath(root)
+    get_dependency_index().add_root(root)
+    with _watches_lock:
+        session = _watches.get(root)
+        if session is None or not session.running:
+            session = WatchSession(root, **options)
+            session.start()
+            _watches[root] = session
+        return session
+
+def stop_watch(root):
+    with _watches_lock:
+        session = _watches.pop(os.path.abspath(root), None)
+    if session:
+        session.stop()
+
+def get_watch(root):
+    session = _watches.get(os.path.abspath(root))
+    return session if session and session.running else None
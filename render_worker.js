@@ -0,0 +1,398 @@
+#!/usr/bin/env node
+// Persistent md-to-pdf render worker.
+//
+// Keeps one Chromium instance and a small pool of pages warm, and takes
+// newline-delimited JSON jobs on stdin. Every message written to stdout is a
+// single JSON object, so anything else (logs, puppeteer warnings) goes to stderr.
+//
+//   -> {"id": 1, "op": "render", "files": ["/abs/a.md"], "basedir": "/abs", "timeout": 120000,
+//       "assets": {"/abs/photo.jpg": "/cache/assets/ab/ab12...-300.jpg"},
+//       "network": {"mode": "offline", "cache": "/cache/fetch"}}
+//   <- {"id": 1, "event": "started",  "path": "/abs/a.md"}
+//   <- {"id": 1, "event": "finished", "path": "/abs/a.md", "pdf": "/abs/a.pdf", "ms": 812, "bytes": 48213}
+//   <- {"id": 1, "event": "failed",   "path": "/abs/a.md", "error": "..."}
+//      (both may carry "blocked": [urls] that the network mode refused)
+//   <- {"id": 1, "event": "done"}
+'use strict';
+
+const crypto = require('crypto');
+const fs = require('fs');
+const http = require('http');
+const path = require('path');
+const readline = require('readline');
+
+// All declared in package.json. md-to-pdf is pinned to an exact version:
+// dist/lib is its internal layout, not a public API
+const puppeteer = require('puppeteer');
+const grayMatter = require('gray-matter');
+const { defaultConfig } = require('md-to-pdf/dist/lib/config');
+const { getHtml } = require('md-to-pdf/dist/lib/get-html');
+
+console.log = console.error;
+
+const MAX_PAGES = Math.max(1, Number(process.env.MD2PDF_PAGES || 2));
+const LAUNCH_OPTIONS = JSON.parse(process.env.MD2PDF_LAUNCH_OPTIONS || '{}');
+const ENGINE_VERSION = require('md-to-pdf/package.json').version;
+
+const MIME_TYPES = {
+	'.css': 'text/css',
+	'.gif': 'image/gif',
+	'.htm': 'text/html',
+	'.html': 'text/html',
+	'.jpeg': 'image/jpeg',
+	'.jpg': 'image/jpeg',
+	'.js': 'text/javascript',
+	'.md': 'text/plain; charset=utf-8',
+	'.otf': 'font/otf',
+	'.png': 'image/png',
+	'.svg': 'image/svg+xml',
+	'.ttf': 'font/ttf',
+	'.webp': 'image/webp',
+	'.woff': 'font/woff',
+	'.woff2': 'font/woff2',
+};
+
+function send(message) {
+	process.stdout.write(JSON.stringify(message) + '\n');
+}
+
+// --- Asset server -----------------------------------------------------------
+// Relative images and stylesheets are resolved the same way md-to-pdf does it:
+// the page is first navigated to the markdown file on a local HTTP origin.
+// Each base directory gets its own opaque prefix so only those trees are served.
+// A job's "assets" (reduced copies of oversized images) are served in place of
+// the originals under a prefix of their own, dropped when the file is done.
+
+const roots = new Map(); // token -> { dir, assets }
+const rootTokens = new Map();
+let jobRoots = 0;
+
+function rootToken(dir, assets) {
+	if (assets) {
+		const token = `j${jobRoots++}`;
+		roots.set(token, { dir, assets });
+		return token;
+	}
+	if (!rootTokens.has(dir)) {
+		const token = `r${rootTokens.size}`;
+		rootTokens.set(dir, token);
+		roots.set(token, { dir, assets: null });
+	}
+	return rootTokens.get(dir);
+}
+
+const server = http.createServer((req, res) => {
+	const url = new URL(req.url, 'http://127.0.0.1');
+	const [, token, ...rest] = url.pathname.split('/');
+	const root = roots.get(token);
+	const file = root && path.resolve(root.dir, decodeURIComponent(rest.join('/')));
+
+	if (!file || (file !== root.dir && !file.startsWith(root.dir + path.sep))) {
+		res.writeHead(404);
+		res.end();
+		return;
+	}
+	const served = (root.assets && root.assets[file]) || file;
+
+	fs.stat(served, (err, stat) => {
+		if (err || !stat.isFile()) {
+			res.writeHead(404);
+			res.end();
+			return;
+		}
+		res.writeHead(200, {
+			'Content-Type': MIME_TYPES[path.extname(file).toLowerCase()] || 'application/octet-stream',
+			'Content-Length': stat.size,
+		});
+		fs.createReadStream(served).pipe(res);
+	});
+});
+
+function serverUrl(token, basedir, file) {
+	const relative = path.relative(basedir, file).split(path.sep).map(encodeURIComponent).join('/');
+	return `http://127.0.0.1:${server.address().port}/${token}/${relative}`;
+}
+
+// --- Remote resources -------------------------------------------------------
+// In "cache" mode remote URLs are answered from the fetch cache and whatever had
+// to be downloaded is stored; "offline" answers hits and aborts misses at once
+// instead of waiting on a network that isn't there. The layout is shared with
+// modules/offline.py: <cache>/<2 hex>/<sha256 of url> plus a .json sidecar.
+
+function cachePath(dir, url) {
+	const digest = crypto.createHash('sha256').update(url).digest('hex');
+	return path.join(dir, digest.slice(0, 2), digest);
+}
+
+async function readCached(dir, url) {
+	const body = cachePath(dir, url);
+	try {
+		const meta = JSON.parse(await fs.promises.readFile(`${body}.json`, 'utf-8'));
+		return { body: await fs.promises.readFile(body), contentType: meta.content_type };
+	} catch {
+		return null;
+	}
+}
+
+async function writeCached(dir, url, data, contentType) {
+	const body = cachePath(dir, url);
+	const suffix = `.${process.pid}.tmp`;
+	await fs.promises.mkdir(path.dirname(body), { recursive: true });
+	await fs.promises.writeFile(body + suffix, data);
+	await fs.promises.rename(body + suffix, body);
+	// The sidecar goes last: readers treat a body without one as a miss
+	await fs.promises.writeFile(`${body}.json${suffix}`, JSON.stringify({ url, content_type: contentType }));
+	await fs.promises.rename(`${body}.json${suffix}`, `${body}.json`);
+}
+
+function isRemote(url) {
+	return /^https?:\/\//.test(url) && !url.startsWith(`http://127.0.0.1:${server.address().port}/`);
+}
+
+// `page.md2pdf` holds the current file's network settings and what was blocked
+function interceptRequest(page, request) {
+	const state = page.md2pdf;
+	if (!state || !state.intercepting) {
+		return;
+	}
+	const url = request.url();
+	if (!isRemote(url)) {
+		request.continue().catch(() => {});
+		return;
+	}
+	readCached(state.network.cache, url).then((hit) => {
+		if (hit) {
+			state.served.add(url);
+			return request.respond({ status: 200, contentType: hit.contentType || undefined, body: hit.body });
+		}
+		if (state.network.mode === 'offline') {
+			state.blocked.push(url);
+			return request.abort('blockedbyclient');
+		}
+		return request.continue();
+	}).catch(() => {});
+}
+
+function storeResponse(page, response) {
+	const state = page.md2pdf;
+	const url = response.url();
+	if (!state || state.network.mode !== 'cache' || state.served.has(url) || !isRemote(url) || !response.ok()) {
+		return;
+	}
+	response.buffer()
+		.then((data) => writeCached(state.network.cache, url, data, response.headers()['content-type'] || null))
+		.catch(() => {});
+}
+
+async function newPage() {
+	const page = await browser.newPage();
+	page.on('request', (request) => interceptRequest(page, request));
+	page.on('response', (response) => storeResponse(page, response));
+	return page;
+}
+
+// --- Page pool --------------------------------------------------------------
+
+let browser;
+const idlePages = [];
+const waiters = [];
+let openPages = 0;
+
+async function acquirePage() {
+	if (idlePages.length > 0) {
+		return idlePages.pop();
+	}
+	if (openPages < MAX_PAGES) {
+		openPages++;
+		return newPage();
+	}
+	return new Promise((resolve) => waiters.push(resolve));
+}
+
+function releasePage(page, broken) {
+	if (broken) {
+		openPages--;
+		page.close().catch(() => {});
+		if (waiters.length > 0) {
+			openPages++;
+			newPage().then(waiters.shift());
+		}
+		return;
+	}
+	const waiter = waiters.shift();
+	if (waiter) {
+		waiter(page);
+	} else {
+		idlePages.push(page);
+	}
+}
+
+// --- Rendering --------------------------------------------------------------
+
+function highlightStylesheet(style) {
+	try {
+		return path.resolve(path.dirname(require.resolve('highlight.js')), '..', 'styles', `${style}.css`);
+	} catch {
+		return null;
+	}
+}
+
+function buildConfig(file, frontMatter) {
+	const config = {
+		...defaultConfig,
+		...frontMatter,
+		pdf_options: { ...defaultConfig.pdf_options, ...frontMatter.pdf_options },
+	};
+	const dir = path.dirname(file);
+	const stylesheets = [].concat(config.stylesheet || []).map((s) => (/^https?:\/\//.test(s) ? s : path.resolve(dir, s)));
+	const highlight = highlightStylesheet(config.highlight_style);
+	if (highlight) {
+		stylesheets.push(highlight);
+	}
+	config.stylesheet = [...new Set(stylesheets)];
+	return config;
+}
+
+// Resolves to { pdf, stages } where stages are milliseconds spent in:
+// parse (markdown -> HTML), wait (for a free page), layout (load, styles, fonts), pdf (print + write)
+async function renderFile(file, basedir, timeout, assets, network) {
+	const stages = {};
+	let mark = Date.now();
+	const lap = (name) => {
+		const now = Date.now();
+		stages[name] = now - mark;
+		mark = now;
+	};
+
+	const source = await fs.promises.readFile(file, 'utf-8');
+	const { content, data } = grayMatter(source);
+	const config = buildConfig(file, data || {});
+	const html = getHtml(content, config);
+	const dest = file.replace(/\.(md|markdown)$/i, '') + '.pdf';
+	const tmp = `${dest}.${process.pid}.tmp`;
+	lap('parse');
+
+	const token = rootToken(basedir, assets);
+	const page = await acquirePage();
+	lap('wait');
+	const state = { network, intercepting: network.mode !== 'online', blocked: [], served: new Set() };
+	page.md2pdf = state;
+	let broken = false;
+	let timer;
+	const work = (async () => {
+		page.setDefaultTimeout(timeout);
+		await page.setRequestInterception(state.intercepting);
+		await page.goto(serverUrl(token, basedir, file));
+		await page.setContent(html, { waitUntil: 'networkidle0' });
+		for (const stylesheet of config.stylesheet) {
+			const remote = /^https?:\/\//.test(stylesheet);
+			await page.addStyleTag(remote ? { url: stylesheet } : { path: stylesheet }).catch((error) => {
+				// A blocked stylesheet is reported, not fatal
+				if (!state.blocked.includes(stylesheet)) {
+					throw error;
+				}
+			});
+		}
+		if (config.css) {
+			await page.addStyleTag({ content: config.css });
+		}
+		await page.evaluate(() => document.fonts.ready);
+		await page.emulateMediaType(config.page_media_type);
+		lap('layout');
+		await page.pdf({ ...config.pdf_options, path: tmp, timeout });
+		await fs.promises.rename(tmp, dest);
+		lap('pdf');
+	})();
+	// Hard per-file deadline: a hung layout or remote resource costs only this
+	// file's timeout. The page is closed (which aborts whatever it was doing)
+	// and replaced, so the other pages keep working.
+	const deadline = new Promise((_, reject) => {
+		timer = setTimeout(() => reject(new Error(`Timed out after ${Math.round(timeout / 1000)}s`)), timeout);
+	});
+	try {
+		await Promise.race([work, deadline]);
+		return { pdf: dest, stages, blocked: state.blocked };
+	} catch (error) {
+		error.blocked = state.blocked;
+		broken = true;
+		work.catch(() => {});
+		fs.promises.unlink(tmp).catch(() => {});
+		throw error;
+	} finally {
+		clearTimeout(timer);
+		page.md2pdf = null;
+		releasePage(page, broken);
+		if (assets) {
+			roots.delete(token);
+		}
+	}
+}
+
+async function handleRender(job) {
+	const timeout = job.timeout || 120000;
+	const queue = job.files.slice();
+	const assets = job.assets && Object.keys(job.assets).length > 0 ? job.assets : null;
+	const network = job.network || { mode: 'online' };
+
+	async function drain() {
+		while (queue.length > 0) {
+			const file = queue.shift();
+			const dir = path.dirname(file);
+			const basedir = job.basedir && file.startsWith(job.basedir + path.sep) ? job.basedir : dir;
+			const started = Date.now();
+			send({ id: job.id, event: 'started', path: file });
+			try {
+				const { pdf, stages, blocked } = await renderFile(file, basedir, timeout, assets, network);
+				const { size } = await fs.promises.stat(pdf);
+				send({ id: job.id, event: 'finished', path: file, pdf, ms: Date.now() - started, bytes: size, stages, ...(blocked.length ? { blocked } : {}) });
+			} catch (error) {
+				const blocked = (error && error.blocked) || [];
+				send({ id: job.id, event: 'failed', path: file, error: String((error && error.message) || error), ms: Date.now() - started, ...(blocked.length ? { blocked } : {}) });
+			}
+		}
+	}
+
+	await Promise.all(Array.from({ length: Math.min(MAX_PAGES, queue.length) }, drain));
+	send({ id: job.id, event: 'done' });
+}
+
+async function main() {
+	await new Promise((resolve) => server.listen(0, '127.0.0.1', resolve));
+
+	const nodeMs = Math.round(process.uptime() * 1000);
+	const launchStarted = Date.now();
+	browser = await puppeteer.launch({ ...LAUNCH_OPTIONS });
+	browser.on('disconnected', () => {
+		console.error('[render_worker] Chromium disconnected, exiting.');
+		process.exit(1);
+	});
+	send({ event: 'ready', pid: process.pid, version: ENGINE_VERSION, node_ms: nodeMs, launch_ms: Date.now() - launchStarted });
+
+	const input = readline.createInterface({ input: process.stdin });
+	input.on('line', (line) => {
+		if (!line.trim()) {
+			return;
+		}
+		let job;
+		try {
+			job = JSON.parse(line);
+		} catch (error) {
+			console.error(`[render_worker] Bad request: ${line}`);
+			return;
+		}
+		if (job.op === 'render') {
+			handleRender(job).catch((error) => send({ id: job.id, event: 'error', error: String(error) }));
+		} else if (job.op === 'ping') {
+			send({ id: job.id, event: 'pong' });
+		}
+	});
+	input.on('close', async () => {
+		await browser.close().catch(() => {});
+		process.exit(0);
+	});
+}
+
+main().catch((error) => {
+	console.error(`[render_worker] ${(error && error.stack) || error}`);
+	process.exit(1);
+});
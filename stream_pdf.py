@@ -1,7 +1,9 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import tempfile
 import sys
 import os
+import uuid
 
 # Ensure we can import from modules
 sys.path.append(os.getcwd())
@@ -20,24 +22,50 @@ st.set_page_config(
 # Apply Styles
 st.markdown(PREMIUM_STYLE, unsafe_allow_html=True)
 
-from modules.utils import get_fixed_temp_dir
-import glob
+from modules.utils import get_evictor, get_fixed_temp_dir, get_manifest, get_upload_store
+from modules.eviction import LEASE_TTL
+from modules.uploads import SESSION_ID
+from modules.renderer import start_warm_up
+
+# Once per server process: dependencies and a renderer come up in the background
+start_warm_up()
 
 # --- SESSION STATE & PERSISTENCE ---
+SESSION_COOKIE = "md2pdf_session"
+SESSION_COOKIE_DAYS = 30
+
+# Each browser uploads into its own folder. The id is the only key to those files, so it lives
+# in a cookie (kept across reloads, never part of a link someone might share), not in the URL
+if 'session_id' not in st.session_state:
+    session_id = st.context.cookies.get(SESSION_COOKIE, "")
+    st.session_state.new_session = not SESSION_ID.match(session_id)
+    st.session_state.session_id = uuid.uuid4().hex if st.session_state.new_session else session_id
+if st.session_state.new_session:
+    # Streamlit can't set cookies itself; the component iframe shares the app's origin. Sent on
+    # every run of a new session, in case a rerun replaced the page before the first one loaded
+    components.html(
+        f"<script>parent.document.cookie = '{SESSION_COOKIE}={st.session_state.session_id}; path=/; SameSite=Strict; "
+        f"max-age={SESSION_COOKIE_DAYS * 86400}' + (parent.location.protocol === 'https:' ? '; Secure' : '');</script>",
+        height=0)
+# Links from before the cookie carried the id; don't keep it in the address bar
+if "session" in st.query_params:
+    del st.query_params["session"]
 if 'temp_dir' not in st.session_state:
-    st.session_state.temp_dir = get_fixed_temp_dir()
+    st.session_state.temp_dir = get_upload_store().session_dir(st.session_state.session_id)
+
+RESTORE_LIMIT = 500  # most recently used uploads listed in a new session
 
 # Auto-load existing PDFs from temp dir to survive reloads
 if 'processed_files' not in st.session_state:
-    st.session_state.processed_files = []
-    # Scan for md and pdf pairs
-    md_files = glob.glob(os.path.join(st.session_state.temp_dir, "*.md"))
-    results = []
-    for md_p in md_files:
-        pdf_p = os.path.splitext(md_p)[0] + ".pdf"
-        if os.path.exists(pdf_p):
-            results.append((md_p, pdf_p))
-    st.session_state.processed_files = results
+    # One indexed query instead of scanning the temp dir (older caches are imported once)
+    manifest = get_manifest()
+    # Uploads from before per-session folders are only imported so eviction can clean them up
+    manifest.import_folder(get_fixed_temp_dir())
+    rows = manifest.documents(st.session_state.temp_dir, limit=RESTORE_LIMIT)
+    st.session_state.processed_files = [(row["md_path"], row["pdf_path"]) for row in rows]
+
+# Files this session lists stay on disk while it is open (see modules/eviction.py)
+get_evictor().lease(st.session_state.session_id, [p for pair in st.session_state.processed_files for p in pair], ttl=LEASE_TTL)
 
 if 'current_view' not in st.session_state:
     st.session_state.current_view = "home"